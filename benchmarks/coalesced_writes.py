@@ -0,0 +1,139 @@
+"""frames against transport writes on the outbound paths
+
+Runs a server and one client over loopback TCP in this process and counts,
+with the sec_sem8_frames_per_write histogram, how many writes (each at most
+one send syscall) carried how many frames:
+
+    python -m benchmarks.coalesced_writes --messages 2000 --size 1000000
+
+Before writes were coalesced every frame was a write of its own, so writes
+per frame was 1 in every scenario.
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+import typer
+from pydantic import BaseModel
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from sec_sem8.bench import BENCH_DIFFIE_PARAMS, provision_users
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.connection.limits import ConnectionLimits
+from sec_sem8.connection.outbound import frames_per_write
+from sec_sem8.entities import DEFAULT_ROOM, Message, ReadRequest, User, WriteRequest
+from sec_sem8.impl import SqliteDatabase
+from sec_sem8.server import ChatServer, RealWorld
+
+
+class WritePathResult(BaseModel):
+    scenario: str
+    side: str
+    frames: int
+    writes: int
+    seconds: float
+
+    @property
+    def writes_per_frame(self) -> float:
+        return self.writes / self.frames if self.frames else 0.0
+
+
+def _totals(side: str) -> tuple[int, int]:
+    child = frames_per_write.labels(side)
+    return int(child.sum), sum(child.counts)
+
+
+async def _scenario(name: str, side: str, run) -> WritePathResult:
+    frames, writes = _totals(side)
+    started = time.perf_counter()
+    await run()
+    elapsed = time.perf_counter() - started
+    frames_after, writes_after = _totals(side)
+    return WritePathResult(
+        scenario=name,
+        side=side,
+        frames=frames_after - frames,
+        writes=writes_after - writes,
+        seconds=elapsed,
+    )
+
+
+async def _measure(
+    world: RealWorld, user: User, messages: int, size: int
+) -> list[WritePathResult]:
+    limits = ConnectionLimits(
+        max_connections=None,
+        max_connections_per_ip=None,
+        handshake_rate_per_ip=None,
+        handshake_rate_per_user=None,
+        max_loop_lag=None,
+    )
+    server = ChatServer(world, verbose=False, limits=limits)
+    for i in range(messages):
+        server.history.append(
+            Message(author="bench", content=f"message {i}"), DEFAULT_ROOM
+        )
+    tcp = await server.start("127.0.0.1", 0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    async with tcp:
+        connection = ActiveConnection(user, port=port)  # type: ignore
+        await connection.connect()
+        await connection.handshake()
+
+        async def read_history():
+            await connection.write(ReadRequest().json())
+            await connection.read()
+
+        async def write_large():
+            await connection.write(WriteRequest(content="x" * size).json())
+            await connection.read()
+
+        results = [
+            await _scenario("read history", "server", read_history),
+            await _scenario("write large message", "client", write_large),
+        ]
+        await connection.say_goodbye()
+        # let the server side see the goodbye before asyncio.run cancels it
+        for _ in range(100):
+            if len(asyncio.all_tasks()) == 1:
+                break
+            await asyncio.sleep(0.01)
+    return results
+
+
+def run_benchmark(messages: int, size: int) -> list[WritePathResult]:
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "users.sqlite")
+        (user,) = provision_users(db_path, 1)
+        world = RealWorld(SqliteDatabase(db_path), BENCH_DIFFIE_PARAMS)
+        return asyncio.run(_measure(world, user, messages, size))
+
+
+console = Console()
+
+
+def main(
+    messages: int = typer.Option(2000, help="messages in history to read back"),
+    size: int = typer.Option(1_000_000, help="characters in the written message"),
+):
+    table = Table(
+        "scenario", "side", "frames", "writes", "writes/frame", "s", box=box.ROUNDED
+    )
+    for result in run_benchmark(messages, size):
+        table.add_row(
+            result.scenario,
+            result.side,
+            str(result.frames),
+            str(result.writes),
+            f"{result.writes_per_frame:.2f}",
+            f"{result.seconds:.3f}",
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    typer.run(main)
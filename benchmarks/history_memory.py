@@ -0,0 +1,166 @@
+"""memory per message of the in-memory history
+
+Fills a list of Message objects, the layout history used to have, and the
+columnar History with the same messages and reports traced bytes per
+message:
+
+    python -m benchmarks.history_memory --messages 1000000 --content-size 64
+
+Contents are random words from a fixed vocabulary, so the search index has
+as many posting list entries as real chat would. The index is also built on
+its own, its share of the columnar bytes is reported separately.
+"""
+import gc
+import random
+import string
+import tracemalloc
+from typing import Callable
+
+import typer
+from pydantic import BaseModel
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from sec_sem8.entities import Message
+from sec_sem8.history import History
+from sec_sem8.search import RoomIndex
+
+
+class LayoutMemory(BaseModel):
+    bytes_per_message: float
+    overhead_per_message: float
+    """bytes per message beyond utf-8 content"""
+
+
+class HistoryMemoryResult(BaseModel):
+    messages: int
+    content_size: int
+    authors: int
+    vocabulary: int
+    objects: LayoutMemory
+    columnar: LayoutMemory
+    """search index included"""
+    index_bytes_per_message: float
+
+
+def _vocabulary(size: int, rng: random.Random) -> list[str]:
+    words: set[str] = set()
+    while len(words) < size:
+        length = rng.randint(2, 9)
+        words.add("".join(rng.choices(string.ascii_lowercase, k=length)))
+    return sorted(words)
+
+
+def _messages(count: int, content_size: int, authors: int, vocabulary: int):
+    """the same messages on every call"""
+    rng = random.Random(0)
+    words = _vocabulary(vocabulary, rng)
+    for i in range(count):
+        content = rng.choice(words)
+        while len(content) < content_size:
+            word = rng.choice(words)
+            if len(content) + 1 + len(word) > content_size:
+                break
+            content += " " + word
+        yield Message(author=f"user-{i % authors}", content=content)
+
+
+def traced_bytes(fill: Callable[[], object]) -> int:
+    """bytes still allocated by fill() once it returns, while its result lives"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = fill()
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del kept
+    return after - before
+
+
+def measure(
+    messages: int, content_size: int, authors: int, vocabulary: int = 50_000
+) -> HistoryMemoryResult:
+    def generate():
+        return _messages(messages, content_size, authors, vocabulary)
+
+    def objects():
+        return list(generate())
+
+    def columnar():
+        history = History()
+        for message in generate():
+            history.append(message)
+        return history
+
+    def index():
+        room_index = RoomIndex()
+        for position, message in enumerate(generate()):
+            room_index.add(position, position % authors, message.content)
+        return room_index
+
+    # whole words only, so contents are a little shorter than content_size
+    content_bytes = sum(len(message.content) for message in generate()) / messages
+
+    def layout(total: int) -> LayoutMemory:
+        per_message = total / messages
+        return LayoutMemory(
+            bytes_per_message=per_message,
+            overhead_per_message=per_message - content_bytes,
+        )
+
+    return HistoryMemoryResult(
+        messages=messages,
+        content_size=content_size,
+        authors=authors,
+        vocabulary=vocabulary,
+        objects=layout(traced_bytes(objects)),
+        columnar=layout(traced_bytes(columnar)),
+        index_bytes_per_message=traced_bytes(index) / messages,
+    )
+
+
+console = Console()
+
+
+def main(
+    messages: int = typer.Option(200_000, help="messages to store"),
+    content_size: int = typer.Option(64, help="most ascii characters per message"),
+    authors: int = typer.Option(100, help="distinct authors"),
+    vocabulary: int = typer.Option(50_000, help="distinct words in contents"),
+):
+    result = measure(messages, content_size, authors, vocabulary)
+    index = result.index_bytes_per_message
+    table = Table(
+        "layout", "bytes/message", "overhead", "messages/GiB", box=box.ROUNDED
+    )
+    columnar = result.columnar
+    rows = [
+        (
+            "objects",
+            result.objects.bytes_per_message,
+            result.objects.overhead_per_message,
+        ),
+        ("columnar", columnar.bytes_per_message, columnar.overhead_per_message),
+        ("  search index", index, index),
+        (
+            "  without index",
+            columnar.bytes_per_message - index,
+            columnar.overhead_per_message - index,
+        ),
+    ]
+    for name, per_message, overhead in rows:
+        table.add_row(
+            name,
+            f"{per_message:.1f}",
+            f"{overhead:.1f}",
+            f"{2**30 / per_message / 1e6:.1f}M",
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,136 @@
+"""memory held by idle established sessions in one server process
+
+Opens sessions against an in-process ChatServer over the memory transport,
+so no file descriptors are needed, and reports traced bytes per session:
+
+    python -m benchmarks.idle_sessions --sessions 100000
+
+Clients keep only their end of the pipe after the handshake. The client half
+of the pipe is measured on its own with sessions that never handshake, and
+subtracted, so the result is what the server holds for one idle session.
+"""
+import asyncio
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+import typer
+from pydantic import BaseModel
+from rich.console import Console
+
+from sec_sem8.bench import BENCH_DIFFIE_PARAMS, provision_users
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.connection.limits import ConnectionLimits
+from sec_sem8.connection.transport import memory_connector, open_memory_connection
+from sec_sem8.entities import User
+from sec_sem8.impl import SqliteDatabase
+from sec_sem8.server import ChatServer, RealWorld
+
+WARMUP_SESSIONS = 100
+
+
+class IdleSessionsResult(BaseModel):
+    sessions: int
+    bytes_per_session: float
+    """server side, client end of the pipe excluded"""
+    pipe_bytes: float
+    """both ends of a bare memory pipe"""
+    open_seconds: float
+
+
+async def _open_pipes(count: int) -> list:
+    async def idle(reader, writer):
+        pass
+
+    return [(await open_memory_connection(idle))[1] for _ in range(count)]
+
+
+async def _open_sessions(server: ChatServer, user: User, count: int) -> list:
+    connector = memory_connector(server.handle_client, server.limits.max_frame_size)
+    writers = []
+    for _ in range(count):
+        connection = ActiveConnection(user, connector=connector)  # type: ignore
+        await connection.connect()
+        await connection.handshake()
+        writers.append(connection.writer)
+    await asyncio.sleep(0)  # let handlers reach their idle read
+    return writers
+
+
+def _traced(open_all) -> tuple[int, list]:
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = open_all()
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] - before, kept
+
+
+def measure(sessions: int) -> IdleSessionsResult:
+    limits = ConnectionLimits(
+        max_connections=None,
+        max_connections_per_ip=None,
+        handshake_rate_per_ip=None,
+        handshake_rate_per_user=None,
+        max_loop_lag=None,
+    )
+    loop = asyncio.new_event_loop()
+    kept: list = []
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "users.sqlite")
+        (user,) = provision_users(db_path, 1)
+        world = RealWorld(SqliteDatabase(db_path), BENCH_DIFFIE_PARAMS)
+        server = ChatServer(world, verbose=False, limits=limits)
+
+        # first sessions fill caches and free lists, keep them out of the numbers
+        kept += loop.run_until_complete(_open_sessions(server, user, WARMUP_SESSIONS))
+        kept += loop.run_until_complete(_open_pipes(WARMUP_SESSIONS))
+        # everything stays open until the end, so nothing freed in between
+        # is subtracted from the next measurement
+        tracemalloc.start()
+        try:
+            started = time.perf_counter()
+            total, opened = _traced(
+                lambda: loop.run_until_complete(_open_sessions(server, user, sessions))
+            )
+            elapsed = time.perf_counter() - started
+            kept += opened
+            pipes, opened = _traced(
+                lambda: loop.run_until_complete(_open_pipes(sessions))
+            )
+            kept += opened
+        finally:
+            tracemalloc.stop()
+            # sessions end on EOF, cancelling handler tasks makes asyncio complain
+            for writer in kept:
+                writer.close()
+            tasks = asyncio.all_tasks(loop)
+            if tasks:
+                loop.run_until_complete(asyncio.wait(tasks))
+            loop.close()
+
+    return IdleSessionsResult(
+        sessions=sessions,
+        bytes_per_session=(total - pipes / 2) / sessions,
+        pipe_bytes=pipes / sessions,
+        open_seconds=elapsed,
+    )
+
+
+console = Console()
+
+
+def main(sessions: int = typer.Option(10_000, help="idle sessions to hold")):
+    result = measure(sessions)
+    console.print(
+        f"{result.sessions} idle sessions: {result.bytes_per_session:.0f} bytes "
+        f"per session on the server, {result.pipe_bytes:.0f} bytes per bare pipe, "
+        f"opened in {result.open_seconds:.1f}s"
+    )
+    projected = result.bytes_per_session * 100_000 / 2**20
+    console.print(f"100k sessions would take {projected:.0f} MiB")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,325 @@
+"""micro-benchmarks for the hot primitives with a stored baseline
+
+    python -m benchmarks.micro                 # compare against baseline
+    python -m benchmarks.micro --update        # record new baseline
+
+A comparison fails (exit code 1) when any operation got slower than the
+baseline by more than --threshold percent, and so does a run with no baseline
+to compare against. Timings only compare on the same machine, so the baseline
+is not committed: record one with --update (make bench-baseline) where the
+gate runs, e.g. once per CI runner image.
+"""
+import asyncio
+import atexit
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+from pathlib import Path
+from typing import Callable, Optional
+
+import typer
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from sec_sem8.connection import client_messages, server_messages
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.connection.passive_connection import PassiveConnection, World
+from sec_sem8.connection.transport import memory_connector
+from sec_sem8.entities import Message, PasswordHash, User
+from sec_sem8.history import History
+from sec_sem8.impl import Sha1Hasher, SqliteDatabase
+from sec_sem8.primes import get_random_prime, miller_rabin_test
+from sec_sem8.rc4 import RC4, xor_bytes
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+KEY = 15772985295341054783
+PRIME = 15772985295341054783
+PAYLOAD = os.urandom(4096)
+GAMMA = os.urandom(4096)
+
+Case = Callable[[], object]
+
+
+def _rc4_gamma() -> Case:
+    generator = RC4(KEY)
+    return lambda: generator.produce_gamma(4096)
+
+
+def _client_parse() -> Case:
+    raw = client_messages.ClientData(data="A" * 1024).json()
+    return lambda: client_messages.parse(raw)
+
+
+def _server_parse() -> Case:
+    raw = server_messages.ServerCryptogramm(content="A" * 1024).json()
+    return lambda: server_messages.parse(raw)
+
+
+def _random_prime() -> Case:
+    def case():
+        random.seed(0)
+        return get_random_prime(64)
+
+    return case
+
+
+def _primitive_root() -> Optional[Case]:
+    if not os.path.exists("./sqsieve"):
+        return None
+    from sec_sem8.diffie_hellman import find_primitive_root
+
+    def case():
+        random.seed(0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return find_primitive_root(32, PRIME)
+
+    return case
+
+
+def _sha1() -> Case:
+    hasher = Sha1Hasher()
+    return lambda: hasher("password" * 8)
+
+
+def _find_user() -> Case:
+    database = SqliteDatabase(":memory:")
+    for i in range(1000):
+        database.add_user(User(username=f"user-{i}", password_hash=PasswordHash("0")))
+    return lambda: database.find_user("user-500")
+
+
+def _add_user() -> Case:
+    database = SqliteDatabase(":memory:")
+    counter = itertools.count()
+    return lambda: database.add_user(
+        User(username=f"user-{next(counter)}", password_hash=PasswordHash("0"))
+    )
+
+
+def _history_append() -> Case:
+    history = History()
+    message = Message(author="user", content="x" * 64)
+    return lambda: history.append(message)
+
+
+def _history_read() -> Case:
+    history = History()
+    for i in range(1000):
+        history.append(Message(author=f"user-{i % 10}", content="x" * 64))
+    return lambda: b"".join(history.encode_chunks(16 * 1024))
+
+
+def _history_search() -> Case:
+    """a page of 50 results for two words over 100k messages"""
+    rng = random.Random(0)
+    words = [f"word{i}" for i in range(1000)]
+    history = History()
+    for i in range(100_000):
+        content = " ".join(rng.choices(words, k=8))
+        history.append(Message(author=f"user-{i % 100}", content=content))
+    return lambda: history.search("general", "word1 word2", limit=50)
+
+
+class _BenchWorld(World):
+    def has_user(self, username: str) -> bool:
+        return True
+
+    def get_user_password_hash(self, username: str) -> PasswordHash:
+        return BENCH_USER.password_hash
+
+    def get_diffie_params(self, username: str) -> tuple[int, int]:
+        return 5, PRIME
+
+
+BENCH_USER = User(username="user", password_hash=Sha1Hasher()("password"))
+
+
+async def _serve_memory(reader, writer):
+    connection = PassiveConnection(reader, writer, _BenchWorld())
+    await connection.handshake()
+    while (message := await connection.read_message()) is not None:
+        await connection.write_message(message)
+
+
+def _close_at_exit(loop: asyncio.AbstractEventLoop, *connections: ActiveConnection):
+    async def close():
+        for connection in connections:
+            await connection.say_goodbye()
+            await connection.reader.read()
+        await asyncio.sleep(0.01)  # let server sides finish
+
+    def run():
+        loop.run_until_complete(close())
+        loop.close()
+
+    atexit.register(run)
+
+
+def _memory_handshake() -> Case:
+    """handshake and goodbye over the memory transport, no sockets involved"""
+    loop = asyncio.new_event_loop()
+    _close_at_exit(loop)
+    connector = memory_connector(_serve_memory)
+
+    async def case():
+        connection = ActiveConnection(BENCH_USER, connector=connector)
+        await connection.connect()
+        await connection.handshake()
+        await connection.say_goodbye()
+        await connection.reader.read()  # until server side is closed too
+
+    return lambda: loop.run_until_complete(case())
+
+
+def _memory_round_trip() -> Case:
+    loop = asyncio.new_event_loop()
+    connection = ActiveConnection(BENCH_USER, connector=memory_connector(_serve_memory))
+    loop.run_until_complete(connection.connect())
+    loop.run_until_complete(connection.handshake())
+    _close_at_exit(loop, connection)
+    text = "x" * 64
+
+    async def case():
+        await connection.write(text)
+        return await connection.read()
+
+    return lambda: loop.run_until_complete(case())
+
+
+CASES: dict[str, Callable[[], Optional[Case]]] = {
+    "rc4_init": lambda: lambda: RC4(KEY),
+    "rc4_produce_gamma_4k": _rc4_gamma,
+    "xor_bytes_4k": lambda: lambda: xor_bytes(PAYLOAD, GAMMA),
+    "client_messages_parse_1k": _client_parse,
+    "server_messages_parse_1k": _server_parse,
+    "miller_rabin_test_64": lambda: lambda: miller_rabin_test(PRIME),
+    "get_random_prime_64": _random_prime,
+    "find_primitive_root": _primitive_root,
+    "sha1_hasher": _sha1,
+    "sqlite_find_user": _find_user,
+    "sqlite_add_user": _add_user,
+    "history_append": _history_append,
+    "history_read_1k": _history_read,
+    "history_search_100k": _history_search,
+    "memory_handshake": _memory_handshake,
+    "memory_round_trip_64": _memory_round_trip,
+}
+
+
+def measure(case: Case, repeat: int) -> float:
+    """best per-call time in seconds over `repeat` runs of an autoranged loop"""
+    timer = timeit.Timer(case)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run_cases(names: list[str], repeat: int) -> dict[str, Optional[float]]:
+    results: dict[str, Optional[float]] = {}
+    for name in names:
+        case = CASES[name]()
+        results[name] = None if case is None else measure(case, repeat)
+    return results
+
+
+def load_baseline(path: Path) -> Optional[dict[str, float]]:
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())["operations"]
+
+
+def save_baseline(path: Path, results: dict[str, Optional[float]]):
+    data = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "operations": {k: v for k, v in results.items() if v is not None},
+    }
+    path.write_text(json.dumps(data, indent=2) + "\n")
+
+
+def find_regressions(
+    results: dict[str, Optional[float]], baseline: dict[str, float], threshold: float
+) -> list[str]:
+    return [
+        name
+        for name, seconds in results.items()
+        if seconds is not None
+        and name in baseline
+        and seconds > baseline[name] * (1 + threshold / 100)
+    ]
+
+
+console = Console()
+
+
+def print_results(
+    results: dict[str, Optional[float]],
+    baseline: Optional[dict[str, float]],
+    regressions: list[str],
+):
+    table = Table("operation", "µs/call", "baseline", "change", box=box.ROUNDED)
+    for name, seconds in results.items():
+        if seconds is None:
+            table.add_row(name, "skipped", "", "")
+            continue
+        before = (baseline or {}).get(name)
+        change = "" if before is None else f"{(seconds / before - 1) * 100:+.1f}%"
+        style = "red" if name in regressions else None
+        table.add_row(
+            name,
+            f"{seconds * 1e6:.2f}",
+            "" if before is None else f"{before * 1e6:.2f}",
+            change,
+            style=style,
+        )
+    console.print(table)
+
+
+def main(
+    baseline_path: Path = typer.Option(DEFAULT_BASELINE, "--baseline"),
+    threshold: float = typer.Option(
+        float(os.environ.get("BENCH_THRESHOLD", 25)),
+        help="allowed slowdown against baseline, percent",
+    ),
+    update: bool = typer.Option(False, help="record results as the new baseline"),
+    repeat: int = typer.Option(5, help="timing runs per operation, best one is kept"),
+    only: Optional[list[str]] = typer.Option(None, help="run just these operations"),
+):
+    unknown = set(only or []) - set(CASES)
+    if unknown:
+        console.print(f"unknown operations: {', '.join(sorted(unknown))}")
+        raise typer.Exit(2)
+
+    baseline = None if update else load_baseline(baseline_path)
+    if baseline is None and not update:
+        console.print(
+            f"[red]no baseline at {baseline_path}, record one with --update first"
+        )
+        raise typer.Exit(1)
+
+    results = run_cases(only or list(CASES), repeat)
+    regressions = (
+        [] if baseline is None else find_regressions(results, baseline, threshold)
+    )
+    print_results(results, baseline, regressions)
+
+    if baseline is None:
+        save_baseline(baseline_path, results)
+        console.print(f"saved baseline to {baseline_path}")
+    elif regressions:
+        console.print(
+            f"[red]{len(regressions)} operation(s) regressed by more than "
+            f"{threshold}%: {', '.join(regressions)}"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,151 @@
+"""latency the man in the middle proxy adds to a request
+
+Starts the server and the proxy in child processes, then times sequential
+WriteRequest round trips on one connection, straight to the server and
+through the proxy:
+
+    python -m benchmarks.mitm --requests 2000 --message-size 1024
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Callable
+
+import typer
+from pydantic import BaseModel
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from sec_sem8.bench import LatencySummary, _serve, provision_users
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.entities import User, WriteRequest
+from sec_sem8.log import setup_logging
+from sec_sem8.mitm import MitmProxy
+from sec_sem8.transcript import TranscriptWriter
+
+
+class MitmBenchResult(BaseModel):
+    requests: int
+    message_size: int
+    direct: LatencySummary
+    proxied: LatencySummary
+    added_p50: float
+    added_p99: float
+
+
+def _proxy(upstream_port: int, transcript_path: str, control: Connection):
+    """proxy process entry point, stops on any message from control"""
+    sys.stdout = open(os.devnull, "w")
+    setup_logging(logging.ERROR)
+
+    async def run():
+        mitm = MitmProxy(
+            ("127.0.0.1", upstream_port), TranscriptWriter(Path(transcript_path))
+        )
+        server = await mitm.start("127.0.0.1", 0)
+        control.send(server.sockets[0].getsockname()[1])
+        async with server:
+            await asyncio.to_thread(control.recv)
+        await mitm.close()
+
+    asyncio.run(run())
+
+
+async def _round_trips(
+    user: User, port: int, requests: int, message_size: int
+) -> list[float]:
+    request = WriteRequest(content="x" * message_size).json()
+    connection = ActiveConnection(user, port=port)  # type: ignore
+    await connection.connect()
+    await connection.handshake()
+
+    loop = asyncio.get_running_loop()
+    samples = []
+    for _ in range(requests):
+        started = loop.time()
+        await connection.write(request)
+        await connection.read()
+        samples.append(loop.time() - started)
+    await connection.say_goodbye()
+    return samples
+
+
+def _start(target: Callable, *args) -> tuple[multiprocessing.Process, Connection, int]:
+    control, child_control = multiprocessing.Pipe()
+    process = multiprocessing.get_context("spawn").Process(
+        target=target, args=(*args, child_control), daemon=True
+    )
+    process.start()
+    return process, control, control.recv()
+
+
+def run_comparison(requests: int, message_size: int) -> MitmBenchResult:
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "users.sqlite")
+        (user,) = provision_users(db_path, 1)
+
+        processes = []
+        try:
+            server, server_control, server_port = _start(_serve, db_path)
+            processes.append((server, server_control))
+            proxy, proxy_control, proxy_port = _start(
+                _proxy, server_port, os.path.join(directory, "transcript.jsonl")
+            )
+            processes.append((proxy, proxy_control))
+
+            direct = asyncio.run(
+                _round_trips(user, server_port, requests, message_size)
+            )
+            proxied = asyncio.run(
+                _round_trips(user, proxy_port, requests, message_size)
+            )
+        finally:
+            for process, control in reversed(processes):
+                control.send("stop")
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+    direct_summary = LatencySummary.from_samples(direct)
+    proxied_summary = LatencySummary.from_samples(proxied)
+    return MitmBenchResult(
+        requests=requests,
+        message_size=message_size,
+        direct=direct_summary,
+        proxied=proxied_summary,
+        added_p50=proxied_summary.p50 - direct_summary.p50,
+        added_p99=proxied_summary.p99 - direct_summary.p99,
+    )
+
+
+console = Console()
+
+
+def main(
+    requests: int = typer.Option(1000, help="sequential round trips per path"),
+    message_size: int = typer.Option(64, help="characters per written message"),
+):
+    result = run_comparison(requests, message_size)
+    table = Table("path", "p50, ms", "p95, ms", "p99, ms", box=box.ROUNDED)
+    for name, summary in [("direct", result.direct), ("proxied", result.proxied)]:
+        table.add_row(
+            name,
+            f"{summary.p50 * 1000:.3f}",
+            f"{summary.p95 * 1000:.3f}",
+            f"{summary.p99 * 1000:.3f}",
+        )
+    console.print(table)
+    console.print(
+        f"proxy adds p50 {result.added_p50 * 1000:.3f} ms, "
+        f"p99 {result.added_p99 * 1000:.3f} ms"
+    )
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,164 @@
+"""unix domain socket against loopback TCP for co-located clients
+
+Starts one server process listening on both, then measures sequential
+WriteRequest round trips on one connection and the request rate of several
+concurrent connections over each transport:
+
+    python -m benchmarks.unix_socket --requests 2000 --clients 8
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from multiprocessing.connection import Connection
+from typing import Optional
+
+import typer
+from pydantic import BaseModel
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.mitm import _start
+from sec_sem8.bench import BENCH_DIFFIE_PARAMS, LatencySummary, provision_users
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.connection.limits import ConnectionLimits
+from sec_sem8.entities import User, WriteRequest
+from sec_sem8.impl import SqliteDatabase
+from sec_sem8.log import setup_logging
+from sec_sem8.server import ChatServer, RealWorld
+
+
+class TransportResult(BaseModel):
+    latency: LatencySummary
+    requests_per_second: float
+
+
+class UnixBenchResult(BaseModel):
+    requests: int
+    clients: int
+    message_size: int
+    tcp: TransportResult
+    unix: TransportResult
+
+
+def _serve(db_path: str, unix_path: str, control: Connection):
+    """server process entry point, stops on any message from control"""
+    sys.stdout = open(os.devnull, "w")
+    setup_logging(logging.ERROR)
+
+    async def run():
+        world = RealWorld(SqliteDatabase(db_path), BENCH_DIFFIE_PARAMS)
+        limits = ConnectionLimits(
+            max_connections=None,
+            max_connections_per_ip=None,
+            handshake_rate_per_ip=None,
+            handshake_rate_per_user=None,
+            max_loop_lag=None,
+        )
+        server = ChatServer(world, verbose=False, limits=limits)
+        tcp = await server.start("127.0.0.1", 0)
+        unix = await server.start_unix(unix_path)
+        control.send(tcp.sockets[0].getsockname()[1])
+        async with tcp, unix:
+            await asyncio.to_thread(control.recv)
+
+    asyncio.run(run())
+
+
+async def _open(user: User, port: int, unix_path: Optional[str]) -> ActiveConnection:
+    connection = ActiveConnection(user, port=port, unix_path=unix_path)  # type: ignore
+    await connection.connect()
+    await connection.handshake()
+    return connection
+
+
+async def _round_trips(
+    connection: ActiveConnection, requests: int, message_size: int
+) -> list[float]:
+    request = WriteRequest(content="x" * message_size).json()
+    loop = asyncio.get_running_loop()
+    samples = []
+    for _ in range(requests):
+        started = loop.time()
+        await connection.write(request)
+        await connection.read()
+        samples.append(loop.time() - started)
+    return samples
+
+
+async def _measure(
+    users: list[User],
+    port: int,
+    unix_path: Optional[str],
+    requests: int,
+    message_size: int,
+) -> TransportResult:
+    single = await _open(users[0], port, unix_path)
+    latency = await _round_trips(single, requests, message_size)
+    await single.say_goodbye()
+
+    connections = [await _open(user, port, unix_path) for user in users]
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await asyncio.gather(
+        *(_round_trips(c, requests, message_size) for c in connections)
+    )
+    elapsed = loop.time() - started
+    for connection in connections:
+        await connection.say_goodbye()
+
+    return TransportResult(
+        latency=LatencySummary.from_samples(latency),
+        requests_per_second=requests * len(connections) / elapsed,
+    )
+
+
+def run_comparison(requests: int, clients: int, message_size: int) -> UnixBenchResult:
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "users.sqlite")
+        unix_path = os.path.join(directory, "chat.sock")
+        users = provision_users(db_path, clients)
+
+        server, control, port = _start(_serve, db_path, unix_path)
+        try:
+            tcp = asyncio.run(_measure(users, port, None, requests, message_size))
+            unix = asyncio.run(_measure(users, port, unix_path, requests, message_size))
+        finally:
+            control.send("stop")
+            server.join(timeout=5)
+            if server.is_alive():
+                server.terminate()
+
+    return UnixBenchResult(
+        requests=requests,
+        clients=clients,
+        message_size=message_size,
+        tcp=tcp,
+        unix=unix,
+    )
+
+
+console = Console()
+
+
+def main(
+    requests: int = typer.Option(1000, help="round trips per connection"),
+    clients: int = typer.Option(8, help="concurrent connections for throughput"),
+    message_size: int = typer.Option(64, help="characters per written message"),
+):
+    result = run_comparison(requests, clients, message_size)
+    table = Table("transport", "p50, ms", "p99, ms", "requests/s", box=box.ROUNDED)
+    for name, transport in [("tcp", result.tcp), ("unix", result.unix)]:
+        table.add_row(
+            name,
+            f"{transport.latency.p50 * 1000:.3f}",
+            f"{transport.latency.p99 * 1000:.3f}",
+            f"{transport.requests_per_second:.0f}",
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    typer.run(main)
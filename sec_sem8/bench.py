@@ -0,0 +1,332 @@
+"""end-to-end load generator for the chat server
+
+Starts the server in a child process on top of a temporary user database,
+then drives it with concurrent ActiveConnection clients:
+
+    python -m sec_sem8.bench --clients 50 --duration 10 --output run.json
+"""
+import asyncio
+import datetime
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Optional
+
+import typer
+from pydantic import BaseModel
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from sec_sem8.connection.active_connection import ActiveConnection, ParamsCache
+from sec_sem8.connection.limits import ConnectionLimits
+from sec_sem8.entities import ReadRequest, User, WriteRequest
+from sec_sem8.impl import Sha1Hasher, SqliteDatabase
+from sec_sem8.log import setup_logging
+from sec_sem8.server import ChatServer, RealWorld
+
+# 64 bit safe prime with its primitive root, fixed so that runs are comparable
+# and do not depend on the external factorization tool
+BENCH_DIFFIE_PARAMS = (5, 15772985295341054783)
+
+
+class BenchConfig(BaseModel):
+    clients: int
+    users: int
+    duration: float
+    handshake_weight: float
+    write_weight: float
+    read_weight: float
+    message_size: int
+    seed: int
+    fast_handshake: bool = False
+
+
+class LatencySummary(BaseModel):
+    count: int
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+    @classmethod
+    def from_samples(cls, samples: list[float]) -> "LatencySummary":
+        if not samples:
+            return cls(count=0, mean=0.0, p50=0.0, p95=0.0, p99=0.0, max=0.0)
+        ordered = sorted(samples)
+
+        def percentile(q: float) -> float:
+            # nearest rank, rounded first so 0.07 * 100 is not rank 8
+            rank = math.ceil(round(q * len(ordered), 9))
+            return ordered[max(0, rank - 1)]
+
+        return cls(
+            count=len(ordered),
+            mean=sum(ordered) / len(ordered),
+            p50=percentile(0.50),
+            p95=percentile(0.95),
+            p99=percentile(0.99),
+            max=ordered[-1],
+        )
+
+
+class BenchResult(BaseModel):
+    started_at: str
+    python: str
+    platform: str
+    config: BenchConfig
+    wall_seconds: float
+    handshake_latency: LatencySummary
+    write_latency: LatencySummary
+    read_latency: LatencySummary
+    requests: int
+    requests_per_second: float
+    handshakes_per_second: float
+    errors: int
+    server_cpu_seconds: float
+    server_cpu_utilization: float
+
+
+class _Samples:
+    def __init__(self) -> None:
+        self.handshake: list[float] = []
+        self.write: list[float] = []
+        self.read: list[float] = []
+        self.errors = 0
+
+
+def provision_users(db_path: str, count: int) -> list[User]:
+    database = SqliteDatabase(db_path)
+    hasher = Sha1Hasher()
+    users = [
+        User(username=f"bench-{i}", password_hash=hasher(f"password-{i}"))
+        for i in range(count)
+    ]
+    for user in users:
+        database.add_user(user)
+    return users
+
+
+def _serve(db_path: str, control: Connection):
+    """server process entry point, answers 'cpu' and 'stop' commands on control"""
+    sys.stdout = open(os.devnull, "w")
+    setup_logging(logging.ERROR)
+
+    async def run():
+        world = RealWorld(SqliteDatabase(db_path), BENCH_DIFFIE_PARAMS)
+        limits = ConnectionLimits(
+            max_connections=None,
+            max_connections_per_ip=None,
+            handshake_rate_per_ip=None,
+            handshake_rate_per_user=None,
+            max_loop_lag=None,
+        )
+        server = await ChatServer(world, verbose=False, limits=limits).start(
+            "127.0.0.1", 0
+        )
+        control.send(server.sockets[0].getsockname()[1])
+
+        async with server:
+            while (command := await asyncio.to_thread(control.recv)) != "stop":
+                if command == "cpu":
+                    control.send(time.process_time())
+
+    asyncio.run(run())
+
+
+async def _run_client(
+    user: User,
+    port: int,
+    config: BenchConfig,
+    rng: random.Random,
+    deadline: float,
+    samples: _Samples,
+):
+    operations = ["handshake", "write", "read"]
+    weights = [config.handshake_weight, config.write_weight, config.read_weight]
+    write_request = WriteRequest(content="x" * config.message_size).json()
+    read_request = ReadRequest().json()
+    params_cache: Optional[ParamsCache] = {} if config.fast_handshake else None
+    connection: Optional[ActiveConnection] = None
+
+    while time.monotonic() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        try:
+            if connection is None or operation == "handshake":
+                if connection is not None:
+                    await connection.say_goodbye()
+                started = time.perf_counter()
+                connection = ActiveConnection(
+                    user, port=port, params_cache=params_cache  # type: ignore
+                )
+                await connection.connect()
+                await connection.handshake()
+                samples.handshake.append(time.perf_counter() - started)
+                if operation == "handshake":
+                    continue
+
+            started = time.perf_counter()
+            if operation == "write":
+                await connection.write(write_request)
+                await connection.read()
+                samples.write.append(time.perf_counter() - started)
+            else:
+                await connection.write(read_request)
+                await connection.read()
+                samples.read.append(time.perf_counter() - started)
+        except Exception:
+            samples.errors += 1
+            connection = None
+
+    if connection is not None and connection.is_open():
+        await connection.say_goodbye()
+
+
+async def _run_clients(
+    users: list[User], port: int, config: BenchConfig
+) -> tuple[_Samples, float]:
+    samples = _Samples()
+    deadline = time.monotonic() + config.duration
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(
+            _run_client(
+                users[i % len(users)],
+                port,
+                config,
+                random.Random(config.seed + i),
+                deadline,
+                samples,
+            )
+            for i in range(config.clients)
+        )
+    )
+    return samples, time.perf_counter() - started
+
+
+def run_benchmark(config: BenchConfig) -> BenchResult:
+    started_at = datetime.datetime.now().isoformat(timespec="seconds")
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "users.sqlite")
+        users = provision_users(db_path, config.users)
+
+        control, child_control = multiprocessing.Pipe()
+        server = multiprocessing.get_context("spawn").Process(
+            target=_serve, args=(db_path, child_control), daemon=True
+        )
+        server.start()
+        try:
+            port = control.recv()
+            control.send("cpu")
+            cpu_before = control.recv()
+
+            samples, wall = asyncio.run(_run_clients(users, port, config))
+
+            control.send("cpu")
+            cpu_after = control.recv()
+            control.send("stop")
+        finally:
+            server.join(timeout=5)
+            if server.is_alive():
+                server.terminate()
+
+    requests = len(samples.write) + len(samples.read)
+    server_cpu = cpu_after - cpu_before
+    return BenchResult(
+        started_at=started_at,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        config=config,
+        wall_seconds=wall,
+        handshake_latency=LatencySummary.from_samples(samples.handshake),
+        write_latency=LatencySummary.from_samples(samples.write),
+        read_latency=LatencySummary.from_samples(samples.read),
+        requests=requests,
+        requests_per_second=requests / wall,
+        handshakes_per_second=len(samples.handshake) / wall,
+        errors=samples.errors,
+        server_cpu_seconds=server_cpu,
+        server_cpu_utilization=server_cpu / wall,
+    )
+
+
+console = Console()
+
+
+def print_result(result: BenchResult):
+    table = Table(
+        "operation", "count", "p50, ms", "p95, ms", "p99, ms", box=box.ROUNDED
+    )
+    for name, summary in [
+        ("handshake", result.handshake_latency),
+        ("write", result.write_latency),
+        ("read", result.read_latency),
+    ]:
+        table.add_row(
+            name,
+            str(summary.count),
+            f"{summary.p50 * 1000:.2f}",
+            f"{summary.p95 * 1000:.2f}",
+            f"{summary.p99 * 1000:.2f}",
+        )
+    console.print(table)
+    console.print(
+        f"requests/s: {result.requests_per_second:.1f}, "
+        f"handshakes/s: {result.handshakes_per_second:.1f}, "
+        f"errors: {result.errors}, "
+        f"server cpu: {result.server_cpu_seconds:.2f}s "
+        f"({result.server_cpu_utilization:.0%})"
+    )
+
+
+app = typer.Typer()
+
+
+@app.command()
+def load(
+    clients: int = typer.Option(10, help="concurrent client connections"),
+    users: int = typer.Option(10, help="users provisioned in temporary database"),
+    duration: float = typer.Option(5.0, help="seconds of load"),
+    handshake_weight: float = typer.Option(1.0, help="relative share of handshakes"),
+    write_weight: float = typer.Option(5.0, help="relative share of WriteRequests"),
+    read_weight: float = typer.Option(20.0, help="relative share of ReadRequests"),
+    message_size: int = typer.Option(64, help="characters per written message"),
+    seed: int = typer.Option(0),
+    fast_handshake: bool = typer.Option(
+        False, help="reconnect with cached group parameters in one round trip"
+    ),
+    output: Optional[Path] = typer.Option(None, help="write JSON results here"),
+):
+    config = BenchConfig(
+        clients=clients,
+        users=users,
+        duration=duration,
+        handshake_weight=handshake_weight,
+        write_weight=write_weight,
+        read_weight=read_weight,
+        message_size=message_size,
+        seed=seed,
+        fast_handshake=fast_handshake,
+    )
+    result = run_benchmark(config)
+    print_result(result)
+    if output is not None:
+        output.write_text(result.json(indent=2))
+
+
+def main():
+    app()
+
+
+if __name__ == "__main__":
+    main()
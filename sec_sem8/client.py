@@ -1,27 +1,36 @@
+import logging
 import sys
 
 import PySimpleGUI as sg
 
 from sec_sem8.connection.active_connection import (
-    SyncActiveConnection,
     IncorrectPasswordError,
     UnknownUserError,
 )
+from sec_sem8.connection.background_connection import BackgroundActiveConnection
 from sec_sem8.impl import Sha1Hasher
+from sec_sem8.log import setup_logging
 from sec_sem8.entities import ReadRequest, WriteRequest, Message
 import time
 from pydantic import parse_raw_as
 import threading
 from queue import Queue
 import contextlib
+from concurrent.futures import Future
+from typing import Optional
 
 try:
     SERVER_ADDRESS = sys.argv[1]
 except:
     SERVER_ADDRESS = "127.0.0.1"
 
+setup_logging(logging.INFO)
+
 fontsize = 35
 
+TIMEOUT = 5.0
+"""seconds given to connect, handshake and goodbye"""
+
 
 username_form = sg.InputText(key="username", font=fontsize)
 password_form = sg.InputText(key="password", password_char="*", font=fontsize)
@@ -45,9 +54,7 @@ window = sg.Window(title="client", layout=form, font=fontsize, finalize=True)
 
 hasher = Sha1Hasher()
 
-conn = None
-
-lock = threading.Lock()
+conn: BackgroundActiveConnection | None = None
 
 updates: Queue[list[Message]] = Queue()
 
@@ -56,25 +63,53 @@ def pull_messages_work():
     while True:
         time.sleep(0.25)
 
-        with lock:
-            if conn is None or not conn.is_open():
-                continue
-
-            conn.write(ReadRequest().json())
+        current = conn
+        if current is None or not current.is_open():
+            continue
 
-            raw_reply = conn.read()
-            # print(raw_reply)
-            messages = parse_raw_as(list[Message], raw_reply)
+        try:
+            raw_reply = current.request(ReadRequest().json()).result(TIMEOUT)
+        except Exception:
+            continue
+        messages = parse_raw_as(list[Message], raw_reply)
 
-            updates.put(messages)
+        updates.put(messages)
 
 
 puller = threading.Thread(target=pull_messages_work, daemon=True)
 puller.start()
 
 
+def close_in_background(current: BackgroundActiveConnection):
+    """say goodbye off the ui thread, a dead server must not freeze the window"""
+    threading.Thread(target=current.close, args=(TIMEOUT,), daemon=True).start()
+
+
+# connect, then handshake of conn; the ui loop polls the future instead of
+# waiting for it, so the window keeps redrawing while the server answers
+login: Optional[Future] = None
+login_step = "connect"
+login_deadline = 0.0
+
+
+def login_failure(step: Future) -> Optional[str]:
+    """text to show if a login step failed or timed out"""
+    if not step.done():
+        return "server did not answer"
+    error = step.exception()
+    if error is None:
+        return None
+    if isinstance(error, OSError):
+        return "could not connect to server"
+    if isinstance(error, UnknownUserError):
+        return "unknown user"
+    if isinstance(error, IncorrectPasswordError):
+        return "incorrect password"
+    return f"other connection error: {error}"
+
+
 while True:
-    event, data = window.read(timeout=0.1)  # type: ignore
+    event, data = window.read(timeout=100)  # type: ignore
 
     with contextlib.suppress(Exception):
         update = updates.get_nowait()
@@ -82,10 +117,25 @@ while True:
             value="\n".join(map(lambda msg: f"{msg.author}: {msg.content}", update))
         )
 
+    if login is not None and (login.done() or time.monotonic() > login_deadline):
+        assert conn is not None
+        step, login = login, None
+        if (failure := login_failure(step)) is not None:
+            close_in_background(conn)
+            conn = None
+            sg.Popup(failure)
+        elif login_step == "connect":
+            login, login_step = conn.handshake(), "handshake"
+            login_deadline = time.monotonic() + TIMEOUT
+        else:
+            text_form.update(disabled=False)
+            send_btn.update(disabled=False)
+            close_btn.update(disabled=False)
+            sg.Popup(f"established connection, shared key: {step.result().key}")
+
     if event == sg.WIN_CLOSED:
-        with lock:
-            if conn is not None and conn.is_open():
-                conn.say_goodbye()
+        if conn is not None:
+            conn.close(TIMEOUT)
         break
     elif event == "LOGIN":
         username = data["username"].strip()
@@ -101,51 +151,24 @@ while True:
             username = username
             password_hash = hasher(password)
 
-        with lock:
-            try:
-                if conn is not None and conn.is_open():
-                    conn.say_goodbye()
-                conn = SyncActiveConnection(user, server=SERVER_ADDRESS, verbose=True)  # type: ignore
-                conn.connect()
-            except ConnectionRefusedError:
-                sg.Popup("could not connect to server")
-                continue
-
-        with lock:
-            try:
-                ok = conn.handshake()
-
-            except UnknownUserError:
-                sg.Popup(f"unknown user")
-                continue
-            except IncorrectPasswordError:
-                sg.Popup("incorrect password")
-                continue
-            except ValueError as e:
-                sg.Popup(f"other connection error: {e}")
-                continue
-
-        text_form.update(disabled=False)
-        send_btn.update(disabled=False)
-        close_btn.update(disabled=False)
-        sg.Popup(f"established connection, shared key: {ok.key}")
+        if conn is not None:
+            close_in_background(conn)
+        conn = BackgroundActiveConnection(user, server=SERVER_ADDRESS, verbose=True)  # type: ignore
+        login, login_step = conn.connect(), "connect"
+        login_deadline = time.monotonic() + TIMEOUT
 
     elif event == "SEND":
-        pass
         text = text_form.get()
 
         data = WriteRequest(content=text)
 
-        with lock:
-            assert conn is not None
-            conn.write(data.json())
-            _ = conn.read()
+        assert conn is not None
+        conn.request(data.json())
     elif event == "CLOSE":
-        time.sleep(0.5)
-        with lock:
-            assert conn is not None
-            conn.say_goodbye()
-            conn = None
+        assert conn is not None
+        close_in_background(conn)
+        conn = None
+        login = None
         text_form.update(disabled=True)
         send_btn.update(disabled=True)
         close_btn.update(disabled=True)
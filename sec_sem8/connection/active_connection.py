@@ -1,9 +1,11 @@
 import asyncio
 import base64
-from typing import NoReturn
+from typing import AsyncIterator, NoReturn, Optional
 
+from sec_sem8.connection.chunks import CHUNK_SIZE, Chunks, split_chunks
 from sec_sem8.connection.client_messages import (
     BaseClientMessage,
+    ClientChunk,
     ClientData,
     ClientGoodbye,
 )
@@ -16,15 +18,30 @@ from sec_sem8.connection.client_states import (
     StartState,
     UserData,
 )
+from sec_sem8.connection.outbound import frames_per_write
+from sec_sem8.connection.transport import Connector
 from sec_sem8.connection.server_messages import (
     BaseServerMessage,
+    DiffieRequest,
+    FastNonce,
     ServerError,
     UnknownMessage,
     parse,
+    ServerChunk,
     ServerCryptogramm,
 )
+from sec_sem8.log import get_logger
 from sec_sem8.rc4 import xor_bytes
 
+log = get_logger("client")
+client_frames_per_write = frames_per_write.labels("client")
+
+# chunks of one message are written together, up to this many bytes at once
+WRITE_WATERMARK = 64 * 1024
+
+ParamsCache = dict[tuple[str, int], tuple[int, int]]
+"""group parameters (g, p) last seen from each server address"""
+
 
 class UnknownUserError(ValueError):
     pass
@@ -41,21 +58,45 @@ class ActiveConnection:
         server: str = "127.0.0.1",
         port: int = 4433,
         verbose: bool = False,
+        params_cache: Optional[ParamsCache] = None,
+        connector: Optional[Connector] = None,
+        unix_path: Optional[str] = None,
     ) -> None:
+        """
+        Args:
+            params_cache: enables fast handshake with servers found in it,
+                filled on every full handshake; can be shared by connections
+            connector: opens the streams instead of a TCP connection to
+                server:port, e.g. transport.memory_connector
+            unix_path: connect to this unix domain socket instead of server:port
+        """
         self.reader = None
         self.writer = None
         self.user_data = user_data
         self.state: BaseClientState = StartState()
-        self.conn_params = (server, port)
+        # also the params_cache key, a socket path gets port 0
+        self.conn_params = (server, port) if unix_path is None else (unix_path, 0)
+        self.unix_path = unix_path
         self.verbose = verbose
+        self.params_cache = params_cache
+        self.connector = connector
+        self._pending: list[bytes] = []
+        self._pending_bytes = 0
 
-    def _log(self, *message):
+    def _log(self, event: str, **fields):
         if self.verbose:
-            print(*message)
+            log.debug(event, **fields)
 
     async def connect(self):
-        self._log("called connect")
-        self.reader, self.writer = await asyncio.open_connection(*self.conn_params)
+        self._log("connect", server=self.conn_params)
+        if self.connector is not None:
+            self.reader, self.writer = await self.connector()
+        elif self.unix_path is not None:
+            self.reader, self.writer = await asyncio.open_unix_connection(
+                self.unix_path
+            )
+        else:
+            self.reader, self.writer = await asyncio.open_connection(*self.conn_params)
 
     async def _error_bailout(self, message: str) -> NoReturn:
         assert self.reader is not None
@@ -77,7 +118,7 @@ class ActiveConnection:
             raw = await self.reader.readline()
             message = raw.decode().strip(" \n")
             decoded = parse(message)
-            self._log("got message of type", decoded.__class__.__name__)
+            self._log("frame_in", frame=decoded)
 
             if isinstance(decoded, ServerError):
                 await self._error_bailout(decoded.text)
@@ -87,15 +128,42 @@ class ActiveConnection:
         except UnicodeDecodeError:
             await self._error_bailout("decode error")
 
-    async def _write_message(self, message: BaseClientMessage):
+    async def _write_message(self, message: BaseClientMessage, flush: bool = True):
+        """
+        Args:
+            flush: write out buffered frames now, otherwise they wait for
+                the next flush or until WRITE_WATERMARK bytes are buffered
+        """
+        frame = (message.json() + "\n").encode()
+        self._pending.append(frame)
+        self._pending_bytes += len(frame)
+        self._log("frame_out", frame=message)
+        if flush or self._pending_bytes >= WRITE_WATERMARK:
+            await self._flush()
+
+    async def _flush(self):
         assert self.reader is not None
         assert self.writer is not None
-        self.writer.write((message.json() + "\n").encode())
+        client_frames_per_write.observe(len(self._pending))
+        self.writer.writelines(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
         await self.writer.drain()
-        self._log("wrote message:", message)
 
     async def handshake(self) -> DiffieDone:
-        message, new_state = self.state.on_init(self.user_data)
+        """authenticate and agree on a key
+
+        With cached group parameters key exchange starts in the first message
+        and the handshake takes one round trip. Password is then checked by
+        the server after handshake returns, a wrong one fails the next read.
+        """
+        cached = None
+        if self.params_cache is not None:
+            cached = self.params_cache.get(self.conn_params)
+        if cached is None:
+            message, new_state = self.state.on_init(self.user_data)
+        else:
+            message, new_state = self.state.on_fast_init(self.user_data, *cached)
         if not isinstance(new_state, NonceRequested):
             await self._error_bailout(
                 "failure setting up connection at username transfer"
@@ -105,43 +173,89 @@ class ActiveConnection:
 
         while True:
             server_message: BaseServerMessage = await self._read_message()
+            if (
+                isinstance(server_message, DiffieRequest)
+                and self.params_cache is not None
+            ):
+                self.params_cache[self.conn_params] = server_message.g, server_message.p
             answer, new_state = self.state.on_message(server_message, self.user_data)
             await self._write_message(answer)
             self.state = new_state
             if isinstance(self.state, ErrorState):
                 await self._error_bailout(self.state.message)
             if isinstance(self.state, DiffieDone):
-                await self._read_message()  # drop ok from server
+                if not isinstance(server_message, FastNonce):
+                    await self._read_message()  # drop ok from server
                 return self.state
 
-    async def read(self) -> str:
+    def _decrypt(self, data: str) -> bytes:
+        assert isinstance(self.state, DiffieDone)
+        b64 = base64.b64decode(data)
+        gamma = self.state.rc4.produce_gamma(len(b64))
+        return xor_bytes(b64, gamma)
+
+    def _encrypt(self, data: bytes) -> str:
+        assert isinstance(self.state, DiffieDone)
+        gamma = self.state.rc4.produce_gamma(len(data))
+        encrypted = xor_bytes(data, gamma)
+        return base64.b64encode(encrypted).decode()
+
+    async def read_stream(self) -> AsyncIterator[bytes]:
+        """decrypted parts of next server message as they arrive
+
+        A message sent as ServerCryptogramm comes out as a single part.
+        """
         if not isinstance(self.state, DiffieDone):
             await self._error_bailout(
                 f"called read in wrong state ({self.state.__class__.__name__})"
             )
         server_message: BaseServerMessage = await self._read_message()
-        if not isinstance(server_message, ServerCryptogramm):
-            raise ValueError(
-                f"unexpected data when trying to read server response: {server_message}"
-            )
+        if isinstance(server_message, ServerCryptogramm):
+            yield self._decrypt(server_message.content)
+            return
+        while isinstance(server_message, ServerChunk):
+            yield self._decrypt(server_message.content)
+            if server_message.last:
+                return
+            server_message = await self._read_message()
+        raise ValueError(
+            f"unexpected data when trying to read server response: {server_message}"
+        )
 
-        b64 = base64.b64decode(server_message.content)
-        gamma = self.state.rc4.produce_gamma(len(b64))
-        decrypted = xor_bytes(b64, gamma)
-        return decrypted.decode()
+    async def read(self) -> str:
+        parts = [part async for part in self.read_stream()]
+        return b"".join(parts).decode()
 
     async def write(self, text: str):
+        """encrypt and send text, as chunks if it is longer than CHUNK_SIZE"""
         if not isinstance(self.state, DiffieDone):
             await self._error_bailout(
                 f"called write in wrong state ({self.state.__class__.__name__})"
             )
         raw_message = text.encode()
-        gamma = self.state.rc4.produce_gamma(len(raw_message))
+        if len(raw_message) > CHUNK_SIZE:
+            await self.write_stream([raw_message])
+            return
+        await self._write_message(ClientData(data=self._encrypt(raw_message)))
 
-        encrypted = xor_bytes(raw_message, gamma)
-        enc_str = base64.b64encode(encrypted).decode()
-        message = ClientData(data=enc_str)
-        await self._write_message(message)
+    async def write_stream(self, chunks: Chunks):
+        """encrypt and send one message made of chunks, without joining them
+
+        Payload goes out as ClientChunk frames of at most CHUNK_SIZE bytes,
+        or as plain ClientData if it fits into one frame.
+        """
+        if not isinstance(self.state, DiffieDone):
+            await self._error_bailout(
+                f"called write in wrong state ({self.state.__class__.__name__})"
+            )
+        first = True
+        async for part, last in split_chunks(chunks):
+            data = self._encrypt(part)
+            if first and last:
+                await self._write_message(ClientData(data=data))
+            else:
+                await self._write_message(ClientChunk(data=data, last=last), last)
+            first = False
 
     async def say_goodbye(self):
         if not isinstance(self.state, DiffieDone):
@@ -157,36 +271,3 @@ class ActiveConnection:
 
     def is_open(self) -> bool:
         return isinstance(self.state, DiffieDone)
-
-
-class SyncActiveConnection:
-    def __init__(
-        self,
-        user_data: UserData,
-        server: str = "127.0.0.1",
-        port: int = 4433,
-        verbose: bool = False,
-    ):
-        self.connection = ActiveConnection(user_data, server, port, verbose)
-        self.loop = asyncio.get_event_loop()
-
-    def _adapt(self, coro):
-        return self.loop.run_until_complete(coro)
-
-    def connect(self):
-        return self._adapt(self.connection.connect())
-
-    def handshake(self) -> DiffieDone:
-        return self._adapt(self.connection.handshake())
-
-    def read(self) -> str:
-        return self._adapt(self.connection.read())
-
-    def write(self, text: str):
-        return self._adapt(self.connection.write(text))
-
-    def say_goodbye(self):
-        self._adapt(self.connection.say_goodbye())
-
-    def is_open(self) -> bool:
-        return isinstance(self.connection.state, DiffieDone)
@@ -0,0 +1,188 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Coroutine, Optional, TypeVar
+
+from sec_sem8.connection.active_connection import ActiveConnection, ParamsCache
+from sec_sem8.connection.client_states import DiffieDone, UserData
+
+T = TypeVar("T")
+
+
+class BackgroundActiveConnection:
+    """ActiveConnection driven by its own event loop thread
+
+    Every public method may be called from any thread and returns a
+    concurrent.futures.Future right away, so callers never block on network io.
+
+    Both directions share one RC4 keystream, so a request and its reply must not
+    interleave with other traffic. Exchanges submitted from different threads are
+    therefore ordered on the loop thread, while callers keep running.
+
+    This is not concurrent send and receive: one lock covers every read and
+    write, so a read waiting for the server holds back all writes until it
+    returns. That needs a keystream per direction in the protocol.
+    """
+
+    def __init__(
+        self,
+        user_data: UserData,
+        server: str = "127.0.0.1",
+        port: int = 4433,
+        verbose: bool = False,
+        on_data: Optional[Callable[[str], None]] = None,
+        on_error: Optional[Callable[[BaseException], None]] = None,
+        params_cache: Optional[ParamsCache] = None,
+        unix_path: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            on_data: called on the loop thread with every decrypted server reply
+            on_error: called on the loop thread when a submitted operation fails
+            params_cache, unix_path: see ActiveConnection
+        """
+        self.connection = ActiveConnection(
+            user_data, server, port, verbose, params_cache, unix_path=unix_path
+        )
+        self.on_data = on_data or (lambda _: None)
+        self.on_error = on_error or (lambda _: None)
+
+        self.loop = asyncio.new_event_loop()
+        self._exchange_lock = asyncio.Lock()
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run_loop, name="active-connection-loop", daemon=True
+        )
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            pending = asyncio.all_tasks(self.loop)
+            for task in pending:
+                task.cancel()
+            self.loop.run_until_complete(
+                asyncio.gather(*pending, return_exceptions=True)
+            )
+            self.loop.close()
+
+    def _submit(self, coro: Coroutine[Any, Any, T]) -> "Future[T]":
+        if self._closed:
+            coro.close()
+            raise RuntimeError("connection is closed")
+        return asyncio.run_coroutine_threadsafe(self._report_errors(coro), self.loop)
+
+    async def _report_errors(self, coro: Coroutine[Any, Any, T]) -> T:
+        try:
+            return await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.on_error(e)
+            raise
+
+    async def _read(self) -> str:
+        async with self._exchange_lock:
+            return await self._read_locked()
+
+    async def _read_locked(self) -> str:
+        reply = await self.connection.read()
+        self.on_data(reply)
+        return reply
+
+    async def _write(self, text: str):
+        async with self._exchange_lock:
+            await self.connection.write(text)
+
+    async def _request(self, text: str) -> str:
+        async with self._exchange_lock:
+            await self.connection.write(text)
+            return await self._read_locked()
+
+    async def _say_goodbye(self):
+        async with self._exchange_lock:
+            await self.connection.say_goodbye()
+
+    def connect(self) -> "Future[None]":
+        return self._submit(self.connection.connect())
+
+    def handshake(self) -> "Future[DiffieDone]":
+        return self._submit(self.connection.handshake())
+
+    def read(self) -> "Future[str]":
+        return self._submit(self._read())
+
+    def write(self, text: str) -> "Future[None]":
+        return self._submit(self._write(text))
+
+    def request(self, text: str) -> "Future[str]":
+        """write text and read the reply to it as one uninterrupted exchange"""
+        return self._submit(self._request(text))
+
+    def say_goodbye(self) -> "Future[None]":
+        return self._submit(self._say_goodbye())
+
+    def is_open(self) -> bool:
+        return not self._closed and self.connection.is_open()
+
+    def close(self, timeout: Optional[float] = None):
+        """say goodbye if session is open, then stop loop thread
+
+        Exchanges already submitted are completed first, anything still pending
+        after that is cancelled. Must not be called from the loop thread.
+        """
+        with self._close_lock:
+            if self._closed:
+                return
+            if self.connection.is_open():
+                goodbye = self.say_goodbye()
+                try:
+                    goodbye.result(timeout)
+                except Exception:
+                    pass
+            self._closed = True
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+
+    def __enter__(self) -> "BackgroundActiveConnection":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class SyncActiveConnection:
+    """blocking facade over BackgroundActiveConnection"""
+
+    def __init__(
+        self,
+        user_data: UserData,
+        server: str = "127.0.0.1",
+        port: int = 4433,
+        verbose: bool = False,
+        unix_path: Optional[str] = None,
+    ):
+        self.connection = BackgroundActiveConnection(
+            user_data, server, port, verbose, unix_path=unix_path
+        )
+
+    def connect(self):
+        return self.connection.connect().result()
+
+    def handshake(self) -> DiffieDone:
+        return self.connection.handshake().result()
+
+    def read(self) -> str:
+        return self.connection.read().result()
+
+    def write(self, text: str):
+        return self.connection.write(text).result()
+
+    def say_goodbye(self):
+        self.connection.close()
+
+    def is_open(self) -> bool:
+        return self.connection.is_open()
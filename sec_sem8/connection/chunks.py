@@ -0,0 +1,33 @@
+from typing import AsyncIterable, AsyncIterator, Iterable
+
+# plaintext bytes per chunk frame; base64 and json envelope keep the frame
+# well below the default 64 KiB StreamReader line limit
+CHUNK_SIZE = 16 * 1024
+
+Chunks = Iterable[bytes] | AsyncIterable[bytes]
+
+
+async def _iterate(chunks: Chunks) -> AsyncIterator[bytes]:
+    if isinstance(chunks, AsyncIterable):
+        async for chunk in chunks:
+            yield chunk
+    else:
+        for chunk in chunks:
+            yield chunk
+
+
+async def split_chunks(
+    chunks: Chunks, size: int = CHUNK_SIZE
+) -> AsyncIterator[tuple[bytes, bool]]:
+    """re-split chunks into non-empty pieces of at most `size` bytes
+
+    Yields:
+        tuple[bytes, bool]: piece and whether it is the last one
+    """
+    pending = b""
+    async for chunk in _iterate(chunks):
+        for start in range(0, len(chunk), size):
+            if pending:
+                yield pending, False
+            pending = chunk[start : start + size]
+    yield pending, True
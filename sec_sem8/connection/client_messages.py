@@ -42,6 +42,21 @@ class ClientGoodbye(BaseClientMessage):
     id: Literal[4] = 4
 
 
+class ClientChunk(BaseClientMessage):
+    id: Literal[5] = 5
+    data: str  # base64 encoded part of a payload
+    last: bool
+
+
+class FastConnectRequest(BaseClientMessage, extra="forbid"):
+    """ConnectRequest of a client that cached group parameters of the server"""
+
+    id: Literal[6] = 6
+    username: str
+    fingerprint: str
+    client_public_value: int
+
+
 AnyMessage = Union[  # type: ignore
     tuple([*BaseClientMessage.__subclasses__(), UnknownAnswer])  # type: ignore
 ]
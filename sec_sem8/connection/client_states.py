@@ -4,6 +4,7 @@ from abc import ABC, abstractmethod
 from pydantic import BaseModel
 
 from sec_sem8.connection import client_messages, server_messages
+from sec_sem8.diffie_hellman import params_fingerprint
 from sec_sem8.hash_task import PasswordHash, solve_task
 from sec_sem8.rc4 import RC4
 
@@ -36,11 +37,16 @@ class BaseClientState(BaseModel):
     def on_init(self, user: UserData) -> Transition:
         return error("did not expect init here", self)
 
+    def on_fast_init(self, user: UserData, g: int, p: int) -> Transition:
+        return error("did not expect init here", self)
+
     def on_message(
         self, message: server_messages.BaseServerMessage, user: UserData
     ) -> Transition:
         if isinstance(message, server_messages.Nonce):
             return self.on_nonce(message, user)
+        elif isinstance(message, server_messages.FastNonce):
+            return self.on_fast_nonce(message, user)
         elif isinstance(message, server_messages.DiffieRequest):
             return self.on_diffie_request(message, user)
         elif isinstance(message, server_messages.DiffieOk):
@@ -53,6 +59,11 @@ class BaseClientState(BaseModel):
     def on_nonce(self, message: server_messages.Nonce, user: UserData) -> Transition:
         return self.error("did not expect nonce")
 
+    def on_fast_nonce(
+        self, message: server_messages.FastNonce, user: UserData
+    ) -> Transition:
+        return self.error("did not expect fast nonce")
+
     def on_diffie_request(
         self, message: server_messages.DiffieRequest, user: UserData
     ) -> Transition:
@@ -73,6 +84,15 @@ class StartState(BaseClientState):
         message = client_messages.ConnectRequest(username=user.username)
         return message, NonceRequested()
 
+    def on_fast_init(self, user: UserData, g: int, p: int) -> Transition:
+        client_secret = random.randint(a=2, b=p - 1)
+        message = client_messages.FastConnectRequest(
+            username=user.username,
+            fingerprint=params_fingerprint(g, p),
+            client_public_value=pow(g, client_secret, p),
+        )
+        return message, FastNonceRequested(p=p, client_secret=client_secret)
+
 
 class NonceRequested(BaseClientState):
     def on_nonce(self, message: server_messages.Nonce, user: UserData) -> Transition:
@@ -81,6 +101,22 @@ class NonceRequested(BaseClientState):
         return answer_message, DiffieStarted()
 
 
+class FastNonceRequested(NonceRequested):
+    """sent FastConnectRequest, server may still fall back to plain Nonce"""
+
+    p: int
+    client_secret: int
+
+    def on_fast_nonce(
+        self, message: server_messages.FastNonce, user: UserData
+    ) -> Transition:
+        answer = solve_task(user.password_hash, message.nonce)
+        key = pow(message.server_public_value, self.client_secret, self.p)
+        return client_messages.HashAnswer(answer=answer), DiffieDone(
+            key=key, rc4=RC4(key)
+        )
+
+
 class DiffieStarted(BaseClientState):
     def on_diffie_request(
         self, message: server_messages.DiffieRequest, user: UserData
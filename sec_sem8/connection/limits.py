@@ -0,0 +1,200 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Optional
+
+from pydantic import BaseModel
+
+from sec_sem8.connection.server_messages import ServerError
+from sec_sem8.metrics import REGISTRY
+
+connections_rejected = REGISTRY.counter(
+    "sec_sem8_connections_rejected_total",
+    "connections refused before handshake",
+    ["reason"],
+)
+loop_lag = REGISTRY.gauge(
+    "sec_sem8_event_loop_lag_seconds", "how late the last lag probe woke up"
+)
+
+LOCAL = "local"
+"""address of peers without one: unix socket and in-process clients"""
+
+
+class ConnectionLimits(BaseModel):
+    handshake_stage_timeout: Optional[float] = 10.0
+    """seconds to wait for each handshake message"""
+    stage_timeouts: dict[str, float] = {}
+    """per handshake state overrides of handshake_stage_timeout, e.g. {"Start": 2}"""
+    idle_timeout: Optional[float] = 300.0
+    """seconds an established session may stay silent"""
+    max_frame_size: int = 64 * 1024
+    """longest accepted line from client, in bytes"""
+    max_message_size: int = 16 * 1024 * 1024
+    """longest message reassembled from chunk frames, in bytes"""
+    max_connections: Optional[int] = 10000
+    max_connections_per_ip: Optional[int] = 128
+    handshake_rate_per_ip: Optional[float] = 50.0
+    """handshakes per second a source address may start, on average"""
+    handshake_burst_per_ip: int = 100
+    limit_local_peers: bool = False
+    """apply the per address limits to LOCAL peers too, they share one address"""
+    handshake_rate_per_user: Optional[float] = 10.0
+    handshake_burst_per_user: int = 20
+    max_loop_lag: Optional[float] = 0.5
+    """seconds of event loop scheduling delay above which new handshakes are shed"""
+    loop_lag_interval: float = 0.1
+
+    def stage_timeout(self, stage: str) -> Optional[float]:
+        return self.stage_timeouts.get(stage, self.handshake_stage_timeout)
+
+
+def rejection_frame(reason: str) -> bytes:
+    return (ServerError(text=f"error: {reason}").json() + "\n").encode()
+
+
+class RateLimiter:
+    """token bucket per key: `burst` tokens, refilled at `rate` per second"""
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100_000) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: dict[str, tuple[float, float]] = {}
+        """key to tokens and time they were counted at"""
+
+    def allow(self, key: str, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        tokens, last = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return False
+        if key not in self.buckets and len(self.buckets) >= self.max_keys:
+            self._prune(now)
+        self.buckets[key] = (tokens - 1, now)
+        return True
+
+    def _prune(self, now: float):
+        """forget refilled buckets, they are the same as new ones"""
+        for key, (tokens, last) in list(self.buckets.items()):
+            if tokens + (now - last) * self.rate >= self.burst:
+                del self.buckets[key]
+        if len(self.buckets) >= self.max_keys:
+            for key in list(self.buckets)[: len(self.buckets) // 2]:
+                del self.buckets[key]
+
+
+class LoopLagMonitor:
+    """measures how late the event loop runs a callback scheduled `interval` ahead
+
+    A spike fades out by DECAY per interval instead of being forgotten on the
+    next probe, so load is shed for a while after the loop was stuck.
+    """
+
+    DECAY = 0.8
+
+    def __init__(self, interval: float = 0.1) -> None:
+        self.interval = interval
+        self.lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - expected, self.lag * self.DECAY)
+            loop_lag.set(self.lag)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class ConnectionLimiter:
+    """admission of new connections
+
+    Counts open connections globally and per source address, rate limits
+    handshake starts per address and per username, and sheds new connections
+    while the event loop lags. Established sessions are never touched.
+    """
+
+    REJECT_FULL = rejection_frame("server is full")
+    REJECT_PER_IP = rejection_frame("too many connections from address")
+    REJECT_OVERLOADED = rejection_frame("server is overloaded, retry later")
+    REJECT_IP_RATE = rejection_frame("too many handshakes from address")
+
+    def __init__(self, limits: ConnectionLimits) -> None:
+        self.limits = limits
+        self.total = 0
+        self.per_ip: Counter[str] = Counter()
+        self.lag = LoopLagMonitor(limits.loop_lag_interval)
+        self.ip_rate = None
+        if limits.handshake_rate_per_ip is not None:
+            self.ip_rate = RateLimiter(
+                limits.handshake_rate_per_ip, limits.handshake_burst_per_ip
+            )
+        self.user_rate = None
+        if limits.handshake_rate_per_user is not None:
+            self.user_rate = RateLimiter(
+                limits.handshake_rate_per_user, limits.handshake_burst_per_user
+            )
+
+    def start(self):
+        """start lag monitor on running loop"""
+        if self.limits.max_loop_lag is not None:
+            self.lag.start()
+
+    def try_acquire(self, address: str) -> Optional[bytes]:
+        """take a slot for address
+
+        Returns:
+            Optional[bytes]: None if admitted, otherwise frame to send before closing
+        """
+        limits = self.limits
+        per_ip = address != LOCAL or limits.limit_local_peers
+        if limits.max_loop_lag is not None and self.lag.lag > limits.max_loop_lag:
+            connections_rejected.labels("overloaded").inc()
+            return self.REJECT_OVERLOADED
+        if per_ip and self.ip_rate is not None and not self.ip_rate.allow(address):
+            connections_rejected.labels("handshake_rate_per_ip").inc()
+            return self.REJECT_IP_RATE
+        if limits.max_connections is not None and self.total >= limits.max_connections:
+            connections_rejected.labels("max_connections").inc()
+            return self.REJECT_FULL
+        if (
+            per_ip
+            and limits.max_connections_per_ip is not None
+            and self.per_ip[address] >= limits.max_connections_per_ip
+        ):
+            connections_rejected.labels("max_connections_per_ip").inc()
+            return self.REJECT_PER_IP
+        self.total += 1
+        self.per_ip[address] += 1
+        return None
+
+    def admit_user(self, username: str) -> bool:
+        """take a handshake token of username"""
+        if self.user_rate is None or self.user_rate.allow(username):
+            return True
+        connections_rejected.labels("handshake_rate_per_user").inc()
+        return False
+
+    def release(self, address: str):
+        self.total -= 1
+        self.per_ip[address] -= 1
+        if self.per_ip[address] <= 0:
+            del self.per_ip[address]
+
+
+def peer_address(writer) -> str:
+    peername = writer.get_extra_info("peername")
+    if isinstance(peername, tuple) and peername:
+        return str(peername[0])
+    return LOCAL
@@ -0,0 +1,260 @@
+import asyncio
+import contextlib
+import itertools
+from asyncio.streams import StreamWriter
+from collections import deque
+from typing import Literal, NoReturn, Optional, cast, get_args
+
+from pydantic import BaseModel
+
+from sec_sem8.metrics import REGISTRY
+
+queue_bytes = REGISTRY.gauge(
+    "sec_sem8_outbound_queue_bytes",
+    "bytes waiting in connection outbound queue",
+    ["connection"],
+)
+queue_frames = REGISTRY.gauge(
+    "sec_sem8_outbound_queue_frames",
+    "frames waiting in connection outbound queue",
+    ["connection"],
+)
+frames_dropped = REGISTRY.counter(
+    "sec_sem8_outbound_frames_dropped_total",
+    "replies replaced by a short error for slow clients",
+)
+clients_evicted = REGISTRY.counter(
+    "sec_sem8_outbound_clients_evicted_total",
+    "connections closed for falling behind",
+    ["reason"],
+)
+
+frames_per_write = REGISTRY.histogram(
+    "sec_sem8_frames_per_write",
+    "frames handed to the transport in one write, _count / _sum is writes "
+    "(send syscalls at most) per frame",
+    ["side"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+server_frames_per_write = frames_per_write.labels("server")
+
+_connection_ids = itertools.count(1)
+
+
+async def drain(writer: StreamWriter, timeout: Optional[float]):
+    """writer.drain() with a deadline, only waits above transport watermark"""
+    if not hasattr(asyncio, "timeout"):  # python < 3.11
+        return await asyncio.wait_for(writer.drain(), timeout)
+    # unlike wait_for, does not start a task for every drain
+    async with asyncio.timeout(timeout):
+        await writer.drain()
+
+
+class SlowClientError(ConnectionError):
+    pass
+
+
+OutboundPolicy = Literal["disconnect", "drop"]
+
+
+def parse_policy(text: str) -> OutboundPolicy:
+    if text not in get_args(OutboundPolicy):
+        raise ValueError(
+            f"unknown outbound policy {text!r}, use {list(get_args(OutboundPolicy))}"
+        )
+    return cast(OutboundPolicy, text)
+
+
+class OutboundLimits(BaseModel):
+    high_watermark: int = 256 * 1024
+    """senders wait once this many bytes are queued..."""
+    low_watermark: int = 64 * 1024
+    """...until the queue drains below this"""
+    max_bytes: int = 4 * 1024 * 1024
+    """frames that do not fit are handled according to policy"""
+    drain_timeout: float = 10.0
+    """seconds a client may take to accept a frame or free the queue"""
+    policy: OutboundPolicy = "disconnect"
+    """on overflow disconnect, or drop: answer with a short error instead,
+    every request still gets exactly one reply"""
+
+
+class OutboundQueue:
+    """bounded queue of encoded frames written to a StreamWriter by its own task
+
+    Frames are encrypted before they are queued, and dropping an encrypted
+    frame would desync the RC4 keystream. That is why overflow is checked with
+    reserve() before a frame is built, when skipping it is still safe.
+
+    Most connections are idle most of the time, so an empty queue holds no
+    task, deque or future: the writer task is started by put() and exits once
+    the queue is drained.
+
+    Frames queued in the same loop iteration, e.g. the chunks of one answer,
+    go to the transport in one writelines() call, up to high_watermark bytes.
+    """
+
+    __slots__ = (
+        "writer",
+        "limits",
+        "name",
+        "_frames",
+        "_queued_bytes",
+        "_below_low",
+        "_error",
+        "_task",
+        "_closing",
+        "_bytes_gauge",
+        "_frames_gauge",
+    )
+
+    def __init__(
+        self, writer: StreamWriter, limits: Optional[OutboundLimits] = None
+    ) -> None:
+        self.writer = writer
+        self.limits = limits or OutboundLimits()
+        self.name = str(next(_connection_ids))
+
+        self._frames: Optional[deque[bytes]] = None
+        self._queued_bytes = 0
+        self._below_low: Optional[asyncio.Future] = None
+        """senders wait on it while queue is above high watermark"""
+        self._error: Optional[BaseException] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        self._bytes_gauge = queue_bytes.labels(self.name)
+        self._frames_gauge = queue_frames.labels(self.name)
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames) if self._frames is not None else 0
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._queued_bytes
+
+    def _update_gauges(self):
+        self._bytes_gauge.set(self._queued_bytes)
+        self._frames_gauge.set(self.depth)
+
+    def _check(self):
+        if self._error is not None:
+            raise SlowClientError("connection was evicted") from self._error
+
+    def _release_senders(self):
+        if self._below_low is not None:
+            if not self._below_low.done():
+                self._below_low.set_result(None)
+            self._below_low = None
+
+    def _evict(self, reason: str) -> NoReturn:
+        if self._error is None:
+            clients_evicted.labels(reason).inc()
+            self._error = SlowClientError(reason)
+            self._frames = None
+            self._queued_bytes = 0
+            self._update_gauges()
+            self._release_senders()
+            self.writer.transport.abort()
+        raise SlowClientError(reason)
+
+    def reserve(self, size: int) -> bool:
+        """check that a frame of about `size` bytes fits before building it
+
+        Returns:
+            bool: False if frame should be replaced by a short one under
+                drop policy
+
+        Raises:
+            SlowClientError: if client is evicted under disconnect policy
+        """
+        self._check()
+        if self._queued_bytes + size <= self.limits.max_bytes:
+            return True
+        if self.limits.policy == "drop":
+            frames_dropped.inc()
+            return False
+        self._evict("queue overflow")
+
+    def put(self, frame: bytes):
+        """queue frame without waiting"""
+        self._check()
+        if self._frames is None:
+            self._frames = deque()
+        self._frames.append(frame)
+        self._queued_bytes += len(frame)
+        self._update_gauges()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if self._queued_bytes > self.limits.high_watermark and self._below_low is None:
+            self._below_low = asyncio.get_running_loop().create_future()
+
+    async def send(self, frame: bytes):
+        """queue frame and wait while queue is above high watermark"""
+        self.put(frame)
+        if self._below_low is None:
+            return
+        try:
+            # shielded, a sender that gives up must not wake the others
+            await asyncio.wait_for(
+                asyncio.shield(self._below_low), self.limits.drain_timeout
+            )
+        except asyncio.TimeoutError:
+            self._evict("backpressure timeout")
+        self._check()
+
+    def _next_batch(self) -> list[bytes]:
+        assert self._frames
+        batch: list[bytes] = []
+        size = 0
+        for frame in self._frames:
+            if batch and size + len(frame) > self.limits.high_watermark:
+                break
+            batch.append(frame)
+            size += len(frame)
+        return batch
+
+    async def _run(self):
+        while self._frames:
+            batch = self._next_batch()
+            # counted first, a peer may already see the frames once written
+            server_frames_per_write.observe(len(batch))
+            self.writer.writelines(batch)
+            try:
+                await drain(self.writer, self.limits.drain_timeout)
+            except asyncio.TimeoutError:
+                if not self._closing:  # close() gives up on the client itself
+                    with contextlib.suppress(SlowClientError):
+                        self._evict("drain timeout")
+                return
+            except ConnectionError as e:
+                self._error = e
+                self._release_senders()
+                return
+            for frame in batch:
+                self._frames.popleft()
+                self._queued_bytes -= len(frame)
+            self._update_gauges()
+            if self._queued_bytes <= self.limits.low_watermark:
+                self._release_senders()
+        self._frames = None
+        self._task = None
+
+    async def flush(self, timeout: Optional[float] = None):
+        """wait until every queued frame was handed to the transport"""
+        if self._task is not None:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        self._check()
+
+    async def close(self):
+        """flush what the client still accepts, then stop writer task"""
+        self._closing = True
+        try:
+            await self.flush(self.limits.drain_timeout)
+        except (asyncio.TimeoutError, SlowClientError):
+            pass
+        if self._task is not None:
+            self._task.cancel()
+        queue_bytes.remove(self.name)
+        queue_frames.remove(self.name)
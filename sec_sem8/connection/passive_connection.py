@@ -1,16 +1,30 @@
+import asyncio
 import base64
+import contextlib
+import time
 from asyncio.streams import StreamReader, StreamWriter
-from typing import NoReturn, Optional, Callable
+from typing import AsyncIterator, NoReturn, Optional, Callable
 
+from sec_sem8.connection.chunks import CHUNK_SIZE, Chunks, split_chunks
 from sec_sem8.connection.client_messages import (
     BaseClientMessage,
+    ClientChunk,
     ClientData,
     ClientError,
     ClientGoodbye,
+    ConnectRequest,
+    FastConnectRequest,
     UnknownAnswer,
     parse,
 )
-from sec_sem8.connection.server_messages import BaseServerMessage, ServerCryptogramm
+from sec_sem8.connection.limits import ConnectionLimits
+from sec_sem8.connection.outbound import OutboundLimits, OutboundQueue
+from sec_sem8.connection.server_messages import (
+    BaseServerMessage,
+    ServerChunk,
+    ServerError,
+    ServerCryptogramm,
+)
 from sec_sem8.connection.server_states import (
     BaseState,
     Closed,
@@ -19,10 +33,87 @@ from sec_sem8.connection.server_states import (
     Start,
     World,
 )
+from sec_sem8.log import get_logger
+from sec_sem8.metrics import REGISTRY
 from sec_sem8.rc4 import xor_bytes
 
+handshake_stage_seconds = REGISTRY.histogram(
+    "sec_sem8_handshake_stage_seconds",
+    "time spent in handshake state, waiting for client included",
+    ["stage"],
+)
+handshake_stage_processing_seconds = REGISTRY.histogram(
+    "sec_sem8_handshake_stage_processing_seconds",
+    "server time to process client message in handshake state",
+    ["stage"],
+)
+handshake_seconds = REGISTRY.histogram(
+    "sec_sem8_handshake_seconds", "handshake duration", ["outcome"]
+)
+frames_total = REGISTRY.counter(
+    "sec_sem8_frames_total", "protocol frames", ["direction", "type"]
+)
+cipher_bytes_total = REGISTRY.counter(
+    "sec_sem8_cipher_bytes_total", "payload bytes passed through rc4", ["direction"]
+)
+encrypted_bytes = cipher_bytes_total.labels("out")
+decrypted_bytes = cipher_bytes_total.labels("in")
+read_timeouts = REGISTRY.counter(
+    "sec_sem8_read_timeouts_total", "connections closed on read deadline", ["stage"]
+)
+
+log = get_logger("protocol")
+
+# json envelope of ServerCryptogramm around base64 content
+FRAME_OVERHEAD = 32
+# reader buffer of an idle session is replaced when it grew past this
+IDLE_BUFFER_SIZE = 4096
+# sent in place of a reply that did not fit the outbound queue, clients pair
+# replies with requests by order, so one must be sent
+DROPPED_REPLY = b'{"error": "reply dropped, client reads too slowly"}'
+
+
+async def _read_line(reader: StreamReader, timeout: Optional[float]) -> bytes:
+    if not hasattr(asyncio, "timeout"):  # python < 3.11
+        return await asyncio.wait_for(reader.readline(), timeout)
+    # unlike wait_for, does not start a task for every read
+    async with asyncio.timeout(timeout):
+        return await reader.readline()
+
+
+def _ignore_frame(_: BaseClientMessage | BaseServerMessage):
+    pass
+
+
+def _admit_everyone(_: str) -> bool:
+    return True
+
+
+def _shrink_buffer(reader: StreamReader):
+    """drop the memory a large message left in an empty reader buffer
+
+    bytearray keeps its allocation after being cleared, and an idle session
+    would hold on to it until the next message.
+    """
+    buffer = reader._buffer  # type: ignore
+    if not buffer and buffer.__alloc__() > IDLE_BUFFER_SIZE:
+        reader._buffer = bytearray()  # type: ignore
+
 
 class PassiveConnection:
+    # one per open session, keep idle sessions small
+    __slots__ = (
+        "limits",
+        "verbose",
+        "state",
+        "reader",
+        "writer",
+        "outbound",
+        "world",
+        "intercept_callback",
+        "admit_user",
+    )
+
     def __init__(
         self,
         reader: StreamReader,
@@ -32,86 +123,218 @@ class PassiveConnection:
         intercept_callback: Optional[
             Callable[[BaseClientMessage | BaseServerMessage], None]
         ] = None,
+        outbound_limits: Optional[OutboundLimits] = None,
+        limits: Optional[ConnectionLimits] = None,
+        admit_user: Optional[Callable[[str], bool]] = None,
     ) -> None:
+        """
+        Args:
+            admit_user: asked before a handshake for username is started
+        """
+        self.limits = limits or ConnectionLimits()
         self.verbose = verbose
         self.state: BaseState = Start()
         self.reader = reader
         self.writer = writer
+        self.outbound = OutboundQueue(writer, outbound_limits)
         self.world = world
-        self.intercept_callback = intercept_callback or (lambda _: None)
+        self.intercept_callback = intercept_callback or _ignore_frame
+        self.admit_user = admit_user or _admit_everyone
+
+    async def _close(self):
+        await self.outbound.close()
+        self.writer.close()
+        with contextlib.suppress(ConnectionError):
+            await self.writer.wait_closed()
 
     async def _error_bailout(self, message: str) -> NoReturn:
         self.state = ErrorState(message=message)
 
-        self.writer.close()
-        await self.writer.wait_closed()
+        await self._close()
         raise ValueError(message)
 
-    async def _read_message(self) -> BaseClientMessage:
+    async def _read_message(self, timeout: Optional[float] = None) -> BaseClientMessage:
         try:
-            raw = await self.reader.readline()
+            try:
+                raw = await _read_line(self.reader, timeout)
+            except asyncio.TimeoutError:
+                stage = self.state.__class__.__name__
+                read_timeouts.labels(stage).inc()
+                await self._error_bailout(f"timed out waiting for client in {stage}")
+            except ValueError:
+                await self._error_bailout("frame too large")
             message = raw.decode().strip(" \n")
             decoded = parse(message)
 
             if self.verbose:
-                print("got message:", decoded)
+                log.debug("frame_in", frame=decoded)
 
             if isinstance(decoded, ClientError):
                 await self._error_bailout(decoded.message)
             if isinstance(decoded, UnknownAnswer):
                 await self._error_bailout("got unknown message")
 
+            frames_total.labels("in", decoded.__class__.__name__).inc()
             self.intercept_callback(decoded)
             return decoded
         except UnicodeDecodeError:
             await self._error_bailout("decode error")
 
     async def _write_message(self, message: BaseServerMessage):
+        frames_total.labels("out", message.__class__.__name__).inc()
         self.intercept_callback(message)
-        self.writer.write((message.json() + "\n").encode())
+        await self.outbound.send((message.json() + "\n").encode())
         if self.verbose:
-            print("sent message:", message)
-        await self.writer.drain()
+            log.debug("frame_out", frame=message)
 
     async def handshake(self) -> DiffieDone:
         if self.verbose:
-            print("begin handshake")
-        while True:
-            message = await self._read_message()
-            answer, new_state = self.state.on_message(message, self.world)
-            await self._write_message(answer)
-            self.state = new_state
-            if isinstance(self.state, ErrorState):
-                await self._error_bailout(self.state.message)
-            if isinstance(self.state, DiffieDone):
-                return self.state
+            log.debug("handshake_begin")
+        started = stage_started = time.perf_counter()
+        try:
+            while True:
+                stage = self.state.__class__.__name__
+                message = await self._read_message(self.limits.stage_timeout(stage))
+                if isinstance(
+                    message, (ConnectRequest, FastConnectRequest)
+                ) and not self.admit_user(message.username):
+                    text = "too many handshakes for user, retry later"
+                    await self._write_message(ServerError(text=f"error: {text}"))
+                    await self._error_bailout(text)
+                processing_started = time.perf_counter()
+                answer, new_state = self.state.on_message(message, self.world)
+                handshake_stage_processing_seconds.labels(stage).observe(
+                    time.perf_counter() - processing_started
+                )
+                if answer is not None:
+                    await self._write_message(answer)
+                self.state = new_state
+                now = time.perf_counter()
+                handshake_stage_seconds.labels(stage).observe(now - stage_started)
+                stage_started = now
+                if isinstance(self.state, ErrorState):
+                    await self._error_bailout(self.state.message)
+                if isinstance(self.state, DiffieDone):
+                    handshake_seconds.labels("ok").observe(now - started)
+                    return self.state
+        except BaseException:
+            handshake_seconds.labels("error").observe(time.perf_counter() - started)
+            raise
 
-    async def read_message(self) -> Optional[str]:
+    def _decrypt(self, data: str) -> bytes:
+        assert isinstance(self.state, DiffieDone)
+        b64 = base64.b64decode(data)
+        gamma = self.state.rc4.produce_gamma(len(b64))
+        decrypted = xor_bytes(b64, gamma)
+        decrypted_bytes.inc(len(decrypted))
+        return decrypted
+
+    def _encrypt(self, data: bytes) -> str:
+        assert isinstance(self.state, DiffieDone)
+        gamma = self.state.rc4.produce_gamma(len(data))
+        encrypted = xor_bytes(data, gamma)
+        encrypted_bytes.inc(len(encrypted))
+        return base64.b64encode(encrypted).decode()
+
+    async def _read_payload(self) -> Optional[ClientData | ClientChunk]:
         if not isinstance(self.state, DiffieDone):
             await self._error_bailout("called read in wrong state ()")
-        message = await self._read_message()
+        _shrink_buffer(self.reader)
+        message = await self._read_message(self.limits.idle_timeout)
         if isinstance(message, ClientGoodbye):
             self.state = Closed()
-            self.writer.close()
-            await self.writer.wait_closed()
+            await self._close()
             return None
-        if isinstance(message, ClientData):
-            b64 = base64.b64decode(message.data)
-            gamma = self.state.rc4.produce_gamma(len(b64))
-            decrypted = xor_bytes(b64, gamma)
-            return decrypted.decode()
+        if isinstance(message, (ClientData, ClientChunk)):
+            return message
 
         await self._error_bailout(
             f"unexpected message type {message.__class__.__name__} after key exchange"
         )
 
-    async def write_message(self, message: str):
+    async def read_stream(self) -> AsyncIterator[bytes]:
+        """decrypted parts of next message as they arrive
+
+        A message sent as ClientData comes out as a single part. Nothing is
+        yielded if the client said goodbye instead.
+        """
+        message = await self._read_payload()
+        if isinstance(message, ClientData):
+            yield self._decrypt(message.data)
+            return
+        while message is not None:
+            assert isinstance(message, ClientChunk)
+            yield self._decrypt(message.data)
+            if message.last:
+                return
+            message = await self._read_chunk()
+
+    async def _read_chunk(self) -> ClientChunk:
+        """next frame of a chunked message, anything else ends the session"""
+        frame = await self._read_message(self.limits.idle_timeout)
+        if not isinstance(frame, ClientChunk):
+            await self._error_bailout("chunked message interrupted")
+        return frame
+
+    async def read_message(self) -> Optional[str]:
+        message = await self._read_payload()
+        if message is None:
+            return None
+        if isinstance(message, ClientData):
+            return self._decrypt(message.data).decode()
+
+        parts = [self._decrypt(message.data)]
+        size = len(parts[0])
+        while not message.last:
+            message = await self._read_chunk()
+            parts.append(self._decrypt(message.data))
+            size += len(parts[-1])
+            if size > self.limits.max_message_size:
+                await self._error_bailout("message too large")
+        return b"".join(parts).decode()
+
+    async def write_message(self, message: str) -> bool:
+        """encrypt and queue message for client
+
+        Messages longer than CHUNK_SIZE are sent as chunks, see write_stream.
+
+        Returns:
+            bool: False if DROPPED_REPLY was sent instead because client fell
+                behind
+
+        Raises:
+            SlowClientError: if client fell behind and was disconnected
+        """
         if not isinstance(self.state, DiffieDone):
             await self._error_bailout("called read in wrong state ()")
 
         encoded = message.encode()
-        gamma = self.state.rc4.produce_gamma(len(encoded))
-        encrypted = xor_bytes(encoded, gamma)
-        b64 = base64.b64encode(encrypted)
-        msg = ServerCryptogramm(content=b64.decode())
-        await self._write_message(msg)
+        if len(encoded) > CHUNK_SIZE:
+            await self.write_stream([encoded])
+            return True
+        fits = self.outbound.reserve(len(encoded) * 4 // 3 + FRAME_OVERHEAD)
+        if not fits:
+            encoded = DROPPED_REPLY
+        await self._write_message(ServerCryptogramm(content=self._encrypt(encoded)))
+        return fits
+
+    async def write_stream(self, chunks: Chunks):
+        """encrypt and send one message made of chunks, without joining them
+
+        Payload is split into ServerChunk frames of at most CHUNK_SIZE bytes,
+        so neither side keeps the whole message nor hits the line limit. A
+        payload that fits into one frame goes out as plain ServerCryptogramm.
+        Chunks are never dropped: the outbound queue applies backpressure
+        and disconnects a client that stops reading.
+        """
+        if not isinstance(self.state, DiffieDone):
+            await self._error_bailout("called write in wrong state ()")
+
+        first = True
+        async for part, last in split_chunks(chunks):
+            content = self._encrypt(part)
+            if first and last:
+                await self._write_message(ServerCryptogramm(content=content))
+            else:
+                await self._write_message(ServerChunk(content=content, last=last))
+            first = False
@@ -0,0 +1,285 @@
+import asyncio
+import contextlib
+import time
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from pydantic import BaseModel
+
+from sec_sem8.connection.active_connection import ActiveConnection, ParamsCache
+from sec_sem8.connection.client_states import UserData
+from sec_sem8.connection.transport import Connector
+
+
+class PoolClosedError(RuntimeError):
+    pass
+
+
+class PoolStats(BaseModel):
+    size: int
+    idle: int
+    in_use: int
+    opening: int
+    waiters: int
+    handshakes: int
+    failed_handshakes: int
+    handshakes_per_second: float
+    checkout_latency_mean: float
+    checkout_latency_p95: float
+    checkout_latency_max: float
+
+
+class _PooledConnection:
+    def __init__(self, connection: ActiveConnection) -> None:
+        self.connection = connection
+        self.idle_since = time.monotonic()
+
+
+class ActiveConnectionPool:
+    """keeps up to `size` handshaked sessions for one user and server
+
+    At least `min_size` sessions are kept warm by a background task, which also
+    drops sessions the server has closed and expires sessions that were idle
+    for longer than `max_idle_time` seconds.
+    """
+
+    STATS_WINDOW = 1024
+    HANDSHAKE_RATE_WINDOW = 10.0
+
+    def __init__(
+        self,
+        user_data: UserData,
+        server: str = "127.0.0.1",
+        port: int = 4433,
+        size: int = 4,
+        min_size: int = 1,
+        max_idle_time: float = 60.0,
+        health_check_interval: float = 5.0,
+        verbose: bool = False,
+        fast_handshake: bool = False,
+        connector: Optional[Connector] = None,
+        unix_path: Optional[str] = None,
+    ) -> None:
+        if not 0 <= min_size <= size:
+            raise ValueError("pool min_size must be between 0 and size")
+        self.user_data = user_data
+        self.conn_params = (server, port)
+        self.size = size
+        self.min_size = min_size
+        self.max_idle_time = max_idle_time
+        self.health_check_interval = health_check_interval
+        self.verbose = verbose
+        self.connector = connector
+        self.unix_path = unix_path
+        # first session learns group parameters, the rest open in one round trip
+        self.params_cache: Optional[ParamsCache] = {} if fast_handshake else None
+
+        self._idle: deque[_PooledConnection] = deque()
+        self._in_use: set[ActiveConnection] = set()
+        self._opening = 0
+        self._waiters = 0
+        self._closed = False
+        self._cond = asyncio.Condition()
+        self._maintenance: Optional[asyncio.Task] = None
+
+        self._handshakes = 0
+        self._failed_handshakes = 0
+        self._handshake_times: deque[float] = deque(maxlen=self.STATS_WINDOW)
+        self._checkout_latencies: deque[float] = deque(maxlen=self.STATS_WINDOW)
+
+    def _total(self) -> int:
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    async def start(self):
+        await self._replenish()
+        self._maintenance = asyncio.create_task(self._maintain())
+
+    async def _open(self) -> ActiveConnection:
+        connection = ActiveConnection(
+            self.user_data,
+            *self.conn_params,
+            self.verbose,
+            self.params_cache,
+            self.connector,
+            self.unix_path,
+        )
+        try:
+            await connection.connect()
+            await connection.handshake()
+        except Exception:
+            self._failed_handshakes += 1
+            raise
+        self._handshakes += 1
+        self._handshake_times.append(time.monotonic())
+        return connection
+
+    @staticmethod
+    def _is_healthy(connection: ActiveConnection) -> bool:
+        return (
+            connection.is_open()
+            and connection.writer is not None
+            and not connection.writer.is_closing()
+            and connection.reader is not None
+            and not connection.reader.at_eof()
+        )
+
+    @staticmethod
+    async def _close_connection(connection: ActiveConnection):
+        with contextlib.suppress(Exception):
+            if connection.is_open():
+                await connection.say_goodbye()
+            elif connection.writer is not None:
+                connection.writer.close()
+
+    async def checkout(self, timeout: Optional[float] = None) -> ActiveConnection:
+        """take a healthy session out of the pool, opening one if there is room
+
+        Raises:
+            asyncio.TimeoutError: if no session became available in time
+            PoolClosedError: if pool was closed
+        """
+        started = time.monotonic()
+        connection = await asyncio.wait_for(self._checkout(), timeout)
+        self._checkout_latencies.append(time.monotonic() - started)
+        return connection
+
+    async def _checkout(self) -> ActiveConnection:
+        async with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolClosedError("pool is closed")
+                while self._idle:
+                    pooled = self._idle.pop()
+                    if self._is_healthy(pooled.connection):
+                        self._in_use.add(pooled.connection)
+                        return pooled.connection
+                    asyncio.create_task(self._close_connection(pooled.connection))
+                if self._total() < self.size:
+                    self._opening += 1
+                    break
+                self._waiters += 1
+                try:
+                    await self._cond.wait()
+                finally:
+                    self._waiters -= 1
+
+        try:
+            connection = await self._open()
+        except BaseException:
+            async with self._cond:
+                self._opening -= 1
+                self._cond.notify()
+            raise
+        async with self._cond:
+            self._opening -= 1
+            self._in_use.add(connection)
+        return connection
+
+    async def checkin(self, connection: ActiveConnection, discard: bool = False):
+        """return session to the pool; broken or discarded sessions are closed"""
+        async with self._cond:
+            self._in_use.discard(connection)
+            keep = not discard and not self._closed and self._is_healthy(connection)
+            if keep:
+                self._idle.append(_PooledConnection(connection))
+            self._cond.notify()
+        if not keep:
+            await self._close_connection(connection)
+
+    @contextlib.asynccontextmanager
+    async def connection(
+        self, timeout: Optional[float] = None
+    ) -> AsyncIterator[ActiveConnection]:
+        """checkout for the duration of the block, session is discarded on error"""
+        connection = await self.checkout(timeout)
+        try:
+            yield connection
+        except BaseException:
+            await self.checkin(connection, discard=True)
+            raise
+        await self.checkin(connection)
+
+    async def _replenish(self):
+        async with self._cond:
+            missing = self.min_size - self._total()
+            if missing <= 0 or self._closed:
+                return
+            self._opening += missing
+
+        results = await asyncio.gather(
+            *(self._open() for _ in range(missing)), return_exceptions=True
+        )
+
+        async with self._cond:
+            self._opening -= missing
+            for result in results:
+                if isinstance(result, ActiveConnection):
+                    if self._closed:
+                        asyncio.create_task(self._close_connection(result))
+                    else:
+                        self._idle.append(_PooledConnection(result))
+            self._cond.notify_all()
+
+    async def _expire(self):
+        now = time.monotonic()
+        dropped = []
+        async with self._cond:
+            for pooled in list(self._idle):
+                expired = now - pooled.idle_since > self.max_idle_time
+                if not self._is_healthy(pooled.connection) or (
+                    expired and self._total() > self.min_size
+                ):
+                    self._idle.remove(pooled)
+                    dropped.append(pooled.connection)
+            if dropped:
+                self._cond.notify_all()
+        for connection in dropped:
+            await self._close_connection(connection)
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            with contextlib.suppress(Exception):
+                await self._expire()
+                await self._replenish()
+
+    def stats(self) -> PoolStats:
+        now = time.monotonic()
+        recent = sum(
+            1 for t in self._handshake_times if now - t <= self.HANDSHAKE_RATE_WINDOW
+        )
+        latencies = sorted(self._checkout_latencies)
+        return PoolStats(
+            size=self._total(),
+            idle=len(self._idle),
+            in_use=len(self._in_use),
+            opening=self._opening,
+            waiters=self._waiters,
+            handshakes=self._handshakes,
+            failed_handshakes=self._failed_handshakes,
+            handshakes_per_second=recent / self.HANDSHAKE_RATE_WINDOW,
+            checkout_latency_mean=sum(latencies) / len(latencies) if latencies else 0.0,
+            checkout_latency_p95=(
+                latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0
+            ),
+            checkout_latency_max=latencies[-1] if latencies else 0.0,
+        )
+
+    async def close(self):
+        async with self._cond:
+            self._closed = True
+            idle = [pooled.connection for pooled in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._maintenance
+        await asyncio.gather(*(self._close_connection(c) for c in idle))
+
+    async def __aenter__(self) -> "ActiveConnectionPool":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
@@ -34,6 +34,21 @@ class ServerCryptogramm(BaseServerMessage):
     content: str
 
 
+class ServerChunk(BaseServerMessage):
+    id: Literal[4] = 4
+    content: str  # base64 encoded part of a payload
+    last: bool
+
+
+class FastNonce(BaseServerMessage, extra="forbid"):
+    """Nonce and DiffieRequest in one, answer to FastConnectRequest"""
+
+    id: Literal[5] = 5
+    nonce: str
+    server_public_value: int
+    fingerprint: str
+
+
 class UnknownMessage(BaseModel):
     pass
 
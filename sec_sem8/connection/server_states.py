@@ -1,13 +1,15 @@
 import random
 from abc import ABC, abstractmethod
+from typing import Optional
 
 from pydantic import BaseModel
 
 from sec_sem8.connection import client_messages, server_messages
+from sec_sem8.diffie_hellman import params_fingerprint
 from sec_sem8.hash_task import PasswordHash, solve_task
 from sec_sem8.rc4 import RC4
 
-TransitionResult = tuple[server_messages.BaseServerMessage, "BaseState"]
+TransitionResult = tuple[Optional[server_messages.BaseServerMessage], "BaseState"]
 
 
 class World(ABC):
@@ -33,6 +35,8 @@ class BaseState(BaseModel):
     ) -> TransitionResult:
         if isinstance(message, client_messages.ConnectRequest):
             return self.on_connect_request(message, world)
+        elif isinstance(message, client_messages.FastConnectRequest):
+            return self.on_fast_connect_request(message, world)
         elif isinstance(message, client_messages.HashAnswer):
             return self.on_hash_answer(message, world)
         elif isinstance(message, client_messages.DiffieAnswer):
@@ -45,6 +49,11 @@ class BaseState(BaseModel):
     ) -> TransitionResult:
         return error("did not expect connect request", self)
 
+    def on_fast_connect_request(
+        self, message: client_messages.FastConnectRequest, world: World
+    ) -> TransitionResult:
+        return error("did not expect connect request", self)
+
     def on_hash_answer(
         self, message: client_messages.HashAnswer, world: World
     ) -> TransitionResult:
@@ -81,6 +90,52 @@ class Start(BaseState):
         else:
             return error("user does not exist", self)
 
+    def on_fast_connect_request(
+        self, message: client_messages.FastConnectRequest, world: World
+    ) -> TransitionResult:
+        """start key exchange together with password check
+
+        If the client cached other parameters it gets a plain Nonce and
+        the usual exchange follows.
+        """
+        if not world.has_user(message.username):
+            return error("user does not exist", self)
+        g, p = world.get_diffie_params(message.username)
+        fingerprint = params_fingerprint(g, p)
+        if message.fingerprint != fingerprint:
+            return self.on_connect_request(
+                client_messages.ConnectRequest(username=message.username), world
+            )
+
+        nonce = random.randbytes(32).hex()
+        server_secret = random.randint(a=2, b=p - 1)
+        server_public = pow(g, server_secret, p)
+        shared_key = pow(message.client_public_value, server_secret, p)
+        return server_messages.FastNonce(
+            nonce=nonce, server_public_value=server_public, fingerprint=fingerprint
+        ), FastTaskRequested(
+            nonce=nonce, username=message.username, shared_key=shared_key
+        )
+
+
+class FastTaskRequested(BaseState):
+    nonce: str
+    username: str
+    shared_key: int
+
+    def on_hash_answer(
+        self, message: client_messages.HashAnswer, world: World
+    ) -> TransitionResult:
+        """nothing is sent on success, client goes on with encrypted data"""
+        pass_hash = world.get_user_password_hash(self.username)
+        if message.answer != solve_task(pass_hash, self.nonce):
+            return error("wrong hash answer", self)
+        return None, DiffieDone(
+            username=self.username,
+            shared_key=self.shared_key,
+            rc4=RC4(self.shared_key),
+        )
+
 
 class TaskRequested(BaseState):
     nonce: str
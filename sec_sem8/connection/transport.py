@@ -0,0 +1,137 @@
+"""in-process transport that connects a client and a server without sockets
+
+MemoryTransport implements asyncio.Transport over a pair of protocols, so
+both ends still get real StreamReader/StreamWriter objects and
+PassiveConnection and ActiveConnection do not know the difference:
+
+    server = ChatServer(world)
+    connection = ActiveConnection(user, connector=memory_connector(server.handle_client))
+
+Writes are handed to the peer protocol right away. When the peer reader
+buffer is full, it pauses reading and this pauses the writer, so drain()
+applies backpressure the way a socket does.
+"""
+import asyncio
+import itertools
+from typing import Any, Awaitable, Callable, Optional
+
+Streams = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+Connector = Callable[[], Awaitable[Streams]]
+"""opens a client connection, asyncio.open_connection for TCP"""
+ClientHandler = Callable[[asyncio.StreamReader, asyncio.StreamWriter], Any]
+
+STREAM_LIMIT = 2**16
+_pipe_ids = itertools.count(1)
+
+
+class MemoryTransport(asyncio.Transport):
+    def __init__(self, loop: asyncio.AbstractEventLoop, name: tuple[str, int]) -> None:
+        # no peer address, so limits treat the other end as LOCAL
+        super().__init__({"peername": None, "sockname": name})
+        self._loop = loop
+        self._protocol: Optional[asyncio.BaseProtocol] = None
+        self._peer: Optional["MemoryTransport"] = None
+        self._closing = False
+        self._eof_sent = False
+        self._reading = True
+
+    def set_protocol(self, protocol: asyncio.BaseProtocol):
+        self._protocol = protocol
+
+    def get_protocol(self) -> asyncio.BaseProtocol:
+        assert self._protocol is not None
+        return self._protocol
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def is_reading(self) -> bool:
+        return self._reading
+
+    def pause_reading(self):
+        # the peer is the one producing data, stop its writer instead
+        if self._reading and self._peer is not None and not self._peer._closing:
+            self._reading = False
+            self._peer._protocol.pause_writing()  # type: ignore
+
+    def resume_reading(self):
+        if not self._reading and self._peer is not None and not self._peer._closing:
+            self._reading = True
+            self._peer._protocol.resume_writing()  # type: ignore
+
+    def write(self, data: bytes | bytearray | memoryview):
+        if self._closing or self._eof_sent or not data:
+            return
+        peer = self._peer
+        if peer is not None and not peer._closing:
+            peer._protocol.data_received(bytes(data))  # type: ignore
+
+    def can_write_eof(self) -> bool:
+        return True
+
+    def write_eof(self):
+        if self._eof_sent:
+            return
+        self._eof_sent = True
+        peer = self._peer
+        if peer is not None and not peer._closing:
+            self._loop.call_soon(peer._protocol.eof_received)  # type: ignore
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def get_write_buffer_limits(self) -> tuple[int, int]:
+        return 0, 0
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def close(self):
+        if self._closing:
+            return
+        self.resume_reading()  # nothing will read the rest, release the peer
+        self.write_eof()
+        self._closing = True
+        self._loop.call_soon(self._protocol.connection_lost, None)  # type: ignore
+
+    def abort(self):
+        self.close()
+
+
+def memory_pipe(
+    client_protocol: asyncio.BaseProtocol, server_protocol: asyncio.BaseProtocol
+) -> tuple[MemoryTransport, MemoryTransport]:
+    """connect two protocols with a pair of transports, must run on the loop"""
+    loop = asyncio.get_running_loop()
+    number = next(_pipe_ids)
+    client = MemoryTransport(loop, ("memory-client", number))
+    server = MemoryTransport(loop, ("memory", number))
+    client._peer, server._peer = server, client
+    client.set_protocol(client_protocol)
+    server.set_protocol(server_protocol)
+    server_protocol.connection_made(server)
+    client_protocol.connection_made(client)
+    return client, server
+
+
+async def open_memory_connection(
+    handler: ClientHandler, limit: int = STREAM_LIMIT
+) -> Streams:
+    """like asyncio.open_connection, with `handler` serving the other end
+
+    `handler` is called as by asyncio.start_server, a coroutine result runs
+    as a task.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=limit, loop=loop)
+    protocol = asyncio.StreamReaderProtocol(reader, loop=loop)
+    server_protocol = asyncio.StreamReaderProtocol(
+        asyncio.StreamReader(limit=limit, loop=loop), handler, loop=loop
+    )
+    transport, _ = memory_pipe(protocol, server_protocol)
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return reader, writer
+
+
+def memory_connector(handler: ClientHandler, limit: int = STREAM_LIMIT) -> Connector:
+    return lambda: open_memory_connection(handler, limit)
@@ -1,3 +1,4 @@
+import hashlib
 import re
 import subprocess
 from math import gcd
@@ -6,6 +7,11 @@ from typing import List
 from sec_sem8.primes import get_random
 
 
+def params_fingerprint(g: int, p: int) -> str:
+    """short id of group parameters, lets a client tell it cached the right ones"""
+    return hashlib.sha1(f"{g}:{p}".encode()).hexdigest()[:16]
+
+
 def find_primitive_root(bitness: int, p: int) -> int:
     totient = p - 1
     divisors = list(set(factorize(totient)))
@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import Iterable, NewType, Optional, Literal
-from pydantic import BaseModel, parse_raw_as
+from typing import Iterable, NamedTuple, NewType, Optional, Literal
+from pydantic import BaseModel, Field, parse_raw_as, root_validator
 
 PasswordHash = NewType("PasswordHash", str)
 
@@ -67,22 +67,132 @@ class Database(ABC):
         """
 
 
+DEFAULT_ROOM = "general"
+"""room every session is in after handshake"""
+
+
 class Message(BaseModel):
     author: str
     content: str
 
 
+class StoredMessage(NamedTuple):
+    id: int
+    room: str
+    position: int
+    """number of message in its room, kept when older ones are removed"""
+    created: float
+    """unix time message was stored"""
+    message: Message
+
+
+class MessageLog(ABC):
+    @abstractmethod
+    def append(self, message: Message, room: str = DEFAULT_ROOM) -> int:
+        """store message at the end of the log
+
+        Args:
+            message (Message): message to store
+            room (str): room message was written to
+
+        Returns:
+            int: id of stored message, ids grow in log order
+        """
+
+    @abstractmethod
+    def read_since(self, after_id: int) -> list[tuple[int, str, Message]]:
+        """get messages stored after message with provided id
+
+        Args:
+            after_id (int): id of last known message, 0 to read whole log
+
+        Returns:
+            list[tuple[int, str, Message]]: ids, rooms and messages in log order
+        """
+
+    @abstractmethod
+    def read_stored_since(self, after_id: int) -> list[StoredMessage]:
+        """like read_since, with position and creation time of messages"""
+
+    @abstractmethod
+    def remove_before(self, room: str, position: int, limit: int) -> int:
+        """remove up to `limit` messages of room at positions below `position`
+
+        Returns:
+            int: number of removed messages, below limit once none are left
+        """
+
+    @abstractmethod
+    def remove_positions(self, room: str, positions: Iterable[int]):
+        """remove messages of room at these positions, missing ones are skipped"""
+
+
+RoomName = Field(DEFAULT_ROOM, min_length=1, max_length=60)
+
+
 class WriteRequest(BaseModel):
     id: Literal[1] = 1
     content: str
+    room: str = RoomName
 
 
 class ReadRequest(BaseModel):
     id: Literal[2] = 2
+    room: str = RoomName
+    after: Optional[int] = Field(default=None, ge=0)
+    """position in the room to read from, a cursor from a previous reply
+
+    Without it the reply is a list of every kept message, [{author, content}].
+    With it the reply is {"messages": [...], "next"}, pass next as after to
+    get only newer messages. Positions never change, so the cursor stays
+    valid when retention removes old messages; removed ones are just not
+    sent. Counting received messages does not give a cursor.
+    """
+
+
+class ReadReply(BaseModel):
+    messages: list[Message]
+    next: int
+    """after of the following ReadRequest"""
+
+
+class JoinRequest(BaseModel):
+    id: Literal[3] = 3
+    room: str = Field(min_length=1, max_length=60)
+
+
+class LeaveRequest(BaseModel):
+    id: Literal[4] = 4
+    room: str = Field(min_length=1, max_length=60)
+
+
+class SearchRequest(BaseModel):
+    """newest room messages containing every word of query, by author if set
+
+    Reply is {"results": [{"position", "author", "content"}], "next"}, pass
+    next as `before` to get the following page, it is null on the last one.
+    """
+
+    id: Literal[5] = 5
+    query: str = Field("", max_length=200)
+    author: Optional[str] = None
+    room: str = RoomName
+    limit: int = Field(50, ge=1, le=500)
+    before: Optional[int] = Field(None, ge=0)
+    """only messages at positions below this one"""
+
+    @root_validator(skip_on_failure=True)
+    def query_or_author(cls, values):
+        if not values["query"].strip() and values["author"] is None:
+            raise ValueError("search needs a query or an author")
+        return values
+
+
+AnyRequest = ReadRequest | WriteRequest | JoinRequest | LeaveRequest | SearchRequest
 
 
-def parse_request(content: str) -> Optional[ReadRequest | WriteRequest]:
+def parse_request(content: str) -> Optional[AnyRequest]:
     try:
-        return parse_raw_as(ReadRequest | WriteRequest, content)  # type: ignore
+        return parse_raw_as(AnyRequest, content)  # type: ignore
     except:
         return None
@@ -0,0 +1,387 @@
+import asyncio
+import json
+import time
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Collection, Iterable, Iterator, Optional
+
+from sec_sem8.entities import DEFAULT_ROOM, Message, MessageLog, StoredMessage
+from sec_sem8.search import RoomIndex, tokenize
+
+READ_REPLY_HEAD = b'{"messages": ['
+"""start of a read reply with a cursor, see ReadRequest.after"""
+
+
+def read_reply_tail(next_position: int) -> bytes:
+    """end of a read reply, next is the `after` of the following read"""
+    return b'], "next": %d}' % next_position
+
+
+class Authors:
+    """author names interned to small ids, shared by all rooms"""
+
+    def __init__(self) -> None:
+        self.names: list[str] = []
+        self.ids: dict[str, int] = {}
+
+    def intern(self, name: str) -> int:
+        author_id = self.ids.get(name)
+        if author_id is None:
+            author_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return author_id
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+class Room:
+    """messages of one room stored as columns
+
+    A message is kept only as its json in `encoded`, followed by a
+    separator, plus its start offset, interned author id, position and
+    creation second in typed arrays. That is about 20 bytes per message on
+    top of the json. The search index takes another 50 to 90 bytes for
+    messages of ten words, see benchmarks/history_memory.py. A read of any
+    suffix of the room is a single slice of `encoded`, and Message objects
+    are built only when asked for.
+
+    Positions number messages in the order they were written and never
+    change, so read and search cursors stay valid after remove(). Indexes
+    like room[i] count kept messages only.
+    """
+
+    SEPARATOR = b", "
+
+    def __init__(self, authors: Optional[Authors] = None) -> None:
+        self.authors = authors if authors is not None else Authors()
+        self.encoded = bytearray()
+        self.offsets = array("Q")
+        """position of each message in encoded"""
+        self.author_ids = array("I")
+        self.positions = array("I")
+        """ascending, with gaps where messages were removed"""
+        self.created = array("I")
+        """unix time in seconds"""
+        self.next_position = 0
+        self.index = RoomIndex()
+
+    def append(
+        self,
+        message: Message,
+        position: Optional[int] = None,
+        created: Optional[float] = None,
+    ):
+        """
+        Args:
+            position: given by the message log, next one by default
+        """
+        if position is None:
+            position = self.next_position
+        self.next_position = position + 1
+        author_id = self.authors.intern(message.author)
+        self.index.add(position, author_id, message.content)
+        self.offsets.append(len(self.encoded))
+        self.author_ids.append(author_id)
+        self.positions.append(position)
+        self.created.append(int(time.time() if created is None else created))
+        self.encoded += json.dumps(message.dict(), ensure_ascii=False).encode()
+        self.encoded += self.SEPARATOR
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def locate(self, position: int) -> int:
+        """index of the first kept message at or after position"""
+        return bisect_left(self.positions, position)
+
+    def message_size(self, index: int) -> int:
+        """bytes of message json, separator included"""
+        end = self.offsets[index + 1] if index + 1 < len(self) else len(self.encoded)
+        return end - self.offsets[index]
+
+    def _end(self, stop: int) -> int:
+        """end of json of message stop - 1"""
+        if stop < len(self.offsets):
+            return self.offsets[stop] - len(self.SEPARATOR)
+        return len(self.encoded) - len(self.SEPARATOR)
+
+    def __getitem__(self, index: int) -> Message:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        return Message.parse_raw(
+            bytes(self.encoded[self.offsets[index] : self._end(index + 1)])
+        )
+
+    def slice(self, start: int = 0, stop: Optional[int] = None) -> list[Message]:
+        """messages start..stop, decoded from a single slice of encoded"""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return []
+        raw = self.encoded[self.offsets[start] : self._end(stop)]
+        return [Message(**fields) for fields in json.loads(b"[" + raw + b"]")]
+
+    def _content(self, index: int) -> str:
+        raw = self.encoded[self.offsets[index] : self._end(index + 1)]
+        return json.loads(raw)["content"]
+
+    def author(self, index: int) -> str:
+        return self.authors.names[self.author_ids[index]]
+
+    def search(
+        self,
+        query: str,
+        author: Optional[str] = None,
+        limit: int = 50,
+        before: Optional[int] = None,
+    ) -> tuple[list[tuple[int, Message]], Optional[int]]:
+        """newest messages with every word of query, by author if given
+
+        Returns:
+            tuple: (position, message) pairs and the `before` cursor of the
+                next page, None when there are no more results
+        """
+        author_id = None
+        if author is not None:
+            author_id = self.authors.ids.get(author)
+            if author_id is None:
+                return [], None
+        found: list[tuple[int, Message]] = []
+        positions = self.index.search(
+            tokenize(query), author_id, self.next_position if before is None else before
+        )
+        for position in positions:
+            if len(found) == limit:
+                return found, found[-1][0]
+            found.append((position, self[self.locate(position)]))
+        return found, None
+
+    def remove(
+        self, before: int = 0, positions: Collection[int] = ()
+    ) -> tuple[int, int]:
+        """drop messages at positions below `before` and at `positions`
+
+        Kept messages are copied into new columns, so a read that is still
+        streaming from the old ones is not affected.
+
+        Returns:
+            tuple[int, int]: number of removed messages and their bytes
+        """
+        start = self.locate(before)
+        dropped = []
+        for position in sorted(positions):
+            index = self.locate(position)
+            if (
+                index >= start
+                and index < len(self)
+                and self.positions[index] == position
+            ):
+                dropped.append(index)
+        if not start and not dropped:
+            return 0, 0
+
+        self.index.discard_before(before)
+        self.index.discard(
+            (self.positions[index], self.author_ids[index], self._content(index))
+            for index in dropped
+        )
+
+        kept = []
+        run_start = start
+        for index in dropped:
+            if index > run_start:
+                kept.append((run_start, index))
+            run_start = index + 1
+        if run_start < len(self):
+            kept.append((run_start, len(self)))
+
+        encoded = bytearray()
+        offsets = array("Q")
+        author_ids = array("I")
+        positions_kept = array("I")
+        created = array("I")
+        for first, stop in kept:
+            begin = self.offsets[first]
+            end = self.offsets[stop] if stop < len(self) else len(self.encoded)
+            shift = len(encoded) - begin
+            offsets.extend([offset + shift for offset in self.offsets[first:stop]])
+            encoded += self.encoded[begin:end]
+            author_ids += self.author_ids[first:stop]
+            positions_kept += self.positions[first:stop]
+            created += self.created[first:stop]
+
+        removed = len(self) - len(offsets), len(self.encoded) - len(encoded)
+        self.encoded = encoded
+        self.offsets = offsets
+        self.author_ids = author_ids
+        self.positions = positions_kept
+        self.created = created
+        return removed
+
+    def encode_chunks(
+        self, chunk_size: int, after: Optional[int] = None
+    ) -> Iterator[bytes]:
+        """
+        Args:
+            after: position of the first message to send, with it the list
+                is wrapped in a reply with the next cursor
+        """
+        if after is None:
+            start, head, tail = 0, b"[", b"]"
+        else:
+            start = self.locate(after)
+            head, tail = READ_REPLY_HEAD, read_reply_tail(self.next_position)
+        if start >= len(self.offsets):
+            yield head + tail
+            return
+        position = self.offsets[start]
+        # slices are copied, so appends during iteration are not visible,
+        # and remove() swaps in new columns instead of changing this one
+        encoded = self.encoded
+        end = len(encoded) - len(self.SEPARATOR)
+        piece = head
+        while True:
+            piece_end = min(position + chunk_size, end)
+            piece += encoded[position:piece_end]
+            if piece_end == end:
+                yield piece + tail
+                return
+            yield piece
+            piece = b""
+            position = piece_end
+
+
+class History:
+    """chat messages kept in memory, one append-only Room per room name
+
+    With a shared MessageLog every write goes to the log first, and the memory
+    copy catches up with writes made by other processes on sync(). The server
+    uses append_async() and sync_async(), which talk to the log from a single
+    thread of their own, so the event loop does not wait for SQLite.
+    """
+
+    def __init__(self, log: Optional[MessageLog] = None) -> None:
+        self.log = log
+        self.rooms: dict[str, Room] = {}
+        self.authors = Authors()
+        self.last_id = 0
+        self.count = 0
+        self.size = 0
+        """bytes of json kept in all rooms"""
+        self._log_thread: Optional[ThreadPoolExecutor] = None
+
+    def room(self, name: str) -> list[Message]:
+        """decoded copy of room messages"""
+        room = self.rooms.get(name)
+        return [] if room is None else room.slice()
+
+    @property
+    def messages(self) -> list[Message]:
+        return self.room(DEFAULT_ROOM)
+
+    def _add(
+        self,
+        message: Message,
+        room: str,
+        position: Optional[int] = None,
+        created: Optional[float] = None,
+    ):
+        stored = self.rooms.get(room)
+        if stored is None:
+            stored = self.rooms[room] = Room(self.authors)
+        size = len(stored.encoded)
+        stored.append(message, position, created)
+        self.count += 1
+        self.size += len(stored.encoded) - size
+
+    def append(self, message: Message, room: str = DEFAULT_ROOM):
+        if self.log is None:
+            self._add(message, room)
+            return
+        self.log.append(message, room)
+        self.sync()
+
+    def sync(self):
+        if self.log is not None:
+            self.add_stored(self.log.read_stored_since(self.last_id))
+
+    async def _in_log_thread(self, function: Callable[..., Any], *args) -> Any:
+        if self._log_thread is None:
+            self._log_thread = ThreadPoolExecutor(1, thread_name_prefix="message-log")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._log_thread, function, *args)
+
+    async def append_async(self, message: Message, room: str = DEFAULT_ROOM):
+        """append, the message is in memory once this returns"""
+        if self.log is None:
+            self._add(message, room)
+            return
+        await self._in_log_thread(self.log.append, message, room)
+        await self.sync_async()
+
+    async def sync_async(self):
+        if self.log is not None:
+            # concurrent syncs may read the same messages, add_stored skips them
+            stored = await self._in_log_thread(self.log.read_stored_since, self.last_id)
+            self.add_stored(stored)
+
+    def add_stored(self, messages: Iterable[StoredMessage]):
+        """add messages read from the log, ones added before are skipped"""
+        for stored in messages:
+            if stored.id <= self.last_id:
+                continue
+            self._add(stored.message, stored.room, stored.position, stored.created)
+            self.last_id = stored.id
+
+    def remove(
+        self, room: str, before: int = 0, positions: Collection[int] = ()
+    ) -> int:
+        """drop messages of room from memory, see Room.remove
+
+        The message log is left alone, retention trims it separately.
+
+        Returns:
+            int: number of removed messages
+        """
+        stored = self.rooms.get(room)
+        if stored is None:
+            return 0
+        count, size = stored.remove(before, positions)
+        self.count -= count
+        self.size -= size
+        return count
+
+    def search(
+        self,
+        room: str,
+        query: str,
+        author: Optional[str] = None,
+        limit: int = 50,
+        before: Optional[int] = None,
+    ) -> tuple[list[tuple[int, Message]], Optional[int]]:
+        """see Room.search"""
+        stored = self.rooms.get(room)
+        if stored is None:
+            return [], None
+        return stored.search(query, author, limit, before)
+
+    def encode_chunks(
+        self, chunk_size: int, room: str = DEFAULT_ROOM, after: Optional[int] = None
+    ) -> Iterator[bytes]:
+        """read reply with room messages from position `after` as chunks of
+        about chunk_size, see ReadRequest
+
+        Messages were encoded when they were added, a read only copies bytes.
+        """
+        stored = self.rooms.get(room)
+        if stored is None:
+            return iter(
+                [b"[]" if after is None else READ_REPLY_HEAD + read_reply_tail(0)]
+            )
+        return stored.encode_chunks(chunk_size, after)
+
+    def __len__(self) -> int:
+        return self.count
@@ -1,8 +1,20 @@
+import time
 from hashlib import sha1
 from sqlite3 import IntegrityError, Row, connect
 from typing import Iterable, Optional
 
-from sec_sem8.entities import Database, Hasher, PasswordHash, User, UserExistsError
+from sec_sem8.entities import (
+    DEFAULT_ROOM,
+    Database,
+    Hasher,
+    Message,
+    MessageLog,
+    PasswordHash,
+    StoredMessage,
+    User,
+    UserExistsError,
+)
+from sec_sem8.params import Params, ParamsStore
 
 
 class Sha1Hasher(Hasher):
@@ -54,3 +66,165 @@ class SqliteDatabase(Database):
         cursor = self.db.cursor()
         cursor.execute("DELETE FROM users WHERE name=?", (username,))
         self.db.commit()
+
+
+class SqliteMessageLog(MessageLog):
+    """message log that can be shared by several processes through one file
+
+    Positions of messages in their room are handed out from room_positions
+    in the insert transaction, so they stay unique across processes and are
+    not reused after retention removed the newest messages of a room.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self.db = connect(db_path, check_same_thread=False, timeout=30)
+        self.db.row_factory = Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS messages(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            author VARCHAR(60) NOT NULL,
+            content TEXT NOT NULL,
+            room VARCHAR(60) NOT NULL DEFAULT 'general',
+            position INTEGER,
+            created REAL
+            )"""
+        )
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS room_positions(
+            room VARCHAR(60) PRIMARY KEY,
+            next_position INTEGER NOT NULL
+            )
+            WITHOUT ROWID"""
+        )
+        columns = {
+            row["name"] for row in self.db.execute("PRAGMA table_info(messages)")
+        }
+        if "room" not in columns:
+            self.db.execute(
+                "ALTER TABLE messages ADD COLUMN room VARCHAR(60) NOT NULL DEFAULT 'general'"
+            )
+        if "position" not in columns:
+            self._add_positions()
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS messages_room_position ON messages(room, position)"
+        )
+        self.db.commit()
+
+    def _add_positions(self):
+        """number messages of an older table in their rooms, in id order"""
+        self.db.execute("ALTER TABLE messages ADD COLUMN position INTEGER")
+        self.db.execute("ALTER TABLE messages ADD COLUMN created REAL")
+        self.db.execute(
+            """UPDATE messages SET position = numbered.position
+            FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY room ORDER BY id) - 1
+                AS position FROM messages
+            ) AS numbered
+            WHERE messages.id = numbered.id"""
+        )
+        self.db.execute("UPDATE messages SET created = ?", (time.time(),))
+        self.db.execute(
+            """INSERT OR REPLACE INTO room_positions
+            SELECT room, MAX(position) + 1 FROM messages GROUP BY room"""
+        )
+
+    def append(self, message: Message, room: str = DEFAULT_ROOM) -> int:
+        cursor = self.db.cursor()
+        cursor.execute(
+            """INSERT INTO room_positions VALUES(?, 1)
+            ON CONFLICT(room) DO UPDATE SET next_position = next_position + 1
+            RETURNING next_position - 1""",
+            (room,),
+        )
+        (position,) = cursor.fetchone()
+        cursor.execute(
+            """INSERT INTO messages(author, content, room, position, created)
+            VALUES(?, ?, ?, ?, ?)""",
+            (message.author, message.content, room, position, time.time()),
+        )
+        self.db.commit()
+        assert cursor.lastrowid is not None
+        return cursor.lastrowid
+
+    def read_since(self, after_id: int) -> list[tuple[int, str, Message]]:
+        return [
+            (stored.id, stored.room, stored.message)
+            for stored in self.read_stored_since(after_id)
+        ]
+
+    def read_stored_since(self, after_id: int) -> list[StoredMessage]:
+        cursor = self.db.cursor()
+        cursor.execute(
+            """SELECT id, room, position, created, author, content FROM messages
+            WHERE id > ? ORDER BY id""",
+            (after_id,),
+        )
+        return [
+            StoredMessage(
+                row["id"],
+                row["room"],
+                row["position"],
+                row["created"],
+                Message(author=row["author"], content=row["content"]),
+            )
+            for row in cursor.fetchall()
+        ]
+
+    def remove_before(self, room: str, position: int, limit: int) -> int:
+        cursor = self.db.cursor()
+        cursor.execute(
+            """DELETE FROM messages WHERE id IN (
+                SELECT id FROM messages WHERE room = ? AND position < ? LIMIT ?
+            )""",
+            (room, position, limit),
+        )
+        self.db.commit()
+        return cursor.rowcount
+
+    def remove_positions(self, room: str, positions: Iterable[int]):
+        self.db.executemany(
+            "DELETE FROM messages WHERE room = ? AND position = ?",
+            [(room, position) for position in positions],
+        )
+        self.db.commit()
+
+
+class SqliteParamsStore(ParamsStore):
+    """diffie parameters the launcher publishes for workers in the shared file"""
+
+    KEEP = 10
+    """published parameters kept, a restarted worker replays them in order"""
+
+    def __init__(self, db_path: str) -> None:
+        self.db = connect(db_path, check_same_thread=False, timeout=30)
+        # numbers are text, p may not fit a signed 64 bit integer
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS diffie_params(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            g TEXT NOT NULL,
+            p TEXT NOT NULL,
+            active_at REAL NOT NULL
+            )"""
+        )
+        self.db.commit()
+
+    def publish(self, params: Params, active_at: float):
+        g, p = params
+        cursor = self.db.execute(
+            "INSERT INTO diffie_params(g, p, active_at) VALUES(?, ?, ?)",
+            (str(g), str(p), active_at),
+        )
+        assert cursor.lastrowid is not None
+        self.db.execute(
+            "DELETE FROM diffie_params WHERE id <= ?", (cursor.lastrowid - self.KEEP,)
+        )
+        self.db.commit()
+
+    def read_since(self, after_id: int) -> list[tuple[int, Params, float]]:
+        rows = self.db.execute(
+            "SELECT id, g, p, active_at FROM diffie_params WHERE id > ? ORDER BY id",
+            (after_id,),
+        )
+        return [(row_id, (int(g), int(p)), at) for row_id, g, p, at in rows]
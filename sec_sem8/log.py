@@ -0,0 +1,198 @@
+"""structured leveled logging written by a background thread
+
+Handler coroutines only build a record and put it into a bounded queue, a
+listener thread formats and writes it. When the queue is full the record is
+dropped and counted instead of blocking the event loop. Events can be sampled
+per event name, and sensitive fields are redacted when the record is formatted.
+"""
+import atexit
+import datetime
+import json
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Iterable, Optional, TextIO
+
+from sec_sem8.metrics import REGISTRY
+
+ROOT_LOGGER = "sec_sem8"
+
+DEFAULT_REDACTED_FIELDS = frozenset(
+    {
+        "answer",
+        "content",
+        "data",
+        "key",
+        "nonce",
+        "password_hash",
+        "server_secret",
+        "shared_key",
+    }
+)
+
+records_dropped = REGISTRY.counter(
+    "sec_sem8_log_records_dropped_total", "log records dropped on full queue"
+)
+
+_sampling: dict[str, float] = {}
+
+
+class EventLogger:
+    """logger of named events with keyword fields
+
+    Level and sampling are checked before a record is created, so disabled
+    or sampled out events cost a dict lookup.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.logger = logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+    def is_enabled(self, level: int) -> bool:
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level: int, event: str, **fields: Any):
+        if not self.logger.isEnabledFor(level):
+            return
+        rate = _sampling.get(event)
+        if rate is not None and random.random() >= rate:
+            return
+        self.logger.log(level, event, extra={"event": event, "fields": fields})
+
+    def debug(self, event: str, **fields: Any):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event: str, **fields: Any):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event: str, **fields: Any):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event: str, **fields: Any):
+        self.log(logging.ERROR, event, **fields)
+
+
+def get_logger(name: str) -> EventLogger:
+    return EventLogger(name)
+
+
+def _plain(value: Any) -> Any:
+    if hasattr(value, "dict") and callable(value.dict):
+        return {"type": value.__class__.__name__, **value.dict()}
+    return value
+
+
+def redact(value: Any, fields: frozenset[str]) -> Any:
+    value = _plain(value)
+    if isinstance(value, dict):
+        return {
+            k: f"<redacted {len(str(v))} chars>" if k in fields else redact(v, fields)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(v, fields) for v in value]
+    return value
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(
+        self,
+        json_lines: bool = False,
+        redacted_fields: Iterable[str] = DEFAULT_REDACTED_FIELDS,
+    ) -> None:
+        super().__init__()
+        self.json_lines = json_lines
+        self.redacted_fields = frozenset(redacted_fields)
+
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = datetime.datetime.fromtimestamp(record.created).isoformat(
+            timespec="milliseconds"
+        )
+        event = getattr(record, "event", record.getMessage())
+        fields = redact(getattr(record, "fields", {}), self.redacted_fields)
+        if record.exc_info:
+            fields["exception"] = self.formatException(record.exc_info)
+
+        if self.json_lines:
+            return json.dumps(
+                {
+                    "time": timestamp,
+                    "level": record.levelname,
+                    "logger": record.name,
+                    "event": event,
+                    **fields,
+                },
+                default=str,
+            )
+        text = " ".join(f"{k}={v}" for k, v in fields.items())
+        return f"{timestamp} {record.levelname} {record.name} {event} {text}".rstrip()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks and leaves formatting to the listener"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            records_dropped.inc()
+
+
+_listener: Optional[QueueListener] = None
+
+
+def parse_sampling(text: str) -> dict[str, float]:
+    """parse rates like 'frame_in=0.01,frame_out=0.1'"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        event, _, rate = item.partition("=")
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+def setup_logging(
+    level: int | str = logging.INFO,
+    json_lines: bool = False,
+    sampling: Optional[dict[str, float]] = None,
+    redacted_fields: Iterable[str] = DEFAULT_REDACTED_FIELDS,
+    queue_size: int = 10000,
+    stream: TextIO = sys.stderr,
+) -> QueueListener:
+    """route sec_sem8 loggers through a bounded queue to a writer thread
+
+    Args:
+        sampling: event name to share of events kept, between 0 and 1
+    """
+    global _listener
+    stop_logging()
+
+    _sampling.clear()
+    _sampling.update(sampling or {})
+
+    output = logging.StreamHandler(stream)
+    output.setFormatter(StructuredFormatter(json_lines, redacted_fields))
+
+    records: queue.Queue[logging.LogRecord] = queue.Queue(maxsize=queue_size)
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.handlers = [DroppingQueueHandler(records)]
+    logger.setLevel(level)
+    logger.propagate = False
+
+    _listener = QueueListener(records, output)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """flush queued records and stop writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,267 @@
+"""in-process metrics with prometheus text exposition
+
+Metrics only keep plain numbers; text is rendered when somebody scrapes
+the endpoint, so an unscraped server pays for a few additions per event.
+"""
+import asyncio
+from bisect import bisect_left
+from typing import Awaitable, Callable, Generic, Iterable, Optional, TypeVar
+from urllib.parse import parse_qsl, urlsplit
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+Sample = tuple[str, dict[str, str], float]
+# extra GET handler, takes query parameters and returns status and body
+Route = Callable[[dict[str, str]], Awaitable[tuple[str, bytes]]]
+
+
+class _CounterValue:
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeValue(_CounterValue):
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramValue:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+V = TypeVar("V", _CounterValue, _GaugeValue, _HistogramValue)
+M = TypeVar("M", bound="_Metric")
+
+
+class _Metric(Generic[V]):
+    type = ""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Iterable[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], V] = {}
+        self._default: Optional[V] = None if self.labelnames else self.labels()
+
+    def _new_value(self) -> V:
+        raise NotImplementedError
+
+    def labels(self, *values: str) -> V:
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_value()
+        return child
+
+    def remove(self, *values: str):
+        """forget child with provided labels, e.g. when a connection closes"""
+        self._children.pop(values, None)
+
+    def _unlabelled(self) -> V:
+        if self._default is None:
+            raise ValueError(f"{self.name} needs labels {self.labelnames}")
+        return self._default
+
+    def _child_samples(self, child: V) -> Iterable[tuple[str, dict[str, str], float]]:
+        raise NotImplementedError
+
+    def samples(self) -> Iterable[Sample]:
+        for values, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            for suffix, extra, value in self._child_samples(child):
+                yield self.name + suffix, {**labels, **extra}, value
+
+
+class Counter(_Metric[_CounterValue]):
+    type = "counter"
+
+    def _new_value(self) -> _CounterValue:
+        return _CounterValue()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled().inc(amount)
+
+    def _child_samples(self, child):
+        yield "", {}, child.value
+
+
+class Gauge(_Metric[_GaugeValue]):
+    type = "gauge"
+
+    def _new_value(self) -> _GaugeValue:
+        return _GaugeValue()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._unlabelled().dec(amount)
+
+    def set(self, value: float):
+        self._unlabelled().set(value)
+
+    def _child_samples(self, child):
+        yield "", {}, child.value
+
+
+class Histogram(_Metric[_HistogramValue]):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_value(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabelled().observe(value)
+
+    def _child_samples(self, child):
+        cumulative = 0
+        for bound, count in zip(self.buckets, child.counts):
+            cumulative += count
+            yield "_bucket", {"le": _format_value(bound)}, cumulative
+        cumulative += child.counts[-1]
+        yield "_bucket", {"le": "+Inf"}, cumulative
+        yield "_count", {}, cumulative
+        yield "_sum", {}, child.sum
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: M) -> M:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Iterable[str] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self, name: str, documentation: str, labelnames: Iterable[str] = ()
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                    name = f"{name}{{{text}}}"
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+async def _handle_scrape(registry: Registry, routes: dict[str, Route], reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode(errors="replace").split()
+        url = urlsplit(parts[1]) if len(parts) >= 2 else None
+        if url is None or parts[0] != "GET":
+            status = "404 Not Found"
+            body = b"not found\n"
+        elif url.path == "/metrics":
+            status = "200 OK"
+            body = registry.render().encode()
+        elif url.path in routes:
+            status, body = await routes[url.path](dict(parse_qsl(url.query)))
+        else:
+            status = "404 Not Found"
+            body = b"not found\n"
+        writer.write(
+            (
+                f"HTTP/1.0 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode()
+            + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(
+    host: str = "127.0.0.1",
+    port: int = 9433,
+    registry: Registry = REGISTRY,
+    routes: Optional[dict[str, Route]] = None,
+) -> asyncio.AbstractServer:
+    """serve `GET /metrics` and `routes` over plain HTTP on host:port"""
+    return await asyncio.start_server(
+        lambda r, w: _handle_scrape(registry, routes or {}, r, w), host, port
+    )
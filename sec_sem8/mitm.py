@@ -1,183 +1,250 @@
-import asyncio
-from functools import cache
-
-from sec_sem8.connection.passive_connection import (
-    PassiveConnection,
-    World,
-    BaseClientMessage,
-    BaseServerMessage,
-)
-from sec_sem8.connection.client_messages import (
-    DiffieAnswer,
-    ClientData,
-    ClientGoodbye,
-    ConnectRequest,
-)
-
-from sec_sem8.connection.server_messages import ServerCryptogramm, DiffieRequest
-
-from sec_sem8.connection.active_connection import ActiveConnection
-from sec_sem8.hash_task import PasswordHash
-from sec_sem8.entities import Message, WriteRequest, ReadRequest, parse_request
-from pydantic.json import pydantic_encoder
-import json
-import sys
-
-from unittest.mock import Mock, MagicMock
-import random
-
-from sec_sem8.rc4 import RC4, xor_bytes
-import base64
-
-
-@cache
-def get_diffie_hellman_params() -> tuple[int, int]:
-    from sec_sem8.diffie_hellman import find_primitive_root
-    from sec_sem8.primes import get_random_prime
-
-    prime = get_random_prime(64)
-    g = find_primitive_root(32, prime)
-    return g, prime
-
-
-get_diffie_hellman_params()
-print("built diffie-hellman parameters")
-
+"""man in the middle proxy for the chat protocol
 
-class MockWorld(World):
-    def __init__(self) -> None:
-        super().__init__()
+Runs Diffie-Hellman with the client and with the server on its own, then
+re-encrypts payloads between the two keystreams and records plaintext into a
+JSONL transcript:
 
-    def has_user(self, username: str) -> bool:
-        return True
-
-    def get_diffie_params(self, username: str) -> tuple[int, int]:
-        return 2, 3
-
-    def get_user_password_hash(self, username: str) -> PasswordHash:
-        return PasswordHash("")
+    python -m sec_sem8.mitm upstream-host --transcript transcript.jsonl
 
+Each direction is pumped by its own task, frames are forwarded as soon as
+they arrive. Only frames the proxy has to change are decoded.
+"""
+import asyncio
+import base64
+import contextlib
+import itertools
+import json
+import random
+import time
+from pathlib import Path
+from typing import Callable, Optional
 
-messages: list[Message] = []
+import typer
+from pydantic import BaseModel
 
-upstream = sys.argv[1]
+from sec_sem8.connection import client_messages, server_messages
+from sec_sem8.log import get_logger, setup_logging
+from sec_sem8.rc4 import RC4, xor_bytes
+from sec_sem8.transcript import TranscriptWriter
+
+log = get_logger("mitm")
+
+# be as lenient as possible, the proxy should not be the one to reject frames
+FRAME_LIMIT = 1024 * 1024
+
+
+def _id(message: type[BaseModel]) -> int:
+    return message.__fields__["id"].default
+
+
+CONNECT_REQUEST = _id(client_messages.ConnectRequest)
+FAST_CONNECT_REQUEST = _id(client_messages.FastConnectRequest)
+DIFFIE_ANSWER = _id(client_messages.DiffieAnswer)
+CLIENT_DATA = _id(client_messages.ClientData)
+CLIENT_CHUNK = _id(client_messages.ClientChunk)
+DIFFIE_REQUEST = _id(server_messages.DiffieRequest)
+SERVER_CRYPTOGRAMM = _id(server_messages.ServerCryptogramm)
+SERVER_CHUNK = _id(server_messages.ServerChunk)
+
+_session_ids = itertools.count(1)
+
+
+class MitmSession:
+    """keys and keystreams of one intercepted client
+
+    from_client/from_server take a frame line and return the line to forward.
+    Both run on the event loop between awaits, so the shared keystreams are
+    used in the same order as by the peers.
+    """
+
+    def __init__(self, transcript: Optional[TranscriptWriter] = None) -> None:
+        self.transcript = transcript
+        self.session = next(_session_ids)
+        self.secret = random.randint(3, 2**63)
+        self.prime = 2
+        self.public = 0
+        self.client_rc4: Optional[RC4] = None
+        self.server_rc4: Optional[RC4] = None
+        self.author = ""
+
+    def _record(self, direction: str, frame: dict, plaintext: bytes):
+        log.debug("intercepted", author=self.author, direction=direction)
+        if self.transcript is None:
+            return
+        record = {
+            "time": time.time(),
+            "session": self.session,
+            "author": self.author,
+            "direction": direction,
+            "id": frame["id"],
+            "text": plaintext.decode(errors="replace"),
+        }
+        if "last" in frame:
+            record["last"] = frame["last"]
+        self.transcript.write(record)
+
+    @staticmethod
+    def _reencrypt(data: str, source: RC4, target: RC4) -> tuple[bytes, str]:
+        raw = base64.b64decode(data)
+        plaintext = xor_bytes(raw, source.produce_gamma(len(raw)))
+        encrypted = xor_bytes(plaintext, target.produce_gamma(len(plaintext)))
+        return plaintext, base64.b64encode(encrypted).decode()
+
+    def from_client(self, line: bytes) -> bytes:
+        try:
+            frame = json.loads(line)
+            kind = frame["id"]
+        except (ValueError, KeyError, TypeError):
+            return line
+
+        if kind == CONNECT_REQUEST:
+            self.author = str(frame.get("username", ""))
+        elif kind == FAST_CONNECT_REQUEST:
+            # group parameters are unknown yet, client falls back to full exchange
+            self.author = str(frame.get("username", ""))
+            frame = client_messages.ConnectRequest(username=self.author).dict()
+        elif kind == DIFFIE_ANSWER:
+            shared = pow(frame["client_public_value"], self.secret, self.prime)
+            self.client_rc4 = RC4(shared)
+            frame["client_public_value"] = self.public
+        elif (
+            kind in (CLIENT_DATA, CLIENT_CHUNK) and self.client_rc4 and self.server_rc4
+        ):
+            plaintext, frame["data"] = self._reencrypt(
+                frame["data"], self.client_rc4, self.server_rc4
+            )
+            self._record("client", frame, plaintext)
+        else:
+            return line
+        return (json.dumps(frame) + "\n").encode()
+
+    def from_server(self, line: bytes) -> bytes:
+        try:
+            frame = json.loads(line)
+            kind = frame["id"]
+        except (ValueError, KeyError, TypeError):
+            return line
+
+        if kind == DIFFIE_REQUEST:
+            self.prime = frame["p"]
+            self.public = pow(frame["g"], self.secret, self.prime)
+            shared = pow(frame["server_public_value"], self.secret, self.prime)
+            self.server_rc4 = RC4(shared)
+            frame["server_public_value"] = self.public
+        elif (
+            kind in (SERVER_CRYPTOGRAMM, SERVER_CHUNK)
+            and self.client_rc4
+            and self.server_rc4
+        ):
+            plaintext, frame["content"] = self._reencrypt(
+                frame["content"], self.server_rc4, self.client_rc4
+            )
+            self._record("server", frame, plaintext)
+        else:
+            return line
+        return (json.dumps(frame) + "\n").encode()
+
+
+async def pump(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    transform: Callable[[bytes], bytes],
+):
+    """forward frames until reader hits end of stream, then half-close writer"""
+    while line := await reader.readline():
+        writer.write(transform(line))
+        await writer.drain()
+    if writer.can_write_eof():
+        writer.write_eof()
 
 
 class MitmProxy:
-    def __init__(self) -> None:
-        self.server = ActiveConnection(user_data=MagicMock(), server=upstream)
-
-    async def connect(self):
-        await self.server.connect()
-
-    async def on_client_message(self, message: BaseClientMessage) -> BaseServerMessage:
-        await self.server._write_message(message)
-        return await self.server._read_message()
-
-
-known_messages: list[Message] = []
-
-
-async def handle_client(reader, writer):
-    data = {}
-
-    passive = PassiveConnection(reader, writer, MockWorld())
-
-    proxy = MitmProxy()
-    await proxy.connect()
-
-    done = False
-
-    server_p = 2
-    server_g = 0
-    server_public = 0
-    my_secret = random.randint(3, 2**63)
-    my_public = 0
-
-    server_shared = 0
-    client_shared = 0
-
-    client_generator = RC4(1)
-    server_generator = RC4(1)
-
-    author = ""
-
-    while True:
+    def __init__(
+        self,
+        upstream: tuple[str, int],
+        transcript: Optional[TranscriptWriter] = None,
+        linger: float = 5.0,
+    ) -> None:
+        self.upstream = upstream
+        self.transcript = transcript
+        self.linger = linger
+
+    async def handle_client(self, reader, writer):
         try:
-            message = await passive._read_message()
-            if isinstance(message, ClientGoodbye):
-                await proxy.server._write_message(message)
-                break
-
-            elif isinstance(message, ConnectRequest):
-                author = message.username
-            elif isinstance(message, DiffieAnswer):
-                client_shared = pow(message.client_public_value, my_secret, server_p)
-                client_generator = RC4(client_shared)
-
-                message = DiffieAnswer(client_public_value=my_public)
-
-            elif isinstance(message, ClientData):
-                raw = base64.b64decode(message.data)
-                decrypted = xor_bytes(raw, client_generator.produce_gamma(len(raw)))
-                string = decrypted.decode()
-                deser = parse_request(string)
-                if isinstance(deser, WriteRequest):
-                    print(author, ":", deser.content)
-
-                message = ClientData(
-                    data=base64.b64encode(
-                        xor_bytes(
-                            decrypted, server_generator.produce_gamma(len(decrypted))
-                        )
-                    ).decode()
-                )
-
-            resp = await proxy.on_client_message(message)
-
-            if isinstance(resp, DiffieRequest):
-                server_public = resp.server_public_value
-                server_g = resp.g
-                server_p = resp.p
-
-                my_public = pow(server_g, my_secret, server_p)
-
-                server_shared = pow(server_public, my_secret, server_p)
-                server_generator = RC4(server_shared)
-
-                resp = DiffieRequest(
-                    g=server_g, p=server_p, server_public_value=my_public
-                )
-
-            elif isinstance(resp, ServerCryptogramm):
-                raw = base64.b64decode(resp.content)
-                decrypted = xor_bytes(raw, server_generator.produce_gamma(len(raw)))
-                string = decrypted.decode()
-
-                resp = ServerCryptogramm(
-                    content=base64.b64encode(
-                        xor_bytes(
-                            decrypted, client_generator.produce_gamma(len(decrypted))
-                        )
-                    ).decode()
-                )
-
-            await passive._write_message(resp)
-        except Exception as e:
-            print(e)
-            break
-
-    writer.close()
-
+            up_reader, up_writer = await asyncio.open_connection(
+                *self.upstream, limit=FRAME_LIMIT
+            )
+        except OSError as e:
+            log.warning("upstream_unavailable", error=str(e))
+            writer.close()
+            return
+
+        session = MitmSession(self.transcript)
+        pumps = [
+            asyncio.create_task(pump(reader, up_writer, session.from_client)),
+            asyncio.create_task(pump(up_reader, writer, session.from_server)),
+        ]
+        try:
+            # once one side is done, the other one gets a moment to finish
+            _, pending = await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+            if pending:
+                await asyncio.wait(pending, timeout=self.linger)
+        finally:
+            for task in pumps:
+                task.cancel()
+            for task in pumps:
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await task
+            for stream in (writer, up_writer):
+                stream.close()
+                with contextlib.suppress(ConnectionError):
+                    await stream.wait_closed()
+        log.info("session_relayed", author=session.author)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 4433):
+        if self.transcript is not None:
+            self.transcript.start()
+        server = await asyncio.start_server(
+            self.handle_client, host, port, limit=FRAME_LIMIT
+        )
+        addrs = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+        log.info("listening", addresses=addrs, upstream=self.upstream)
+        return server
+
+    async def close(self):
+        if self.transcript is not None:
+            await self.transcript.close()
+
+
+app = typer.Typer()
+
+
+@app.command()
+def proxy(
+    upstream: str = typer.Argument(..., help="host of the real server"),
+    upstream_port: int = typer.Option(4433),
+    host: str = typer.Option("127.0.0.1"),
+    port: int = typer.Option(4433),
+    transcript: Path = typer.Option(Path("transcript.jsonl")),
+):
+    setup_logging()
+
+    async def run():
+        mitm = MitmProxy((upstream, upstream_port), TranscriptWriter(transcript))
+        server = await mitm.start(host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await mitm.close()
 
-async def main():
-    server = await asyncio.start_server(handle_client, "127.0.0.1", 4433)
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(run())
 
-    addrs = ", ".join(str(sock.getsockname()) for sock in server.sockets)
-    print(f"Serving on {addrs}")
 
-    async with server:
-        await server.serve_forever()
+def main():
+    app()
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    main()
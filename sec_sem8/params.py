@@ -0,0 +1,202 @@
+"""Diffie-Hellman group parameters with background rotation
+
+Handshakes read the current parameters once and keep them in their state,
+so a swap only affects handshakes started after it.
+
+With several worker processes only the launcher rotates. It publishes new
+parameters in a ParamsStore with a time they become active a little ahead,
+and every worker follows the store, so all workers switch at the same moment
+and hand out the same (g, p) in between. Generation metrics are counted in the
+launcher, which serves them on a metrics port of its own.
+"""
+import asyncio
+import multiprocessing
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Optional
+
+from sec_sem8.log import get_logger
+from sec_sem8.metrics import REGISTRY
+
+log = get_logger("params")
+
+generation_seconds = REGISTRY.histogram(
+    "sec_sem8_diffie_params_generation_seconds",
+    "time to generate a new prime and primitive root",
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+rotations_total = REGISTRY.counter(
+    "sec_sem8_diffie_params_rotations_total", "parameter generations", ["outcome"]
+)
+generating = REGISTRY.gauge(
+    "sec_sem8_diffie_params_generating", "1 while new parameters are generated"
+)
+rotated_at = REGISTRY.gauge(
+    "sec_sem8_diffie_params_rotated_timestamp_seconds",
+    "unix time current parameters were swapped in",
+)
+
+Params = tuple[int, int]
+
+
+def generate_diffie_params(bits: int = 64) -> Params:
+    """
+    Returns:
+        tuple[int, int]: g, p
+    """
+    from sec_sem8.diffie_hellman import find_primitive_root
+    from sec_sem8.primes import get_random_prime
+
+    prime = get_random_prime(bits)
+    g = find_primitive_root(bits // 2, prime)
+    return g, prime
+
+
+class ParamsStore(ABC):
+    @abstractmethod
+    def publish(self, params: Params, active_at: float):
+        """store params to be used from unix time active_at on"""
+
+    @abstractmethod
+    def read_since(self, after_id: int) -> list[tuple[int, Params, float]]:
+        """
+        Returns:
+            list[tuple[int, Params, float]]: ids, parameters and their
+                activation times published after after_id, in order
+        """
+
+
+class DiffieParamsManager:
+    """holds current (g, p) and replaces them every `rotation_interval` seconds
+
+    Generation runs in a separate process, so the event loop keeps serving
+    while the next prime is searched. A failed generation keeps old values.
+    """
+
+    def __init__(
+        self,
+        initial: Optional[Params] = None,
+        rotation_interval: Optional[float] = None,
+        generate: Callable[[], Params] = generate_diffie_params,
+        executor: Optional[Executor] = None,
+        store: Optional[ParamsStore] = None,
+        activation_delay: float = 0.0,
+    ) -> None:
+        """
+        Args:
+            store: where rotated parameters are published for workers
+            activation_delay: seconds from publishing to activation, longer
+                than the poll interval of workers
+        """
+        self._current = initial
+        self.rotation_interval = rotation_interval
+        self.generate = generate
+        self._executor = executor
+        self.store = store
+        self.activation_delay = activation_delay
+        self._task: Optional[asyncio.Task] = None
+        if initial is not None:
+            rotated_at.set(time.time())
+
+    @property
+    def current(self) -> Params:
+        if self._current is None:
+            # nothing to serve with yet, generate in place as before rotation
+            self._swap(self.generate())
+        assert self._current is not None
+        return self._current
+
+    def _swap(self, params: Params):
+        self._current = params
+        rotated_at.set(time.time())
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def rotate(self) -> bool:
+        """generate new parameters in executor and swap them in
+
+        Returns:
+            bool: whether parameters changed
+        """
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        generating.set(1)
+        try:
+            params = await loop.run_in_executor(self._get_executor(), self.generate)
+        except Exception as e:
+            rotations_total.labels("error").inc()
+            log.error("diffie_params_rotation_failed", error=repr(e))
+            return False
+        finally:
+            generating.set(0)
+        elapsed = time.perf_counter() - started
+        generation_seconds.observe(elapsed)
+        rotations_total.labels("ok").inc()
+        if self.store is not None:
+            self.store.publish(params, time.time() + self.activation_delay)
+        self._swap(params)
+        log.info("diffie_params_rotated", seconds=round(elapsed, 3))
+        return True
+
+    async def _run(self):
+        assert self.rotation_interval is not None
+        while True:
+            await asyncio.sleep(self.rotation_interval)
+            await self.rotate()
+
+    def start(self):
+        if self.rotation_interval and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class PublishedDiffieParams(DiffieParamsManager):
+    """parameters rotated by another process, read from a store
+
+    The store is polled every `poll_interval` seconds, and published
+    parameters are swapped in once their activation time has come.
+    """
+
+    def __init__(self, store: ParamsStore, poll_interval: float = 1.0) -> None:
+        super().__init__(rotation_interval=poll_interval)
+        self.source = store
+        self._last_id = 0
+        self._upcoming: list[tuple[Params, float]] = []
+        self.refresh()
+
+    @property
+    def current(self) -> Params:
+        now = time.time()
+        while self._upcoming and self._upcoming[0][1] <= now:
+            params, _ = self._upcoming.pop(0)
+            if params != self._current:
+                self._swap(params)
+        if self._current is None:
+            raise RuntimeError("no diffie parameters published yet")
+        return self._current
+
+    def refresh(self) -> bool:
+        """
+        Returns:
+            bool: whether new parameters were published
+        """
+        published = self.source.read_since(self._last_id)
+        for self._last_id, params, active_at in published:
+            self._upcoming.append((params, active_at))
+        return bool(published)
+
+    async def rotate(self) -> bool:
+        return self.refresh()
@@ -0,0 +1,225 @@
+"""sampling profiler that can be switched on in a running server
+
+Every `interval` seconds of CPU time the event loop thread is interrupted
+and its stack counted, which costs one short signal handler per sample.
+Coroutine frames are on that stack while they run, so time spent in
+ChatServer and PassiveConnection methods shows up under their names.
+
+Either send SIGUSR1 to a worker, it writes profile-<pid>-<time>.collapsed
+into the profile directory, or ask the metrics port:
+
+    curl 'http://127.0.0.1:9433/debug/profile?seconds=10' > out.collapsed
+    curl 'http://127.0.0.1:9433/debug/profile?seconds=10&format=top'
+
+Collapsed stacks are what flamegraph.pl and speedscope read.
+"""
+import asyncio
+import os
+import signal
+import time
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+from typing import Optional
+
+from sec_sem8.log import get_logger
+from sec_sem8.metrics import REGISTRY
+
+log = get_logger("profiler")
+
+profiles_total = REGISTRY.counter(
+    "sec_sem8_profiles_total", "profiling sessions run", ["trigger"]
+)
+
+# innermost frame with one of these prefixes gets the sample in `top`
+ATTRIBUTED = ("ChatServer.", "PassiveConnection.")
+MAX_SECONDS = 300.0
+PROFILE_SIGNAL = getattr(signal, "SIGUSR1", None)
+
+Stack = tuple[str, ...]
+
+
+def frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _stack(frame: Optional[FrameType]) -> Stack:
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels)
+
+
+class Profile:
+    def __init__(
+        self, stacks: Counter[Stack], duration: float, interval: float
+    ) -> None:
+        self.stacks = stacks
+        self.duration = duration
+        self.interval = interval
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+    def collapsed(self) -> str:
+        """one `outer;inner count` line per distinct stack"""
+        return "".join(
+            f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def by_function(self) -> Counter[str]:
+        """samples each function was on the stack for"""
+        counts: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            for label in set(stack):
+                counts[label] += count
+        return counts
+
+    def attribute(self, prefixes: tuple[str, ...] = ATTRIBUTED) -> Counter[str]:
+        """samples of each innermost function matching one of prefixes"""
+        counts: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            owner = "other"
+            for label in reversed(stack):
+                if label.partition(":")[2].startswith(prefixes):
+                    owner = label
+                    break
+            counts[owner] += count
+        return counts
+
+    def top(self, limit: int = 25) -> str:
+        total = self.samples or 1
+        cpu = self.samples * self.interval
+        lines = [
+            f"{self.samples} samples, {cpu:.2f}s cpu in {self.duration:.2f}s",
+            "",
+            "coroutines:",
+        ]
+        for label, count in self.attribute().most_common():
+            lines.append(f"{100 * count / total:6.1f}% {label}")
+        lines += ["", "functions:"]
+        for label, count in self.by_function().most_common(limit):
+            lines.append(f"{100 * count / total:6.1f}% {label}")
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """samples the main thread stack on a CPU time interval timer
+
+    A thread polling sys._current_frames() would only get the GIL when the
+    loop blocks in select and see nothing else, so SIGPROF interrupts the
+    running code instead and its handler records the interrupted frame.
+    Time blocked on I/O is not sampled. Only works on the main thread of a
+    unix process, which is where the server runs its event loop.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self._stacks: Counter[Stack] = Counter()
+        self._previous = None
+        self._running = False
+        self._started = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        if self._running:
+            raise RuntimeError("profiler is already running")
+        if not hasattr(signal, "SIGPROF"):
+            raise RuntimeError("profiling needs SIGPROF")
+        self._stacks = Counter()
+        # raises ValueError outside of the main thread
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self._running = True
+        self._started = time.perf_counter()
+
+    def _sample(self, signum: int, frame: Optional[FrameType]):
+        self._stacks[_stack(frame)] += 1
+
+    def stop(self) -> Profile:
+        if not self._running:
+            raise RuntimeError("profiler is not running")
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+        self._running = False
+        return Profile(self._stacks, time.perf_counter() - self._started, self.interval)
+
+
+class ProfilerControl:
+    """runs one profiling session at a time for a signal or an HTTP request"""
+
+    def __init__(
+        self,
+        directory: Path = Path("."),
+        seconds: float = 10.0,
+        interval: float = 0.005,
+    ) -> None:
+        self.directory = directory
+        self.seconds = seconds
+        self.profiler = SamplingProfiler(interval)
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self, seconds: float, trigger: str = "manual") -> Profile:
+        """profile the event loop thread for `seconds`, must run on it"""
+        self.profiler.start()
+        profiles_total.labels(trigger).inc()
+        log.info("profiling_started", seconds=seconds, trigger=trigger)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile = self.profiler.stop()
+        log.info("profiling_finished", samples=profile.samples)
+        return profile
+
+    async def _run_to_file(self) -> Optional[Path]:
+        if self.profiler.running:
+            log.warning("profiler_busy")
+            return None
+        try:
+            profile = await self.run(self.seconds, "signal")
+        except (RuntimeError, ValueError) as e:
+            log.warning("profiling_unavailable", error=str(e))
+            return None
+        path = self.directory / f"profile-{os.getpid()}-{int(time.time())}.collapsed"
+        await asyncio.to_thread(path.write_text, profile.collapsed())
+        log.info("profile_written", path=str(path))
+        return path
+
+    def _on_signal(self):
+        self._task = asyncio.create_task(self._run_to_file())
+
+    def install_signal(self, signum: Optional[int] = PROFILE_SIGNAL):
+        """start a profile on `signum`, where the loop supports signals"""
+        try:
+            if signum is None:
+                raise NotImplementedError
+            asyncio.get_running_loop().add_signal_handler(signum, self._on_signal)
+        except (NotImplementedError, RuntimeError):
+            log.warning("profile_signal_unsupported")
+
+    async def handle_http(self, query: dict[str, str]) -> tuple[str, bytes]:
+        """`GET /debug/profile?seconds=N&format=collapsed|top`"""
+        try:
+            seconds = float(query.get("seconds", self.seconds))
+        except ValueError:
+            return "400 Bad Request", b"seconds must be a number\n"
+        output = query.get("format", "collapsed")
+        if not 0 < seconds <= MAX_SECONDS or output not in ("collapsed", "top"):
+            return "400 Bad Request", b"bad seconds or format\n"
+        if self.profiler.running:
+            return "409 Conflict", b"profiler is already running\n"
+
+        try:
+            profile = await self.run(seconds, "http")
+        except (RuntimeError, ValueError) as e:
+            return "501 Not Implemented", f"{e}\n".encode()
+        text = profile.collapsed() if output == "collapsed" else profile.top()
+        return "200 OK", text.encode()
@@ -2,8 +2,11 @@ from math import ceil
 
 
 class RC4:
+    # one of these lives in every session, keep it small: 256 byte state
+    __slots__ = ("state", "i", "j")
+
     def __init__(self, key: int) -> None:
-        self.state = list(range(256))
+        self.state = bytearray(range(256))
         j = 0
         key_bytelen = ceil(key.bit_count() / 8)
         key_bytes = key.to_bytes(256, byteorder="little")
@@ -28,7 +31,16 @@ class RC4:
         return k
 
     def produce_gamma(self, size: int) -> bytes:
-        return bytes([next(self) for _ in range(size)])
+        # same steps as __next__, with the state in locals
+        state, i, j = self.state, self.i, self.j
+        gamma = bytearray(size)
+        for n in range(size):
+            i = (i + 1) & 255
+            j = (j + state[i]) & 255
+            state[i], state[j] = state[j], state[i]
+            gamma[n] = state[(state[i] + state[j]) & 255]
+        self.i, self.j = i, j
+        return bytes(gamma)
 
 
 def xor_bytes(a: bytes, b: bytes) -> bytes:
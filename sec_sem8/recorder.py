@@ -0,0 +1,128 @@
+"""session recording for capacity tests, see sec_sem8.replay"""
+import itertools
+import time
+from pathlib import Path
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+from sec_sem8.connection.client_messages import (
+    BaseClientMessage,
+    ClientChunk,
+    ClientData,
+    ConnectRequest,
+    FastConnectRequest,
+)
+from sec_sem8.connection.server_messages import (
+    BaseServerMessage,
+    DiffieOk,
+    FastNonce,
+    ServerChunk,
+    ServerCryptogramm,
+)
+from sec_sem8.entities import (
+    DEFAULT_ROOM,
+    AnyRequest,
+    JoinRequest,
+    LeaveRequest,
+    ReadRequest,
+    SearchRequest,
+    WriteRequest,
+)
+from sec_sem8.transcript import TranscriptWriter
+
+
+RequestKind = Literal["read", "write", "join", "leave", "search", "unknown"]
+
+
+class RecordedRequest(BaseModel):
+    at: float
+    """seconds since session start"""
+    kind: RequestKind = "unknown"
+    room: str = DEFAULT_ROOM
+    size: int = 0
+    """length of written content or search query"""
+    after: Optional[int] = None
+    frame_bytes: int = 0
+    reply_bytes: int = 0
+    latency: Optional[float] = None
+
+
+class RecordedSession(BaseModel):
+    session: int
+    username: str
+    started: float
+    """unix time of connect"""
+    handshake_seconds: Optional[float] = None
+    requests: list[RecordedRequest] = []
+
+
+class SessionTrace:
+    """collects one session, on_frame fits PassiveConnection intercept_callback"""
+
+    def __init__(self, session: int) -> None:
+        self.record = RecordedSession(session=session, username="", started=time.time())
+        self._start = time.perf_counter()
+        self._pending: Optional[RecordedRequest] = None
+
+    def on_frame(self, message: BaseClientMessage | BaseServerMessage):
+        now = time.perf_counter() - self._start
+        if isinstance(message, (ConnectRequest, FastConnectRequest)):
+            self.record.username = message.username
+        elif isinstance(message, (DiffieOk, FastNonce)):
+            self.record.handshake_seconds = now
+        elif isinstance(message, (ClientData, ClientChunk)):
+            if self._pending is None:
+                self._pending = RecordedRequest(at=now)
+            self._pending.frame_bytes += len(message.data)
+        elif isinstance(message, (ServerCryptogramm, ServerChunk)):
+            pending = self._pending
+            if pending is None:
+                return
+            pending.reply_bytes += len(message.content)
+            if isinstance(message, ServerCryptogramm) or message.last:
+                pending.latency = now - pending.at
+                self.record.requests.append(pending)
+                self._pending = None
+
+    def on_request(self, request: AnyRequest):
+        if self._pending is not None:
+            describe_request(self._pending, request)
+
+
+def describe_request(recorded: RecordedRequest, request: Optional[AnyRequest]):
+    if isinstance(request, ReadRequest):
+        recorded.kind = "read"
+        recorded.after = request.after
+    elif isinstance(request, WriteRequest):
+        recorded.kind = "write"
+        recorded.size = len(request.content)
+    elif isinstance(request, JoinRequest):
+        recorded.kind = "join"
+    elif isinstance(request, LeaveRequest):
+        recorded.kind = "leave"
+    elif isinstance(request, SearchRequest):
+        recorded.kind = "search"
+        recorded.size = len(request.query)
+    if request is not None:
+        recorded.room = request.room
+
+
+class SessionRecorder:
+    """writes finished sessions to a JSONL recording"""
+
+    def __init__(self, path: Path) -> None:
+        self.writer = TranscriptWriter(path)
+        self._ids = itertools.count(1)
+
+    def start(self):
+        self.writer.start()
+
+    def session(self) -> SessionTrace:
+        return SessionTrace(next(self._ids))
+
+    def finish(self, trace: SessionTrace):
+        self.writer.write(trace.record.dict())
+
+    async def close(self):
+        await self.writer.close()
@@ -0,0 +1,326 @@
+"""record real sessions and replay them against another server
+
+The server records established sessions when started with --record: frame
+timing and sizes come from PassiveConnection's intercept_callback, request
+kind and room from the parsed request. Contents are not kept, a write is
+replayed with a message of the recorded length. A mitm transcript can be
+turned into a recording too:
+
+    python -m sec_sem8.replay from-transcript transcript.jsonl recording.jsonl
+    python -m sec_sem8.replay run recording.jsonl --port 4433 --speed 10
+
+Replayed sessions connect as the recorded users, with password hashes taken
+from --db, and keep recorded gaps between requests divided by speed. A
+request is never sent before the reply to the previous one arrives.
+"""
+import asyncio
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Optional
+
+import typer
+from pydantic import BaseModel
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from sec_sem8.bench import LatencySummary
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.entities import (
+    JoinRequest,
+    LeaveRequest,
+    ReadRequest,
+    SearchRequest,
+    User,
+    WriteRequest,
+    parse_request,
+)
+from sec_sem8.impl import SqliteDatabase
+from sec_sem8.recorder import RecordedRequest, RecordedSession, describe_request
+
+
+def load_recording(path: Path) -> list[RecordedSession]:
+    with open(path) as file:
+        return [RecordedSession.parse_raw(line) for line in file if line.strip()]
+
+
+def from_transcript(path: Path) -> list[RecordedSession]:
+    """rebuild sessions from a mitm transcript
+
+    The proxy only sees encrypted traffic, so handshake time is unknown and
+    a session starts at its first request.
+    """
+    sessions: dict[int, RecordedSession] = {}
+    pending: dict[int, RecordedRequest] = {}
+    texts: dict[int, list[str]] = defaultdict(list)
+
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            number = record["session"]
+            session = sessions.get(number)
+            if session is None:
+                session = sessions[number] = RecordedSession(
+                    session=number, username=record["author"], started=record["time"]
+                )
+            now = record["time"] - session.started
+
+            if record["direction"] == "client":
+                if number not in pending:
+                    pending[number] = RecordedRequest(at=now)
+                texts[number].append(record["text"])
+                pending[number].frame_bytes += len(record["text"].encode())
+                if record.get("last", True):
+                    describe_request(
+                        pending[number], parse_request("".join(texts.pop(number)))
+                    )
+            elif number in pending:
+                request = pending[number]
+                request.reply_bytes += len(record["text"].encode())
+                if record.get("last", True):
+                    request.latency = now - request.at
+                    session.requests.append(pending.pop(number))
+
+    return sorted(sessions.values(), key=lambda s: s.started)
+
+
+class ReplayStats(BaseModel):
+    sessions: int
+    requests: int
+    duration: float
+    requests_per_second: float
+    handshake: LatencySummary
+    latency: dict[str, LatencySummary]
+
+
+class Divergence(BaseModel):
+    throughput_ratio: float
+    """replayed throughput over recorded throughput scaled by speed"""
+    p50_delta: dict[str, float]
+    p99_delta: dict[str, float]
+
+
+class ReplayReport(BaseModel):
+    speed: float
+    recorded: ReplayStats
+    replayed: ReplayStats
+    divergence: Divergence
+    errors: int
+    skipped: int
+
+
+def _stats(
+    sessions: int,
+    duration: float,
+    handshakes: list[float],
+    latencies: dict[str, list[float]],
+) -> ReplayStats:
+    requests = sum(len(samples) for samples in latencies.values())
+    return ReplayStats(
+        sessions=sessions,
+        requests=requests,
+        duration=duration,
+        requests_per_second=requests / duration if duration > 0 else 0.0,
+        handshake=LatencySummary.from_samples(handshakes),
+        latency={
+            kind: LatencySummary.from_samples(samples)
+            for kind, samples in sorted(latencies.items())
+        },
+    )
+
+
+def recorded_stats(sessions: list[RecordedSession]) -> ReplayStats:
+    latencies: dict[str, list[float]] = defaultdict(list)
+    handshakes = []
+    start = min((s.started for s in sessions), default=0.0)
+    end = start
+    for session in sessions:
+        if session.handshake_seconds is not None:
+            handshakes.append(session.handshake_seconds)
+        for request in session.requests:
+            if request.kind == "unknown" or request.latency is None:
+                continue
+            latencies[request.kind].append(request.latency)
+            end = max(end, session.started + request.at + request.latency)
+    return _stats(len(sessions), end - start, handshakes, latencies)
+
+
+def _request_body(request: RecordedRequest) -> str:
+    if request.kind == "read":
+        return ReadRequest(room=request.room, after=request.after).json()
+    if request.kind == "write":
+        return WriteRequest(content="x" * request.size, room=request.room).json()
+    if request.kind == "join":
+        return JoinRequest(room=request.room).json()
+    if request.kind == "search":
+        # query words are not recorded, search for a word of the same length
+        return SearchRequest(
+            query="x" * max(request.size, 1), room=request.room, limit=50, before=None
+        ).json()
+    return LeaveRequest(room=request.room).json()
+
+
+class _Replay:
+    def __init__(self) -> None:
+        self.handshakes: list[float] = []
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors = 0
+        self.skipped = 0
+
+
+async def _replay_session(
+    session: RecordedSession,
+    delay: float,
+    speed: float,
+    host: str,
+    port: int,
+    find_user: Callable[[str], Optional[User]],
+    result: _Replay,
+):
+    await asyncio.sleep(delay)
+    user = find_user(session.username)
+    if user is None:
+        result.errors += 1
+        return
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    connection = ActiveConnection(user, host, port)  # type: ignore
+    try:
+        await connection.connect()
+        await connection.handshake()
+        result.handshakes.append(loop.time() - started)
+
+        for request in session.requests:
+            if request.kind == "unknown":
+                result.skipped += 1
+                continue
+            await asyncio.sleep(started + request.at / speed - loop.time())
+            sent = loop.time()
+            await connection.write(_request_body(request))
+            await connection.read()
+            result.latencies[request.kind].append(loop.time() - sent)
+
+        await connection.say_goodbye()
+    except Exception:
+        result.errors += 1
+
+
+async def replay(
+    sessions: list[RecordedSession],
+    host: str,
+    port: int,
+    find_user: Callable[[str], Optional[User]],
+    speed: float = 1.0,
+) -> ReplayReport:
+    """re-drive recorded sessions through fresh connections at `speed`"""
+    result = _Replay()
+    first = min((s.started for s in sessions), default=0.0)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await asyncio.gather(
+        *(
+            _replay_session(
+                session,
+                (session.started - first) / speed,
+                speed,
+                host,
+                port,
+                find_user,
+                result,
+            )
+            for session in sessions
+        )
+    )
+    duration = loop.time() - started
+
+    recorded = recorded_stats(sessions)
+    replayed = _stats(len(sessions), duration, result.handshakes, result.latencies)
+    expected = recorded.requests_per_second * speed
+    common = sorted(set(recorded.latency) & set(replayed.latency))
+    return ReplayReport(
+        speed=speed,
+        recorded=recorded,
+        replayed=replayed,
+        divergence=Divergence(
+            throughput_ratio=replayed.requests_per_second / expected
+            if expected > 0
+            else 0.0,
+            p50_delta={
+                k: replayed.latency[k].p50 - recorded.latency[k].p50 for k in common
+            },
+            p99_delta={
+                k: replayed.latency[k].p99 - recorded.latency[k].p99 for k in common
+            },
+        ),
+        errors=result.errors,
+        skipped=result.skipped,
+    )
+
+
+console = Console()
+
+
+def print_report(report: ReplayReport):
+    table = Table(
+        "request",
+        "recorded p50, ms",
+        "replayed p50, ms",
+        "recorded p99, ms",
+        "replayed p99, ms",
+        box=box.ROUNDED,
+    )
+    for kind in sorted(set(report.recorded.latency) | set(report.replayed.latency)):
+        row = [kind]
+        for quantile in ("p50", "p99"):
+            for stats in (report.recorded, report.replayed):
+                summary = stats.latency.get(kind)
+                value = None if summary is None else getattr(summary, quantile)
+                row.append("" if value is None else f"{value * 1000:.2f}")
+        table.add_row(*row)
+    console.print(table)
+    console.print(
+        f"speed {report.speed:g}x: recorded {report.recorded.requests_per_second:.1f} "
+        f"requests/s, replayed {report.replayed.requests_per_second:.1f} requests/s "
+        f"(ratio {report.divergence.throughput_ratio:.2f}), "
+        f"errors: {report.errors}, skipped: {report.skipped}"
+    )
+
+
+app = typer.Typer()
+
+
+@app.command()
+def run(
+    recording: Path,
+    host: str = typer.Option("127.0.0.1"),
+    port: int = typer.Option(4433),
+    speed: float = typer.Option(1.0, help="1, 10, 100 times faster than recorded"),
+    db_path: str = typer.Option("users.sqlite", "--db", envvar="SQLITE_PATH"),
+    output: Optional[Path] = typer.Option(None, help="write JSON report here"),
+):
+    database = SqliteDatabase(db_path)
+    report = asyncio.run(
+        replay(load_recording(recording), host, port, database.find_user, speed)
+    )
+    print_report(report)
+    if output is not None:
+        output.write_text(report.json(indent=2))
+
+
+@app.command("from-transcript")
+def convert(transcript: Path, recording: Path):
+    with open(recording, "w") as file:
+        for session in from_transcript(transcript):
+            file.write(session.json() + "\n")
+
+
+def main():
+    app()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""retention policies for chat history and the task that applies them
+
+A policy limits messages by count, age and bytes of json; every limit that
+is set removes the oldest messages first. A room follows its own policy from
+`rooms` or the default one, and a policy from `authors` also limits the
+messages of that author in every room.
+
+Compaction swaps new room state in on the event loop between requests:
+rooms are rebuilt one at a time and the search index is swept in batches,
+so neither holds the loop for long. The message log is read and trimmed in
+a worker thread on a connection of its own. Message positions do not change,
+so read and search cursors clients hold stay valid.
+"""
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Optional, Sequence
+
+from pydantic import BaseModel, Field
+
+from sec_sem8.entities import MessageLog
+from sec_sem8.history import History, Room
+from sec_sem8.log import get_logger
+from sec_sem8.metrics import REGISTRY
+
+log = get_logger("retention")
+
+messages_removed = REGISTRY.counter(
+    "sec_sem8_retention_removed_messages_total",
+    "messages removed from history by retention",
+    ["scope"],
+)
+compaction_seconds = REGISTRY.histogram(
+    "sec_sem8_retention_compaction_seconds",
+    "time of one compaction pass, message log included",
+    buckets=(0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+history_bytes = REGISTRY.gauge(
+    "sec_sem8_history_bytes", "bytes of message json kept in memory"
+)
+
+LIMITS = {"count": "max_count", "age": "max_age", "bytes": "max_bytes"}
+"""names of policy limits in parse_policies specs"""
+
+
+class RetentionPolicy(BaseModel):
+    max_count: Optional[int] = Field(None, ge=0)
+    max_age: Optional[float] = Field(None, gt=0)
+    """seconds"""
+    max_bytes: Optional[int] = Field(None, ge=0)
+
+    @property
+    def limited(self) -> bool:
+        return (self.max_count, self.max_age, self.max_bytes) != (None, None, None)
+
+
+class Retention(BaseModel):
+    default: RetentionPolicy = RetentionPolicy(
+        max_count=None, max_age=None, max_bytes=None
+    )
+    rooms: dict[str, RetentionPolicy] = {}
+    """replace default policy for these rooms"""
+    authors: dict[str, RetentionPolicy] = {}
+    """apply to messages of these authors in each room, besides room policy"""
+
+    @property
+    def limited(self) -> bool:
+        policies = [self.default, *self.rooms.values(), *self.authors.values()]
+        return any(policy.limited for policy in policies)
+
+    def room_policy(self, room: str) -> RetentionPolicy:
+        return self.rooms.get(room, self.default)
+
+
+def parse_policies(text: str) -> dict[str, RetentionPolicy]:
+    """parse limits like 'random.count=1000,random.age=3600,bot.bytes=65536'
+
+    The name is everything before the last dot, so it may contain dots.
+    """
+    limits: dict[str, dict[str, str]] = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        key, _, value = item.partition("=")
+        name, _, limit = key.strip().rpartition(".")
+        if limit not in LIMITS:
+            raise ValueError(f"unknown retention limit {limit!r}, use {list(LIMITS)}")
+        limits.setdefault(name, {})[LIMITS[limit]] = value.strip()
+    policies = {}
+    for name, fields in limits.items():
+        policies[name] = RetentionPolicy(
+            max_count=int(fields["max_count"]) if "max_count" in fields else None,
+            max_age=float(fields["max_age"]) if "max_age" in fields else None,
+            max_bytes=int(fields["max_bytes"]) if "max_bytes" in fields else None,
+        )
+    return policies
+
+
+def _expired_prefix(room: Room, policy: RetentionPolicy, now: float) -> int:
+    """number of oldest room messages the policy removes"""
+    count = 0
+    if policy.max_count is not None:
+        count = max(count, len(room) - policy.max_count)
+    if policy.max_age is not None:
+        # a scan, not bisect: clocks of processes sharing a log may disagree
+        cutoff = now - policy.max_age
+        old = 0
+        while old < len(room) and room.created[old] < cutoff:
+            old += 1
+        count = max(count, old)
+    if policy.max_bytes is not None:
+        # messages from index i on take len(encoded) - offsets[i] bytes
+        count = max(
+            count, bisect_left(room.offsets, len(room.encoded) - policy.max_bytes)
+        )
+    return count
+
+
+def _expired_of_author(
+    room: Room, indexes: Sequence[int], policy: RetentionPolicy, now: float
+) -> int:
+    """number of oldest messages at indexes the policy removes"""
+    count = 0
+    if policy.max_count is not None:
+        count = max(count, len(indexes) - policy.max_count)
+    if policy.max_age is not None:
+        cutoff = now - policy.max_age
+        old = 0
+        while old < len(indexes) and room.created[indexes[old]] < cutoff:
+            old += 1
+        count = max(count, old)
+    if policy.max_bytes is not None:
+        kept = size = 0
+        for index in reversed(indexes):
+            size += room.message_size(index)
+            if size > policy.max_bytes:
+                break
+            kept += 1
+        count = max(count, len(indexes) - kept)
+    return count
+
+
+def plan(
+    room: Room, retention: Retention, name: str, now: float
+) -> tuple[int, list[int]]:
+    """what retention removes from room
+
+    Returns:
+        tuple[int, list[int]]: position all older messages are removed below,
+            and positions of single messages removed by author policies
+    """
+    start = _expired_prefix(room, retention.room_policy(name), now)
+    before = room.positions[start] if start < len(room) else room.next_position
+    removed = []
+    for author, policy in retention.authors.items():
+        author_id = room.authors.ids.get(author)
+        postings = room.index.authors.get(author_id)  # type: ignore
+        if postings is None:
+            continue
+        indexes = [
+            room.locate(position)
+            for position in postings[bisect_left(postings, before) :]
+        ]
+        expired = _expired_of_author(room, indexes, policy, now)
+        removed += [room.positions[index] for index in indexes[:expired]]
+    return before, removed
+
+
+class Compactor:
+    """applies retention to history every `interval` seconds"""
+
+    def __init__(
+        self,
+        history: History,
+        retention: Retention,
+        interval: float = 60.0,
+        batch_size: int = 1000,
+        log: Optional[MessageLog] = None,
+    ) -> None:
+        """
+        Args:
+            batch_size: messages removed from the log, or index lists swept,
+                at once
+            log: another connection to the log of history, used from a
+                worker thread only; required when history has a log
+        """
+        if history.log is not None and log is None:
+            raise ValueError("compactor needs its own connection to the log")
+        self.log = log
+        self.history = history
+        self.retention = retention
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def _trim_log(self, room: str, before: int, positions: list[int]):
+        """runs in a worker thread, batches keep each write transaction short
+        for the other processes sharing the log"""
+        assert self.log is not None
+        while self.log.remove_before(room, before, self.batch_size) == self.batch_size:
+            pass
+        for i in range(0, len(positions), self.batch_size):
+            self.log.remove_positions(room, positions[i : i + self.batch_size])
+
+    async def compact(self, now: Optional[float] = None) -> int:
+        """one pass over every room
+
+        Returns:
+            int: number of messages removed from memory
+        """
+        started = time.perf_counter()
+        now = time.time() if now is None else now
+        if self.log is not None:
+            stored = await asyncio.to_thread(
+                self.log.read_stored_since, self.history.last_id
+            )
+            self.history.add_stored(stored)
+        total = 0
+        for name, room in list(self.history.rooms.items()):
+            before, positions = plan(room, self.retention, name, now)
+            from_room = room.locate(before)
+            removed = self.history.remove(name, before, positions)
+            if removed:
+                messages_removed.labels("room").inc(from_room)
+                messages_removed.labels("author").inc(removed - from_room)
+                total += removed
+            if from_room:
+                for _ in room.index.sweep(self.batch_size):
+                    await asyncio.sleep(0)
+            if self.log is not None and (before or positions):
+                await asyncio.to_thread(self._trim_log, name, before, positions)
+            await asyncio.sleep(0)
+        history_bytes.set(self.history.size)
+        elapsed = time.perf_counter() - started
+        compaction_seconds.observe(elapsed)
+        if total:
+            log.info("history_compacted", removed=total, seconds=round(elapsed, 3))
+        return total
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.compact()
+            except Exception as e:
+                log.error("history_compaction_failed", error=repr(e))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
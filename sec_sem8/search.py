@@ -0,0 +1,137 @@
+"""inverted index over room messages for SearchRequest
+
+Messages are tokenized once when they are added to a room. Every token and
+every author keeps a posting list of message positions in the room. Lists
+only ever grow at the end, so they stay sorted, and a query walks the
+shortest list from the newest end, checking the others by binary search.
+A page of results costs about limit * log(n), not a scan of the room.
+
+Retention removes old messages by moving the start of the index, queries
+stop there, and sweep() cuts the front of every list later in small steps.
+Single messages are tokenized again and cut from each of their lists at once.
+"""
+import re
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, Optional, TypeVar
+
+TOKEN = re.compile(r"\w+")
+MAX_TOKEN_LENGTH = 40
+
+Key = TypeVar("Key", str, int)
+"""token or author id a posting list is kept under"""
+
+
+def tokenize(text: str) -> set[str]:
+    """distinct lowercase words of text, overly long ones are cut"""
+    return {token[:MAX_TOKEN_LENGTH] for token in TOKEN.findall(text.lower())}
+
+
+def _contains(postings: array, position: int) -> bool:
+    i = bisect_left(postings, position)
+    return i < len(postings) and postings[i] == position
+
+
+def _discard(postings_by: dict[Key, array], removed: dict[Key, list[int]]):
+    """cut sorted positions from the lists under each key, copying every list
+    once instead of moving its tail for each position"""
+    for key, positions in removed.items():
+        postings = postings_by.get(key)
+        if postings is None:
+            continue
+        kept = array(postings.typecode)
+        run_start = 0
+        for position in positions:
+            i = bisect_left(postings, position, run_start)
+            if i < len(postings) and postings[i] == position:
+                kept += postings[run_start:i]
+                run_start = i + 1
+        kept += postings[run_start:]
+        if kept:
+            postings_by[key] = kept
+        else:
+            del postings_by[key]
+
+
+class RoomIndex:
+    def __init__(self) -> None:
+        self.tokens: dict[str, array] = {}
+        self.authors: dict[int, array] = {}
+        self.start = 0
+        """positions below this are removed, sweep() drops them from lists"""
+
+    def add(self, position: int, author_id: int, content: str):
+        for token in tokenize(content):
+            postings = self.tokens.get(token)
+            if postings is None:
+                postings = self.tokens[token] = array("I")
+            postings.append(position)
+        postings = self.authors.get(author_id)
+        if postings is None:
+            postings = self.authors[author_id] = array("I")
+        postings.append(position)
+
+    def search(
+        self, words: set[str], author_id: Optional[int] = None, before: int = 2**32
+    ) -> Iterator[int]:
+        """positions of messages with all words and author, newest first
+
+        Args:
+            before: only positions below this one, the pagination cursor
+        """
+        lists = []
+        for word in words:
+            postings = self.tokens.get(word)
+            if postings is None:
+                return
+            lists.append(postings)
+        if author_id is not None:
+            postings = self.authors.get(author_id)
+            if postings is None:
+                return
+            lists.append(postings)
+        if not lists:
+            return
+
+        lists.sort(key=len)
+        shortest, others = lists[0], lists[1:]
+        for i in range(bisect_left(shortest, before) - 1, -1, -1):
+            position = shortest[i]
+            if position < self.start:
+                return
+            if all(_contains(postings, position) for postings in others):
+                yield position
+
+    def discard_before(self, position: int):
+        """drop every message older than position"""
+        self.start = max(self.start, position)
+
+    def sweep(self, batch: int = 1000) -> Iterator[None]:
+        """free list entries below start, pausing after every batch of lists"""
+        yield from self._sweep(self.tokens, batch)
+        yield from self._sweep(self.authors, batch)
+
+    def _sweep(self, postings_by: dict[Key, array], batch: int) -> Iterator[None]:
+        for n, key in enumerate(list(postings_by)):
+            if n % batch == batch - 1:
+                yield
+            postings = postings_by.get(key)
+            if postings is None:
+                continue
+            cut = bisect_left(postings, self.start)
+            if cut == len(postings):
+                del postings_by[key]
+            elif cut:
+                del postings[:cut]
+
+    def discard(self, messages: Iterable[tuple[int, int, str]]):
+        """drop single messages given as (position, author id, content) in
+        position order, content must be the one they were added with"""
+        tokens: dict[str, list[int]] = {}
+        authors: dict[int, list[int]] = {}
+        for position, author_id, content in messages:
+            for token in tokenize(content):
+                tokens.setdefault(token, []).append(position)
+            authors.setdefault(author_id, []).append(position)
+        _discard(self.tokens, tokens)
+        _discard(self.authors, authors)
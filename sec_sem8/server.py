@@ -1,40 +1,144 @@
 import asyncio
-from functools import cache
+import json
+import multiprocessing
+import socket
+import time
+from pathlib import Path
+from typing import Optional
+
+import environs
+import typer
 
+from sec_sem8.connection.chunks import CHUNK_SIZE
+from sec_sem8.connection.limits import (
+    ConnectionLimiter,
+    ConnectionLimits,
+    peer_address,
+)
+from sec_sem8.connection.outbound import OutboundLimits, parse_policy
 from sec_sem8.connection.passive_connection import PassiveConnection, World
+from sec_sem8.connection.server_states import DiffieDone
 from sec_sem8.hash_task import PasswordHash
-from sec_sem8.impl import SqliteDatabase
-from sec_sem8.entities import Message, WriteRequest, ReadRequest, parse_request
-from pydantic.json import pydantic_encoder
-import json
+from sec_sem8.history import History
+from sec_sem8.impl import SqliteDatabase, SqliteMessageLog, SqliteParamsStore
+from sec_sem8.entities import (
+    DEFAULT_ROOM,
+    JoinRequest,
+    LeaveRequest,
+    Message,
+    ReadRequest,
+    SearchRequest,
+    WriteRequest,
+    parse_request,
+)
+from sec_sem8.log import get_logger, parse_sampling, setup_logging
+from sec_sem8.metrics import REGISTRY, Route, start_metrics_server
+from sec_sem8.params import (
+    DiffieParamsManager,
+    PublishedDiffieParams,
+    generate_diffie_params,
+)
+from sec_sem8.profiler import ProfilerControl
+from sec_sem8.recorder import SessionRecorder, SessionTrace
+from sec_sem8.retention import (
+    Compactor,
+    Retention,
+    RetentionPolicy,
+    history_bytes,
+    parse_policies,
+)
+
+env = environs.Env()
+env.read_env()
+
 
-database = SqliteDatabase("users.sqlite")
+class Config:
+    METRICS_PORT: Optional[int] = env.int("METRICS_PORT", None)
+    LOG_LEVEL: str = env("LOG_LEVEL", "INFO")
+    LOG_JSON: bool = env.bool("LOG_JSON", False)
+    LOG_SAMPLING: str = env("LOG_SAMPLING", "")
+    LOG_QUEUE_SIZE: int = env.int("LOG_QUEUE_SIZE", 10000)
+    OUTBOUND_HIGH_WATERMARK: int = env.int("OUTBOUND_HIGH_WATERMARK", 256 * 1024)
+    OUTBOUND_LOW_WATERMARK: int = env.int("OUTBOUND_LOW_WATERMARK", 64 * 1024)
+    OUTBOUND_MAX_BYTES: int = env.int("OUTBOUND_MAX_BYTES", 4 * 1024 * 1024)
+    OUTBOUND_DRAIN_TIMEOUT: float = env.float("OUTBOUND_DRAIN_TIMEOUT", 10.0)
+    OUTBOUND_POLICY: str = env("OUTBOUND_POLICY", "disconnect")
+    HANDSHAKE_STAGE_TIMEOUT: float = env.float("HANDSHAKE_STAGE_TIMEOUT", 10.0)
+    IDLE_TIMEOUT: float = env.float("IDLE_TIMEOUT", 300.0)
+    MAX_FRAME_SIZE: int = env.int("MAX_FRAME_SIZE", 64 * 1024)
+    MAX_CONNECTIONS: int = env.int("MAX_CONNECTIONS", 10000)
+    MAX_CONNECTIONS_PER_IP: int = env.int("MAX_CONNECTIONS_PER_IP", 128)
+    # rates and lag threshold of 0 turn the check off
+    HANDSHAKE_RATE_PER_IP: float = env.float("HANDSHAKE_RATE_PER_IP", 50.0)
+    HANDSHAKE_BURST_PER_IP: int = env.int("HANDSHAKE_BURST_PER_IP", 100)
+    LIMIT_LOCAL_PEERS: bool = env.bool("LIMIT_LOCAL_PEERS", False)
+    HANDSHAKE_RATE_PER_USER: float = env.float("HANDSHAKE_RATE_PER_USER", 10.0)
+    HANDSHAKE_BURST_PER_USER: int = env.int("HANDSHAKE_BURST_PER_USER", 20)
+    MAX_LOOP_LAG: float = env.float("MAX_LOOP_LAG", 0.5)
+    DIFFIE_ROTATION_INTERVAL: float = env.float("DIFFIE_ROTATION_INTERVAL", 3600.0)
+    # workers check the shared file this often, new parameters are published
+    # DIFFIE_ACTIVATION_DELAY ahead so all of them switch at the same time
+    DIFFIE_POLL_INTERVAL: float = env.float("DIFFIE_POLL_INTERVAL", 1.0)
+    DIFFIE_ACTIVATION_DELAY: float = env.float("DIFFIE_ACTIVATION_DELAY", 5.0)
+    PROFILE_ENABLED: bool = env.bool("PROFILE_ENABLED", True)
+    PROFILE_DIR: str = env("PROFILE_DIR", ".")
+    PROFILE_SECONDS: float = env.float("PROFILE_SECONDS", 10.0)
+    PROFILE_INTERVAL: float = env.float("PROFILE_INTERVAL", 0.005)
+    # limits of 0 are off, per room and author like "random.count=1000,bot.age=60"
+    RETENTION_MAX_COUNT: int = env.int("RETENTION_MAX_COUNT", 0)
+    RETENTION_MAX_AGE: float = env.float("RETENTION_MAX_AGE", 0.0)
+    RETENTION_MAX_BYTES: int = env.int("RETENTION_MAX_BYTES", 0)
+    RETENTION_ROOMS: str = env("RETENTION_ROOMS", "")
+    RETENTION_AUTHORS: str = env("RETENTION_AUTHORS", "")
+    RETENTION_INTERVAL: float = env.float("RETENTION_INTERVAL", 60.0)
 
 
-@cache
-def get_diffie_hellman_params() -> tuple[int, int]:
-    from sec_sem8.diffie_hellman import find_primitive_root
-    from sec_sem8.primes import get_random_prime
+log = get_logger("server")
 
-    prime = get_random_prime(64)
-    g = find_primitive_root(32, prime)
-    return g, prime
 
+connections_open = REGISTRY.gauge(
+    "sec_sem8_connections_open", "accepted connections, handshaking or established"
+)
+sessions_established = REGISTRY.gauge(
+    "sec_sem8_sessions_established", "connections that finished handshake"
+)
+requests_total = REGISTRY.counter(
+    "sec_sem8_requests_total", "requests from established sessions", ["type"]
+)
+request_seconds = REGISTRY.histogram(
+    "sec_sem8_request_seconds", "time to handle request and write reply", ["type"]
+)
+messages_stored = REGISTRY.gauge(
+    "sec_sem8_messages_stored", "chat messages kept in memory"
+)
+rooms_stored = REGISTRY.gauge("sec_sem8_rooms", "rooms with at least one message")
 
-get_diffie_hellman_params()
-print("built diffie-hellman parameters")
+REQUEST_KINDS = {
+    ReadRequest: "read",
+    WriteRequest: "write",
+    JoinRequest: "join",
+    LeaveRequest: "leave",
+    SearchRequest: "search",
+}
+ACK = json.dumps("ack")
 
 
 class RealWorld(World):
-    def __init__(self, database: SqliteDatabase) -> None:
+    def __init__(
+        self,
+        database: SqliteDatabase,
+        diffie_params: Optional[tuple[int, int]] = None,
+        params: Optional[DiffieParamsManager] = None,
+    ) -> None:
         super().__init__()
         self.db = database
+        self.params = params or DiffieParamsManager(diffie_params)
 
     def has_user(self, username: str) -> bool:
         return self.db.find_user(username) is not None
 
     def get_diffie_params(self, username: str) -> tuple[int, int]:
-        return get_diffie_hellman_params()
+        return self.params.current
 
     def get_user_password_hash(self, username: str) -> PasswordHash:
         user = self.db.find_user(username)
@@ -42,56 +146,489 @@ class RealWorld(World):
         return user.password_hash
 
 
-world = RealWorld(database)
+class ChatServer:
+    def __init__(
+        self,
+        world: World,
+        history: Optional[History] = None,
+        verbose: bool = True,
+        outbound_limits: Optional[OutboundLimits] = None,
+        limits: Optional[ConnectionLimits] = None,
+        recorder: Optional[SessionRecorder] = None,
+        profiler: Optional[ProfilerControl] = None,
+        compactor: Optional[Compactor] = None,
+    ) -> None:
+        """
+        Args:
+            compactor: applies retention to history, started with the server
+        """
+        self.world = world
+        self.history = history if history is not None else History()
+        self.verbose = verbose
+        self.outbound_limits = outbound_limits or OutboundLimits()
+        self.limits = limits or ConnectionLimits()
+        self.limiter = ConnectionLimiter(self.limits)
+        self.recorder = recorder
+        self.profiler = profiler
+        self.compactor = compactor
+        self._services_started = False
+
+    async def handle_client(self, reader, writer):
+        address = peer_address(writer)
+        if (rejection := self.limiter.try_acquire(address)) is not None:
+            writer.write(rejection)
+            writer.close()
+            return
+
+        connections_open.inc()
+        try:
+            await self._handle_client(reader, writer)
+        finally:
+            connections_open.dec()
+            self.limiter.release(address)
+
+    async def _handle_client(self, reader, writer):
+        trace = None if self.recorder is None else self.recorder.session()
+        connection = PassiveConnection(
+            reader,
+            writer,
+            self.world,
+            verbose=self.verbose,
+            intercept_callback=None if trace is None else trace.on_frame,
+            outbound_limits=self.outbound_limits,
+            limits=self.limits,
+            admit_user=self.limiter.admit_user,
+        )
+
+        try:
+            ok = await connection.handshake()
+        except Exception as e:
+            log.warning("handshake_failed", error=str(e))
+            return
+
+        log.info("session_started", username=ok.username, shared_key=ok.shared_key)
+
+        sessions_established.inc()
+        try:
+            await self._serve_session(connection, ok, trace)
+        except (ValueError, ConnectionError) as e:
+            log.info("session_closed", username=ok.username, error=str(e))
+            return
+        finally:
+            sessions_established.dec()
+            if trace is not None:
+                self.recorder.finish(trace)  # type: ignore
+
+        log.info("session_closed", username=ok.username)
+
+    async def _serve_session(
+        self,
+        connection: PassiveConnection,
+        ok: DiffieDone,
+        trace: Optional[SessionTrace] = None,
+    ):
+        joined = {DEFAULT_ROOM}
+        while True:
+            maybe_message = await connection.read_message()
+            if maybe_message is None:
+                break
+
+            started = time.perf_counter()
+            request = parse_request(maybe_message)
+            if request is None:
+                requests_total.labels("unknown").inc()
+                log.warning("unknown_request", username=ok.username, data=maybe_message)
+                break
+            if trace is not None:
+                trace.on_request(request)
+
+            if isinstance(request, JoinRequest):
+                joined.add(request.room)
+                await connection.write_message(ACK)
+            elif isinstance(request, LeaveRequest):
+                joined.discard(request.room)
+                await connection.write_message(ACK)
+            elif request.room not in joined:
+                await connection.write_message(
+                    json.dumps({"error": f"not joined to room {request.room}"})
+                )
+            elif isinstance(request, ReadRequest):
+                await self.history.sync_async()
+                self._update_gauges()
+                await connection.write_stream(
+                    self.history.encode_chunks(CHUNK_SIZE, request.room, request.after)
+                )
+            elif isinstance(request, SearchRequest):
+                await self.history.sync_async()
+                self._update_gauges()
+                found, cursor = self.history.search(
+                    request.room,
+                    request.query,
+                    request.author,
+                    request.limit,
+                    request.before,
+                )
+                results = [
+                    {"position": position, **message.dict()}
+                    for position, message in found
+                ]
+                await connection.write_message(
+                    json.dumps({"results": results, "next": cursor})
+                )
+            else:
+                text = request.content
+                message = Message(author=ok.username, content=text)
+                await self.history.append_async(message, request.room)
+                self._update_gauges()
+                log.debug(
+                    "message_written",
+                    username=ok.username,
+                    room=request.room,
+                    content=text,
+                )
+                await connection.write_message(ACK)
+
+            kind = REQUEST_KINDS[type(request)]
+            requests_total.labels(kind).inc()
+            request_seconds.labels(kind).observe(time.perf_counter() - started)
+
+    def _update_gauges(self):
+        messages_stored.set(len(self.history))
+        rooms_stored.set(len(self.history.rooms))
+        history_bytes.set(self.history.size)
+
+    async def start(
+        self, host: str = "127.0.0.1", port: int = 4433, reuse_port: bool = False
+    ):
+        server = await asyncio.start_server(
+            self.handle_client,
+            host,
+            port,
+            reuse_port=reuse_port or None,
+            limit=self.limits.max_frame_size,
+        )
+        self._start_services()
+
+        addrs = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+        log.info("listening", addresses=addrs)
+        return server
 
+    async def start_unix(
+        self, path: Optional[str] = None, sock: Optional[socket.socket] = None
+    ):
+        """listen on a unix domain socket at path, or on an already bound sock
 
-messages: list[Message] = []
+        Unix clients have no address, so per-address limits count all of
+        them as one "local" peer.
+        """
+        server = await asyncio.start_unix_server(
+            self.handle_client, path, sock=sock, limit=self.limits.max_frame_size
+        )
+        self._start_services()
+        log.info("listening", addresses=str(server.sockets[0].getsockname()))
+        return server
 
+    def _start_services(self):
+        if self._services_started:
+            return
+        self._services_started = True
+        self.limiter.start()
+        if self.recorder is not None:
+            self.recorder.start()
+        if self.profiler is not None:
+            self.profiler.install_signal()
+        if self.compactor is not None:
+            self.compactor.start()
 
-async def handle_client(reader, writer):
-    global messages
+    async def serve(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 4433,
+        metrics_port: Optional[int] = None,
+        reuse_port: bool = False,
+        unix_sock: Optional[socket.socket] = None,
+        tcp: bool = True,
+    ):
+        """serve on TCP host:port and/or on a bound unix socket"""
+        servers = []
+        if tcp:
+            servers.append(await self.start(host, port, reuse_port))
+        if unix_sock is not None:
+            servers.append(await self.start_unix(sock=unix_sock))
+        if metrics_port is not None:
+            routes: dict[str, Route] = {}
+            if self.profiler is not None:
+                routes["/debug/profile"] = self.profiler.handle_http
+            await start_metrics_server("127.0.0.1", metrics_port, routes=routes)
+            log.info("metrics_listening", address=f"127.0.0.1:{metrics_port}")
 
-    connection = PassiveConnection(reader, writer, world, verbose=True)
+        try:
+            await asyncio.gather(*(server.serve_forever() for server in servers))
+        finally:
+            for server in servers:
+                server.close()
+            if self.compactor is not None:
+                self.compactor.stop()
+            if self.recorder is not None:
+                await self.recorder.close()
+
+
+def _setup_logging():
+    setup_logging(
+        Config.LOG_LEVEL,
+        json_lines=Config.LOG_JSON,
+        sampling=parse_sampling(Config.LOG_SAMPLING),
+        queue_size=Config.LOG_QUEUE_SIZE,
+    )
+
+
+def bind_unix_socket(path: Path) -> socket.socket:
+    """listening unix socket at path, replacing a stale socket file"""
+    if path.is_socket():
+        path.unlink()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(path))
+    sock.listen(1024)
+    return sock
+
+
+def run_worker(
+    host: str,
+    port: int,
+    db_path: str,
+    diffie_params: Optional[tuple[int, int]],
+    metrics_port: Optional[int],
+    reuse_port: bool,
+    record_path: Optional[Path] = None,
+    unix_sock: Optional[socket.socket] = None,
+    tcp: bool = True,
+):
+    """serve on host:port and/or unix_sock with users and message log shared
+    through db_path
+
+    Args:
+        diffie_params: rotated here if given, otherwise followed as the
+            launcher publishes them in db_path
+    """
+    _setup_logging()
+    params: DiffieParamsManager
+    if diffie_params is None:
+        params = PublishedDiffieParams(
+            SqliteParamsStore(db_path), Config.DIFFIE_POLL_INTERVAL
+        )
+    else:
+        params = DiffieParamsManager(
+            diffie_params, rotation_interval=Config.DIFFIE_ROTATION_INTERVAL or None
+        )
+    world = RealWorld(SqliteDatabase(db_path), params=params)
+    limits = OutboundLimits(
+        high_watermark=Config.OUTBOUND_HIGH_WATERMARK,
+        low_watermark=Config.OUTBOUND_LOW_WATERMARK,
+        max_bytes=Config.OUTBOUND_MAX_BYTES,
+        drain_timeout=Config.OUTBOUND_DRAIN_TIMEOUT,
+        policy=parse_policy(Config.OUTBOUND_POLICY),
+    )
+    connection_limits = ConnectionLimits(
+        handshake_stage_timeout=Config.HANDSHAKE_STAGE_TIMEOUT,
+        idle_timeout=Config.IDLE_TIMEOUT,
+        max_frame_size=Config.MAX_FRAME_SIZE,
+        max_connections=Config.MAX_CONNECTIONS,
+        max_connections_per_ip=Config.MAX_CONNECTIONS_PER_IP,
+        handshake_rate_per_ip=Config.HANDSHAKE_RATE_PER_IP or None,
+        handshake_burst_per_ip=Config.HANDSHAKE_BURST_PER_IP,
+        limit_local_peers=Config.LIMIT_LOCAL_PEERS,
+        handshake_rate_per_user=Config.HANDSHAKE_RATE_PER_USER or None,
+        handshake_burst_per_user=Config.HANDSHAKE_BURST_PER_USER,
+        max_loop_lag=Config.MAX_LOOP_LAG or None,
+    )
+    history = History(SqliteMessageLog(db_path))
+    retention = Retention(
+        default=RetentionPolicy(
+            max_count=Config.RETENTION_MAX_COUNT or None,
+            max_age=Config.RETENTION_MAX_AGE or None,
+            max_bytes=Config.RETENTION_MAX_BYTES or None,
+        ),
+        rooms=parse_policies(Config.RETENTION_ROOMS),
+        authors=parse_policies(Config.RETENTION_AUTHORS),
+    )
+    server = ChatServer(
+        world,
+        history,
+        outbound_limits=limits,
+        limits=connection_limits,
+        recorder=None if record_path is None else SessionRecorder(record_path),
+        profiler=ProfilerControl(
+            Path(Config.PROFILE_DIR), Config.PROFILE_SECONDS, Config.PROFILE_INTERVAL
+        )
+        if Config.PROFILE_ENABLED
+        else None,
+        compactor=Compactor(
+            history,
+            retention,
+            Config.RETENTION_INTERVAL,
+            log=SqliteMessageLog(db_path),
+        )
+        if retention.limited
+        else None,
+    )
+
+    async def run():
+        params.start()
+        try:
+            await server.serve(host, port, metrics_port, reuse_port, unix_sock, tcp)
+        finally:
+            params.stop()
+
+    asyncio.run(run())
+
+
+app = typer.Typer()
+
+
+@app.command()
+def serve(
+    host: str = typer.Option("127.0.0.1", envvar="HOST"),
+    port: int = typer.Option(4433, envvar="PORT"),
+    workers: int = typer.Option(1, envvar="WORKERS", help="server processes"),
+    db_path: str = typer.Option("users.sqlite", envvar="SQLITE_PATH"),
+    metrics_port: Optional[int] = typer.Option(
+        Config.METRICS_PORT,
+        help="worker i serves metrics on metrics_port + i, "
+        "the launcher of several workers on metrics_port + workers",
+    ),
+    record: Optional[Path] = typer.Option(
+        None,
+        envvar="RECORD_PATH",
+        help="record sessions for replay, worker i writes to record.i",
+    ),
+    unix_path: Optional[Path] = typer.Option(
+        None, envvar="UNIX_PATH", help="also listen on this unix socket"
+    ),
+    tcp: bool = typer.Option(True, help="listen on host:port"),
+):
+    _setup_logging()
+    if not tcp and unix_path is None:
+        log.error("no_listener", hint="pass --unix-path with --no-tcp")
+        raise typer.Exit(1)
+    if tcp and workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        log.error("reuse_port_unsupported")
+        raise typer.Exit(1)
+    SqliteMessageLog(db_path)
+    diffie_params = generate_diffie_params()
+    log.info("diffie_hellman_ready")
+
+    # bound once here, all workers accept from the same socket
+    unix_sock = None if unix_path is None else bind_unix_socket(unix_path)
 
     try:
-        ok = await connection.handshake()
-    except Exception as e:
-        print(e)
-        return
+        _run_workers(
+            host,
+            port,
+            workers,
+            db_path,
+            diffie_params,
+            metrics_port,
+            record,
+            unix_sock,
+            tcp,
+        )
+    finally:
+        if unix_path is not None and unix_sock is not None:
+            unix_sock.close()
+            unix_path.unlink(missing_ok=True)
 
-    print(f"initiated connection with {ok.username}, shared key is {ok.shared_key}")
 
-    while True:
-        maybe_message = await connection.read_message()
-        if maybe_message is None:
-            break
+def _run_workers(
+    host: str,
+    port: int,
+    workers: int,
+    db_path: str,
+    diffie_params: tuple[int, int],
+    metrics_port: Optional[int],
+    record: Optional[Path],
+    unix_sock: Optional[socket.socket],
+    tcp: bool,
+):
+    if workers == 1:
+        run_worker(
+            host,
+            port,
+            db_path,
+            diffie_params,
+            metrics_port,
+            False,
+            record,
+            unix_sock,
+            tcp,
+        )
+        return
 
-        request = parse_request(maybe_message)
+    # workers follow parameters rotated here, so they never disagree
+    store = SqliteParamsStore(db_path)
+    store.publish(diffie_params, time.time())
+    params = DiffieParamsManager(
+        diffie_params,
+        rotation_interval=Config.DIFFIE_ROTATION_INTERVAL or None,
+        store=store,
+        activation_delay=Config.DIFFIE_ACTIVATION_DELAY,
+    )
 
-        if isinstance(request, ReadRequest):
-            await connection.write_message(
-                json.dumps(messages, default=pydantic_encoder)
-            )
-        elif isinstance(request, WriteRequest):
-            text = request.content
-            messages += [Message(author=ok.username, content=text)]
-            print(f"{ok.username} wrote: {text}")
-            await connection.write_message(json.dumps("ack"))
-        else:
-            print(f"got unknown request '{maybe_message}' from {ok.username}")
-            break
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(
+                host,
+                port,
+                db_path,
+                None,
+                None if metrics_port is None else metrics_port + i,
+                True,
+                None if record is None else record.with_name(f"{record.name}.{i}"),
+                unix_sock,
+                tcp,
+            ),
+            name=f"worker-{i}",
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    log.info("workers_started", count=workers)
 
-    print(f"closed connection with {ok.username}")
+    try:
+        # rotation metrics live in this process, scraped next to the workers
+        launcher_metrics_port = None if metrics_port is None else metrics_port + workers
+        asyncio.run(_rotate_while_running(params, processes, launcher_metrics_port))
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
 
 
-async def main():
-    server = await asyncio.start_server(handle_client, "127.0.0.1", 4433)
+async def _rotate_while_running(
+    params: DiffieParamsManager, processes: list, metrics_port: Optional[int] = None
+):
+    metrics = None
+    if metrics_port is not None:
+        metrics = await start_metrics_server("127.0.0.1", metrics_port)
+        log.info("metrics_listening", address=f"127.0.0.1:{metrics_port}")
+    params.start()
+    try:
+        while any(process.is_alive() for process in processes):
+            await asyncio.sleep(0.5)
+    finally:
+        params.stop()
+        if metrics is not None:
+            metrics.close()
 
-    addrs = ", ".join(str(sock.getsockname()) for sock in server.sockets)
-    print(f"Serving on {addrs}")
 
-    async with server:
-        await server.serve_forever()
+def main():
+    app()
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""buffered JSONL output for transcripts and recordings"""
+import asyncio
+import contextlib
+import json
+from pathlib import Path
+from typing import Any, Optional
+
+from sec_sem8.metrics import REGISTRY
+
+records_dropped = REGISTRY.counter(
+    "sec_sem8_transcript_records_dropped_total",
+    "transcript records dropped on full buffer",
+)
+
+
+class TranscriptWriter:
+    """appends JSONL records to a file without blocking the relay
+
+    write() only adds the encoded record to a memory buffer. The buffer goes
+    to disk from a worker thread once it grows past flush_bytes, or every
+    flush_interval seconds. Records that do not fit into max_bytes are dropped
+    and counted.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        flush_bytes: int = 64 * 1024,
+        flush_interval: float = 1.0,
+        max_bytes: int = 16 * 1024 * 1024,
+    ) -> None:
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.buffer = bytearray()
+        self.dropped = 0
+        self._file = open(path, "ab")
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def write(self, record: dict[str, Any]):
+        line = (json.dumps(record) + "\n").encode()
+        if len(self.buffer) + len(line) > self.max_bytes:
+            self.dropped += 1
+            records_dropped.inc()
+            return
+        self.buffer += line
+        if len(self.buffer) >= self.flush_bytes:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._closing:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            self._wakeup.clear()
+            await self._flush()
+
+    async def _flush(self):
+        if not self.buffer:
+            return
+        data, self.buffer = bytes(self.buffer), bytearray()
+        await asyncio.to_thread(self._write_file, data)
+
+    def _write_file(self, data: bytes):
+        self._file.write(data)
+        self._file.flush()
+
+    async def close(self):
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+        await self._flush()
+        self._file.close()
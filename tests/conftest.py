@@ -0,0 +1,71 @@
+import asyncio
+import contextlib
+import threading
+
+import pytest
+
+from sec_sem8.connection.passive_connection import PassiveConnection, World
+from sec_sem8.entities import PasswordHash
+from sec_sem8.impl import Sha1Hasher
+
+PASSWORD_HASH = Sha1Hasher()("password")
+
+
+class EchoWorld(World):
+    def has_user(self, username: str) -> bool:
+        return username == "user"
+
+    def get_user_password_hash(self, username: str) -> PasswordHash:
+        return PASSWORD_HASH
+
+    def get_diffie_params(self, username: str) -> tuple[int, int]:
+        return 5, 23
+
+
+class user(object):
+    username = "user"
+    password_hash = PASSWORD_HASH
+
+
+async def echo_client(reader, writer):
+    connection = PassiveConnection(reader, writer, EchoWorld())
+    try:
+        await connection.handshake()
+    except ValueError:
+        return
+    while (message := await connection.read_message()) is not None:
+        await connection.write_message(message)
+
+
+@contextlib.contextmanager
+def serving_in_thread(start_server):
+    """run the server made by start_server() on its own loop in a thread"""
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(start_server())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        asyncio.run_coroutine_threadsafe(_shutdown(server), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+async def _shutdown(server):
+    server.close()
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await server.wait_closed()
+
+
+@pytest.fixture
+def echo_server():
+    def start():
+        return asyncio.start_server(echo_client, "127.0.0.1", 0, reuse_address=True)
+
+    with serving_in_thread(start) as server:
+        yield server.sockets[0].getsockname()[1]
@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+from sec_sem8.connection.background_connection import (
+    BackgroundActiveConnection,
+    SyncActiveConnection,
+)
+from tests.conftest import user
+
+
+def test_background_connection_returns_futures(echo_server):
+    received = []
+    conn = BackgroundActiveConnection(user, port=echo_server, on_data=received.append)  # type: ignore
+    with conn:
+        conn.connect().result(timeout=5)
+        conn.handshake().result(timeout=5)
+        assert conn.is_open()
+        assert conn.request("hello").result(timeout=5) == "hello"
+    assert received == ["hello"]
+    assert not conn.is_open()
+
+
+def test_background_connection_keeps_exchanges_ordered(echo_server):
+    conn = BackgroundActiveConnection(user, port=echo_server)  # type: ignore
+    conn.connect().result(timeout=5)
+    conn.handshake().result(timeout=5)
+
+    results: dict[int, str] = {}
+
+    def work(n: int):
+        for i in range(20):
+            text = f"{n}-{i}"
+            results[n * 100 + i] = conn.request(text).result(timeout=5)
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    conn.close()
+
+    assert results == {n * 100 + i: f"{n}-{i}" for n in range(4) for i in range(20)}
+
+
+def test_background_connection_rejects_calls_after_close(echo_server):
+    conn = BackgroundActiveConnection(user, port=echo_server)  # type: ignore
+    conn.close()
+    with pytest.raises(RuntimeError):
+        conn.connect()
+
+
+def test_sync_connection_blocks_until_done(echo_server):
+    conn = SyncActiveConnection(user, port=echo_server)  # type: ignore
+    conn.connect()
+    conn.handshake()
+    conn.write("ping")
+    assert conn.read() == "ping"
+    conn.say_goodbye()
+    assert not conn.is_open()
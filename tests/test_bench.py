@@ -0,0 +1,32 @@
+from sec_sem8.bench import BenchConfig, LatencySummary, run_benchmark
+
+
+def test_latency_summary_uses_nearest_rank():
+    summary = LatencySummary.from_samples([float(i) for i in range(100, 0, -1)])
+    assert summary.count == 100
+    assert summary.p50 == 50.0
+    assert summary.p95 == 95.0
+    assert summary.p99 == 99.0
+    assert LatencySummary.from_samples([3.0]).p99 == 3.0
+    assert summary.max == 100.0
+
+
+def test_latency_summary_of_nothing_is_zero():
+    assert LatencySummary.from_samples([]).count == 0
+
+
+def test_benchmark_drives_server():
+    config = BenchConfig(
+        clients=2,
+        users=2,
+        duration=0.5,
+        handshake_weight=1,
+        write_weight=1,
+        read_weight=1,
+        message_size=8,
+        seed=0,
+    )
+    result = run_benchmark(config)
+    assert result.errors == 0
+    assert result.handshake_latency.count >= 2
+    assert result.requests > 0
@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.connection.chunks import CHUNK_SIZE, split_chunks
+from sec_sem8.connection.outbound import frames_per_write
+from sec_sem8.entities import ReadRequest, WriteRequest
+from sec_sem8.server import ChatServer
+from tests.conftest import EchoWorld, user
+
+
+def test_split_chunks_bounds_parts_and_marks_last():
+    async def collect(chunks, size):
+        return [item async for item in split_chunks(chunks, size)]
+
+    assert asyncio.run(collect([b"abcde", b"", b"fg"], 2)) == [
+        (b"ab", False),
+        (b"cd", False),
+        (b"e", False),
+        (b"fg", True),
+    ]
+    assert asyncio.run(collect([], 2)) == [(b"", True)]
+
+
+def test_payload_above_line_limit_round_trips(echo_server):
+    text = "ё" * (100 * 1024)
+
+    async def run():
+        conn = ActiveConnection(user, port=echo_server)  # type: ignore
+        await conn.connect()
+        await conn.handshake()
+        await conn.write(text)
+        echoed = await conn.read()
+        await conn.write("small")
+        small = await conn.read()
+        await conn.say_goodbye()
+        return echoed, small
+
+    assert asyncio.run(run()) == (text, "small")
+
+
+def test_streams_are_consumed_part_by_part(echo_server):
+    async def produce():
+        for _ in range(5):
+            yield b"x" * CHUNK_SIZE
+
+    async def run():
+        conn = ActiveConnection(user, port=echo_server)  # type: ignore
+        await conn.connect()
+        await conn.handshake()
+        await conn.write_stream(produce())
+        parts = [part async for part in conn.read_stream()]
+        await conn.say_goodbye()
+        return parts
+
+    parts = asyncio.run(run())
+    assert max(len(part) for part in parts) <= CHUNK_SIZE
+    assert b"".join(parts) == b"x" * (5 * CHUNK_SIZE)
+
+
+def test_chunk_frames_are_coalesced_into_fewer_writes(echo_server):
+    def totals():
+        children = {
+            side: frames_per_write.labels(side) for side in ("client", "server")
+        }
+        return {side: (c.sum, sum(c.counts)) for side, c in children.items()}
+
+    async def run():
+        conn = ActiveConnection(user, port=echo_server)  # type: ignore
+        await conn.connect()
+        await conn.handshake()
+        before = totals()
+        await conn.write_stream([b"x" * (8 * CHUNK_SIZE)])
+        parts = [part async for part in conn.read_stream()]
+        after = totals()
+        await conn.say_goodbye()
+        return parts, before, after
+
+    parts, before, after = asyncio.run(run())
+    assert len(parts) == 8
+    for side in ("client", "server"):
+        frames = after[side][0] - before[side][0]
+        writes = after[side][1] - before[side][1]
+        assert frames == 8
+        assert writes < frames
+
+
+def test_large_history_is_streamed():
+    async def run():
+        server = ChatServer(EchoWorld(), verbose=False)
+        tcp = await server.start("127.0.0.1", 0)
+        conn = ActiveConnection(user, port=tcp.sockets[0].getsockname()[1])  # type: ignore
+        await conn.connect()
+        await conn.handshake()
+        for i in range(20):
+            await conn.write(WriteRequest(content=f"{i}" * 10000).json())
+            await conn.read()
+        await conn.write(ReadRequest().json())
+        reply = await conn.read()
+        await conn.say_goodbye()
+        tcp.close()
+        return json.loads(reply)
+
+    messages = asyncio.run(run())
+    assert [m["content"] for m in messages] == [f"{i}" * 10000 for i in range(20)]
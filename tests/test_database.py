@@ -1,7 +1,9 @@
+import sqlite3
+
 import pytest
 
-from sec_sem8.entities import PasswordHash, User, UserExistsError
-from sec_sem8.impl import SqliteDatabase
+from sec_sem8.entities import Message, PasswordHash, User, UserExistsError
+from sec_sem8.impl import SqliteDatabase, SqliteMessageLog
 
 
 @pytest.fixture
@@ -44,3 +46,57 @@ def test_database_allows_listing_users(database_with_user, user):
 def test_database_allows_deleting_user(database_with_user):
     database_with_user.delete_user("user")
     assert database_with_user.find_user("user") is None
+
+
+@pytest.fixture
+def message_log_path(tmp_path):
+    return str(tmp_path / "messages.sqlite")
+
+
+def test_message_log_reads_appended_messages_in_order(message_log_path):
+    log = SqliteMessageLog(message_log_path)
+    first = log.append(Message(author="a", content="1"))
+    second = log.append(Message(author="b", content="2"))
+
+    assert first < second
+    assert log.read_since(0) == [
+        (first, "general", Message(author="a", content="1")),
+        (second, "general", Message(author="b", content="2")),
+    ]
+    assert log.read_since(first) == [
+        (second, "general", Message(author="b", content="2"))
+    ]
+
+
+def test_message_log_keeps_room_of_message(message_log_path):
+    log = SqliteMessageLog(message_log_path)
+    log.append(Message(author="a", content="1"), "random")
+
+    assert [room for _, room, _ in log.read_since(0)] == ["random"]
+
+
+def test_message_log_is_shared_between_connections(message_log_path):
+    writer = SqliteMessageLog(message_log_path)
+    reader = SqliteMessageLog(message_log_path)
+    writer.append(Message(author="a", content="1"))
+
+    assert [message for _, _, message in reader.read_since(0)] == [
+        Message(author="a", content="1")
+    ]
+
+
+def test_message_log_adds_room_to_old_table(message_log_path):
+    db = sqlite3.connect(message_log_path)
+    db.execute(
+        """CREATE TABLE messages(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        author VARCHAR(60) NOT NULL,
+        content TEXT NOT NULL
+        )"""
+    )
+    db.execute("INSERT INTO messages(author, content) VALUES('a', '1')")
+    db.commit()
+    db.close()
+
+    log = SqliteMessageLog(message_log_path)
+    assert [room for _, room, _ in log.read_since(0)] == ["general"]
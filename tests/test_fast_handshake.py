@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from sec_sem8.connection.active_connection import (
+    ActiveConnection,
+    IncorrectPasswordError,
+)
+from sec_sem8.connection.passive_connection import PassiveConnection
+from sec_sem8.impl import Sha1Hasher
+from sec_sem8.mitm import MitmProxy
+from tests.conftest import EchoWorld, user
+
+
+async def start_recording_server(frames: list):
+    async def handle(reader, writer):
+        connection = PassiveConnection(
+            reader,
+            writer,
+            EchoWorld(),
+            intercept_callback=lambda m: frames.append(m.__class__.__name__),
+        )
+        try:
+            await connection.handshake()
+            while (message := await connection.read_message()) is not None:
+                await connection.write_message(message)
+        except ValueError:
+            return
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def echo_once(conn: ActiveConnection, text: str) -> str:
+    await conn.connect()
+    await conn.handshake()
+    await conn.write(text)
+    reply = await conn.read()
+    await conn.say_goodbye()
+    return reply
+
+
+def test_second_handshake_takes_one_round_trip():
+    async def run():
+        frames: list[str] = []
+        server, port = await start_recording_server(frames)
+        cache: dict = {}
+        replies = []
+        for _ in range(2):
+            conn = ActiveConnection(user, port=port, params_cache=cache)  # type: ignore
+            replies.append(await echo_once(conn, "hi"))
+            await asyncio.sleep(0.01)
+        server.close()
+        return frames, cache, replies, port
+
+    frames, cache, replies, port = asyncio.run(run())
+    assert replies == ["hi", "hi"]
+    assert cache == {("127.0.0.1", port): (5, 23)}
+    second = frames[frames.index("ClientGoodbye") + 1 :]
+    assert second[:3] == ["FastConnectRequest", "FastNonce", "HashAnswer"]
+    assert "DiffieRequest" not in second
+
+
+def test_stale_parameters_fall_back_to_full_exchange(echo_server):
+    cache = {("127.0.0.1", echo_server): (2, 11)}
+    conn = ActiveConnection(user, port=echo_server, params_cache=cache)  # type: ignore
+    assert asyncio.run(echo_once(conn, "hi")) == "hi"
+    assert cache[("127.0.0.1", echo_server)] == (5, 23)
+
+
+def test_wrong_password_fails_first_read(echo_server):
+    class intruder(object):
+        username = "user"
+        password_hash = Sha1Hasher()("wrong")
+
+    cache = {("127.0.0.1", echo_server): (5, 23)}
+
+    async def run():
+        conn = ActiveConnection(intruder, port=echo_server, params_cache=cache)  # type: ignore
+        await conn.connect()
+        await conn.handshake()
+        await conn.write("hi")
+        await conn.read()
+
+    with pytest.raises(IncorrectPasswordError):
+        asyncio.run(run())
+
+
+def test_proxy_downgrades_fast_handshake(echo_server):
+    async def run():
+        mitm = MitmProxy(("127.0.0.1", echo_server))
+        server = await mitm.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        cache = {("127.0.0.1", port): (5, 23)}
+        conn = ActiveConnection(user, port=port, params_cache=cache)  # type: ignore
+        reply = await echo_once(conn, "hi")
+        server.close()
+        return reply
+
+    assert asyncio.run(run()) == "hi"
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import threading
+
+from pydantic.json import pydantic_encoder
+
+from sec_sem8.entities import Message
+from sec_sem8.history import READ_REPLY_HEAD, History, read_reply_tail
+from sec_sem8.impl import SqliteMessageLog
+
+
+def test_history_without_log_keeps_messages_in_memory():
+    history = History()
+    history.append(Message(author="a", content="1"))
+    history.sync()
+    assert history.messages == [Message(author="a", content="1")]
+
+
+def test_history_catches_up_with_writes_of_other_process(tmp_path):
+    path = str(tmp_path / "messages.sqlite")
+    first = History(SqliteMessageLog(path))
+    second = History(SqliteMessageLog(path))
+
+    first.append(Message(author="a", content="1"))
+    second.append(Message(author="b", content="2"))
+    first.sync()
+
+    expected = [Message(author="a", content="1"), Message(author="b", content="2")]
+    assert first.messages == expected
+    assert second.messages == expected
+    assert len(first) == 2
+
+
+def test_async_appends_use_the_log_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "messages.sqlite")
+    threads = []
+
+    class TracedLog(SqliteMessageLog):
+        def append(self, message, room):
+            threads.append(threading.get_ident())
+            super().append(message, room)
+
+    history = History(TracedLog(path))
+    other = History(SqliteMessageLog(path))
+
+    async def run():
+        await asyncio.gather(
+            *(
+                history.append_async(Message(author="a", content=str(i)))
+                for i in range(5)
+            )
+        )
+        other.append(Message(author="b", content="5"))
+        await history.sync_async()
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert len(threads) == 5 and loop_thread not in threads
+    assert [m.content for m in history.messages] == [str(i) for i in range(6)]
+    assert len(history) == 6
+
+
+def test_encoded_reads_match_json_of_messages():
+    history = History()
+    messages = [Message(author=f"a{i}", content="ю" * i) for i in range(30)]
+    for message in messages:
+        history.append(message)
+
+    for after in [0, 1, 29, 30, 31]:
+        for chunk_size in [1, 7, 1024]:
+            chunks = list(history.encode_chunks(chunk_size, after=after))
+            frame = len(READ_REPLY_HEAD) + len(read_reply_tail(30))
+            assert max(map(len, chunks)) <= chunk_size + frame
+            expected = json.dumps(
+                messages[after:], default=pydantic_encoder, ensure_ascii=False
+            )
+            reply = b"".join(chunks).decode()
+            assert reply == f'{{"messages": {expected}, "next": 30}}'
+
+    everything = b"".join(history.encode_chunks(7)).decode()
+    assert everything == json.dumps(
+        messages, default=pydantic_encoder, ensure_ascii=False
+    )
+    assert b"".join(history.encode_chunks(7, "missing")) == b"[]"
+
+
+def test_read_does_not_see_messages_appended_while_streaming():
+    history = History()
+    history.append(Message(author="a", content="1"))
+    chunks = history.encode_chunks(4)
+    first = next(chunks)
+    history.append(Message(author="b", content="2"))
+
+    reply = json.loads(first + b"".join(chunks))
+    assert reply == [{"author": "a", "content": "1"}]
+
+
+def test_room_decodes_messages_by_index_and_range():
+    history = History()
+    messages = [Message(author=f"a{i % 3}", content=f"ю{i}") for i in range(10)]
+    for message in messages:
+        history.append(message)
+    room = history.rooms["general"]
+
+    assert len(room) == 10
+    assert room[0] == messages[0]
+    assert room[-1] == messages[-1]
+    assert room.slice(3, 6) == messages[3:6]
+    assert room.slice(8, 100) == messages[8:]
+    assert room.slice(6, 3) == []
+    assert [room.author(i) for i in range(4)] == ["a0", "a1", "a2", "a0"]
+    assert len(history.authors) == 3
+
+
+def test_columnar_history_is_compact():
+    from benchmarks.history_memory import measure
+
+    result = measure(messages=5_000, content_size=64, authors=50, vocabulary=2_000)
+
+    index = result.index_bytes_per_message
+    assert 0 < index < 150
+    assert result.columnar.overhead_per_message - index < 80
+    assert result.columnar.bytes_per_message * 2 < result.objects.bytes_per_message
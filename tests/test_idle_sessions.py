@@ -0,0 +1,7 @@
+def test_idle_session_fits_memory_budget():
+    from benchmarks.idle_sessions import measure
+
+    result = measure(sessions=300)
+
+    # 100k sessions in about 1 GiB, before compacting one took over 15 KB
+    assert result.bytes_per_session < 10_000
@@ -0,0 +1,178 @@
+import asyncio
+import time
+
+import pytest
+
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.connection.client_messages import ConnectRequest
+from sec_sem8.connection.limits import (
+    ConnectionLimiter,
+    ConnectionLimits,
+    LOCAL,
+    LoopLagMonitor,
+    RateLimiter,
+)
+from sec_sem8.server import ChatServer
+from tests.conftest import EchoWorld, user
+
+
+def test_limiter_caps_total_and_per_address():
+    limiter = ConnectionLimiter(
+        ConnectionLimits(max_connections=3, max_connections_per_ip=2)
+    )
+    assert limiter.try_acquire("a") is None
+    assert limiter.try_acquire("a") is None
+    assert limiter.try_acquire("a") == ConnectionLimiter.REJECT_PER_IP
+    assert limiter.try_acquire("b") is None
+    assert limiter.try_acquire("c") == ConnectionLimiter.REJECT_FULL
+
+    limiter.release("a")
+    assert limiter.try_acquire("c") is None
+
+
+def test_local_peers_skip_per_address_limits():
+    limits = ConnectionLimits(max_connections_per_ip=1, handshake_rate_per_ip=None)
+    limiter = ConnectionLimiter(limits)
+    assert limiter.try_acquire(LOCAL) is None
+    assert limiter.try_acquire(LOCAL) is None
+
+    limiter = ConnectionLimiter(limits.copy(update={"limit_local_peers": True}))
+    assert limiter.try_acquire(LOCAL) is None
+    assert limiter.try_acquire(LOCAL) == ConnectionLimiter.REJECT_PER_IP
+
+
+def test_stage_timeout_override():
+    limits = ConnectionLimits(handshake_stage_timeout=5, stage_timeouts={"Start": 1})
+    assert limits.stage_timeout("Start") == 1
+    assert limits.stage_timeout("TaskRequested") == 5
+
+
+async def serve(limits: ConnectionLimits):
+    server = ChatServer(EchoWorld(), verbose=False, limits=limits)
+    tcp = await server.start("127.0.0.1", 0)
+    return tcp, tcp.sockets[0].getsockname()[1]
+
+
+def test_silent_client_is_closed_after_stage_deadline():
+    async def run():
+        tcp, port = await serve(ConnectionLimits(handshake_stage_timeout=0.05))
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write((ConnectRequest(username="user").json() + "\n").encode())
+        assert b"nonce" in await reader.readline()
+        assert await asyncio.wait_for(reader.read(), 1) == b""
+        tcp.close()
+
+    asyncio.run(run())
+
+
+def test_established_session_is_reaped_after_idle_timeout():
+    async def run():
+        tcp, port = await serve(ConnectionLimits(idle_timeout=0.05))
+        connection = ActiveConnection(user, port=port)  # type: ignore
+        await connection.connect()
+        await connection.handshake()
+        assert connection.reader is not None
+        assert await asyncio.wait_for(connection.reader.read(), 1) == b""
+        tcp.close()
+
+    asyncio.run(run())
+
+
+def test_oversized_frame_closes_connection():
+    async def run():
+        tcp, port = await serve(ConnectionLimits(max_frame_size=1024))
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"x" * 4096 + b"\n")
+        assert await asyncio.wait_for(reader.read(), 1) == b""
+        tcp.close()
+
+    asyncio.run(run())
+
+
+def test_connections_over_cap_get_error():
+    async def run():
+        tcp, port = await serve(ConnectionLimits(max_connections=1))
+        first = ActiveConnection(user, port=port)  # type: ignore
+        await first.connect()
+        await first.handshake()
+
+        second = ActiveConnection(user, port=port)  # type: ignore
+        await second.connect()
+        with pytest.raises(ValueError, match="server is full"):
+            await second.handshake()
+
+        await first.say_goodbye()
+        tcp.close()
+
+    asyncio.run(run())
+
+
+def test_rate_limiter_refills_over_time():
+    limiter = RateLimiter(rate=1, burst=2)
+    assert limiter.allow("a", now=0) and limiter.allow("a", now=0)
+    assert not limiter.allow("a", now=0.5)
+    assert limiter.allow("a", now=1.5)
+    assert limiter.allow("b", now=1.5)
+
+
+def test_rate_limiter_forgets_refilled_keys():
+    limiter = RateLimiter(rate=1, burst=1, max_keys=2)
+    limiter.allow("a", now=0)
+    limiter.allow("b", now=0)
+    limiter.allow("c", now=5)
+    assert set(limiter.buckets) == {"c"}
+
+
+def test_lagging_loop_sheds_new_connections():
+    limiter = ConnectionLimiter(ConnectionLimits(max_loop_lag=0.1))
+    limiter.lag.lag = 0.5
+    assert limiter.try_acquire("a") == ConnectionLimiter.REJECT_OVERLOADED
+    limiter.lag.lag = 0.0
+    assert limiter.try_acquire("a") is None
+
+
+def test_handshakes_over_rate_get_error():
+    async def run():
+        limits = ConnectionLimits(
+            handshake_rate_per_ip=None,
+            handshake_rate_per_user=0.001,
+            handshake_burst_per_user=1,
+        )
+        tcp, port = await serve(limits)
+        first = ActiveConnection(user, port=port)  # type: ignore
+        await first.connect()
+        await first.handshake()
+
+        second = ActiveConnection(user, port=port)  # type: ignore
+        await second.connect()
+        with pytest.raises(ValueError, match="too many handshakes for user"):
+            await second.handshake()
+
+        tcp.close()
+
+    asyncio.run(run())
+
+
+def test_address_over_rate_is_rejected_before_handshake():
+    async def run():
+        limits = ConnectionLimits(handshake_rate_per_ip=0.001, handshake_burst_per_ip=1)
+        tcp, port = await serve(limits)
+        await asyncio.open_connection("127.0.0.1", port)
+        reader, _ = await asyncio.open_connection("127.0.0.1", port)
+        assert b"too many handshakes from address" in await reader.readline()
+        tcp.close()
+
+    asyncio.run(run())
+
+
+def test_lag_monitor_notices_blocked_loop():
+    async def run():
+        monitor = LoopLagMonitor(interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.2)
+        await asyncio.sleep(0.02)
+        monitor.stop()
+        return monitor.lag
+
+    assert asyncio.run(run()) > 0.05
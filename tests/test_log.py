@@ -0,0 +1,80 @@
+import io
+import json
+import logging
+
+import pytest
+
+from sec_sem8.connection.client_messages import ClientData
+from sec_sem8.log import (
+    DroppingQueueHandler,
+    get_logger,
+    parse_sampling,
+    records_dropped,
+    setup_logging,
+    stop_logging,
+)
+
+
+@pytest.fixture
+def output():
+    stream = io.StringIO()
+    yield stream
+    stop_logging()
+
+
+def read_records(stream: io.StringIO) -> list[dict]:
+    stop_logging()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_records_are_written_by_listener_and_redacted(output):
+    setup_logging(logging.DEBUG, json_lines=True, stream=output)
+    get_logger("test").info("frame_in", frame=ClientData(data="secret"), size=6)
+
+    [record] = read_records(output)
+
+    assert record["event"] == "frame_in"
+    assert record["logger"] == "sec_sem8.test"
+    assert record["size"] == 6
+    assert record["frame"] == {
+        "type": "ClientData",
+        "id": 3,
+        "data": "<redacted 6 chars>",
+    }
+
+
+def test_records_below_level_are_skipped(output):
+    setup_logging(logging.INFO, json_lines=True, stream=output)
+    get_logger("test").debug("frame_in")
+    get_logger("test").warning("handshake_failed")
+
+    assert [r["event"] for r in read_records(output)] == ["handshake_failed"]
+
+
+def test_sampled_out_events_are_skipped(output):
+    setup_logging(
+        logging.DEBUG, json_lines=True, stream=output, sampling={"frame_in": 0.0}
+    )
+    for _ in range(10):
+        get_logger("test").debug("frame_in")
+    get_logger("test").debug("frame_out")
+
+    assert [r["event"] for r in read_records(output)] == ["frame_out"]
+
+
+def test_full_queue_drops_records_instead_of_blocking():
+    import queue
+
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    before = records_dropped.labels().value
+    for _ in range(3):
+        handler.emit(logging.makeLogRecord({"msg": "event"}))
+    assert records_dropped.labels().value - before == 2
+
+
+def test_parse_sampling():
+    assert parse_sampling("frame_in=0.1, frame_out=1") == {
+        "frame_in": 0.1,
+        "frame_out": 1.0,
+    }
+    assert parse_sampling("") == {}
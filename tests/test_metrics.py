@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from sec_sem8.metrics import Registry, start_metrics_server
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter_and_gauge_render_as_prometheus_text(registry):
+    requests = registry.counter("requests_total", "requests", ["type"])
+    sessions = registry.gauge("sessions", "open sessions")
+    requests.labels("read").inc()
+    requests.labels("read").inc(2)
+    sessions.inc()
+    sessions.inc()
+    sessions.dec()
+
+    text = registry.render()
+
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{type="read"} 3' in text
+    assert "# TYPE sessions gauge" in text
+    assert "sessions 1" in text
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    latency = registry.histogram("latency_seconds", "latency", buckets=(0.1, 1.0))
+    for value in [0.05, 0.5, 0.7, 5.0]:
+        latency.observe(value)
+
+    text = registry.render()
+
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 3' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+    assert "latency_seconds_count 4" in text
+    assert "latency_seconds_sum 6.25" in text
+
+
+def test_labelled_metric_requires_labels(registry):
+    counter = registry.counter("frames_total", "frames", ["direction"])
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        registry.counter("frames_total", "duplicate")
+
+
+def test_metrics_endpoint_serves_registry(registry):
+    registry.counter("scraped_total", "scrapes").inc()
+
+    async def scrape(path: str) -> bytes:
+        server = await start_metrics_server("127.0.0.1", 0, registry)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.0\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        server.close()
+        return response
+
+    response = asyncio.run(scrape("/metrics"))
+    assert response.startswith(b"HTTP/1.0 200 OK")
+    assert b"scraped_total 1" in response
+    assert asyncio.run(scrape("/other")).startswith(b"HTTP/1.0 404")
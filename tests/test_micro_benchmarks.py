@@ -0,0 +1,30 @@
+import typer
+from typer.testing import CliRunner
+
+from benchmarks.micro import find_regressions, main
+
+
+def test_regression_is_reported_above_threshold():
+    baseline = {"fast": 1.0, "slow": 1.0}
+    results = {"fast": 1.1, "slow": 1.3, "skipped": None, "new": 5.0}
+    assert find_regressions(results, baseline, threshold=25) == ["slow"]
+
+
+def test_speedup_is_not_a_regression():
+    assert find_regressions({"op": 0.5}, {"op": 1.0}, threshold=0) == []
+
+
+def test_run_needs_a_recorded_baseline(tmp_path):
+    app = typer.Typer()
+    app.command()(main)
+    path = tmp_path / "baseline.json"
+
+    result = CliRunner().invoke(app, ["--baseline", str(path), "--only", "rc4_init"])
+
+    assert result.exit_code == 1
+    assert not path.exists()
+
+    args = ["--baseline", str(path), "--only", "rc4_init", "--repeat", "1"]
+    assert CliRunner().invoke(app, [*args, "--update"]).exit_code == 0
+    assert path.exists()
+    assert CliRunner().invoke(app, [*args, "--threshold", "1000"]).exit_code == 0
@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+from benchmarks.mitm import run_comparison
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.mitm import MitmProxy
+from sec_sem8.transcript import TranscriptWriter
+from tests.conftest import user
+
+
+def test_proxy_relays_and_records_plaintext(echo_server, tmp_path):
+    path = tmp_path / "transcript.jsonl"
+    big = "b" * (40 * 1024)
+
+    async def run():
+        mitm = MitmProxy(("127.0.0.1", echo_server), TranscriptWriter(path))
+        server = await mitm.start("127.0.0.1", 0)
+        conn = ActiveConnection(user, port=server.sockets[0].getsockname()[1])  # type: ignore
+        await conn.connect()
+        await conn.handshake()
+        await conn.write("hello")
+        replies = [await conn.read()]
+        await conn.write(big)
+        replies.append(await conn.read())
+        await conn.say_goodbye()
+        server.close()
+        await mitm.close()
+        return replies
+
+    assert asyncio.run(run()) == ["hello", big]
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(r["author"], r["direction"], r["text"]) for r in records[:2]] == [
+        ("user", "client", "hello"),
+        ("user", "server", "hello"),
+    ]
+    client_chunks = [r for r in records[2:] if r["direction"] == "client"]
+    assert "".join(r["text"] for r in client_chunks) == big
+    assert client_chunks[-1]["last"]
+
+
+def test_transcript_drops_records_past_buffer_limit(tmp_path):
+    async def run():
+        transcript = TranscriptWriter(tmp_path / "t.jsonl", max_bytes=100)
+        transcript.start()
+        for i in range(10):
+            transcript.write({"text": "x" * 20})
+        await transcript.close()
+        return transcript.dropped
+
+    assert asyncio.run(run()) > 0
+    assert len((tmp_path / "t.jsonl").read_text().splitlines()) < 10
+
+
+def test_mitm_benchmark_compares_paths():
+    result = run_comparison(requests=20, message_size=8)
+    assert result.direct.count == result.proxied.count == 20
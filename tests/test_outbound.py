@@ -0,0 +1,173 @@
+import asyncio
+from unittest.mock import Mock
+
+import pytest
+
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.connection.outbound import (
+    OutboundLimits,
+    OutboundQueue,
+    SlowClientError,
+    parse_policy,
+)
+from sec_sem8.connection.passive_connection import DROPPED_REPLY
+from sec_sem8.entities import SearchRequest, WriteRequest
+from sec_sem8.server import ChatServer
+from tests.conftest import EchoWorld, user
+
+
+class StalledWriter:
+    """StreamWriter stand-in whose drain() waits until client is resumed"""
+
+    def __init__(self) -> None:
+        self.written: list[bytes] = []
+        self.batches: list[int] = []
+        self.accepting = asyncio.Event()
+        self.accepting.set()
+        self.transport = Mock()
+
+    def write(self, data: bytes):
+        self.written.append(data)
+        self.batches.append(1)
+
+    def writelines(self, data: list[bytes]):
+        self.written.extend(data)
+        self.batches.append(len(data))
+
+    async def drain(self):
+        await self.accepting.wait()
+
+
+def test_frames_are_written_in_order():
+    async def run():
+        writer = StalledWriter()
+        queue = OutboundQueue(writer)  # type: ignore
+        for frame in [b"a", b"b", b"c"]:
+            queue.put(frame)
+        await queue.flush(timeout=1)
+        assert writer.written == [b"a", b"b", b"c"]
+        assert queue.depth == 0
+        await queue.close()
+
+    asyncio.run(run())
+
+
+def test_frames_queued_together_are_written_together():
+    async def run():
+        writer = StalledWriter()
+        limits = OutboundLimits(high_watermark=4, low_watermark=0)
+        queue = OutboundQueue(writer, limits)  # type: ignore
+        for frame in [b"a", b"b", b"c", b"dddd", b"e"]:
+            queue.put(frame)
+        await queue.flush(timeout=1)
+        queue.put(b"f")
+        await queue.flush(timeout=1)
+
+        assert writer.written == [b"a", b"b", b"c", b"dddd", b"e", b"f"]
+        assert writer.batches == [3, 1, 1, 1]
+        await queue.close()
+
+    asyncio.run(run())
+
+
+def test_send_waits_above_high_watermark_until_low_watermark():
+    async def run():
+        writer = StalledWriter()
+        writer.accepting.clear()
+        limits = OutboundLimits(high_watermark=10, low_watermark=4, max_bytes=100)
+        queue = OutboundQueue(writer, limits)  # type: ignore
+
+        await queue.send(b"12345")
+        sender = asyncio.create_task(queue.send(b"123456"))
+        await asyncio.sleep(0.01)
+        assert not sender.done()
+        assert queue.queued_bytes == 11
+
+        writer.accepting.set()
+        await asyncio.wait_for(sender, 1)
+        await queue.close()
+
+    asyncio.run(run())
+
+
+def test_stalled_client_is_evicted_after_drain_timeout():
+    async def run():
+        writer = StalledWriter()
+        writer.accepting.clear()
+        queue = OutboundQueue(writer, OutboundLimits(drain_timeout=0.01))  # type: ignore
+        queue.put(b"frame")
+        await asyncio.sleep(0.05)
+
+        writer.transport.abort.assert_called_once()
+        with pytest.raises(SlowClientError):
+            queue.put(b"more")
+        await queue.close()
+
+    asyncio.run(run())
+
+
+def test_overflow_policy():
+    async def run():
+        writer = StalledWriter()
+        writer.accepting.clear()
+
+        dropping = OutboundQueue(writer, OutboundLimits(max_bytes=8, policy="drop", drain_timeout=0.05))  # type: ignore
+        dropping.put(b"12345678")
+        assert dropping.reserve(1) is False
+        await dropping.close()
+
+        disconnecting = OutboundQueue(writer, OutboundLimits(max_bytes=8, drain_timeout=0.05))  # type: ignore
+        disconnecting.put(b"12345678")
+        with pytest.raises(SlowClientError):
+            disconnecting.reserve(1)
+        writer.transport.abort.assert_called_once()
+        await disconnecting.close()
+
+    asyncio.run(run())
+
+
+def test_dropped_reply_is_replaced_so_replies_stay_paired():
+    limits = OutboundLimits(max_bytes=200, policy="drop")
+
+    async def run():
+        server = ChatServer(EchoWorld(), verbose=False, outbound_limits=limits)
+        tcp = await server.start("127.0.0.1", 0)
+        conn = ActiveConnection(user, port=tcp.sockets[0].getsockname()[1])  # type: ignore
+        await conn.connect()
+        await conn.handshake()
+        replies = []
+        for request in [
+            WriteRequest(content="word " * 60),
+            SearchRequest(query="word"),  # reply does not fit max_bytes
+            WriteRequest(content="next"),
+        ]:
+            await conn.write(request.json())
+            replies.append(await conn.read())
+        await conn.say_goodbye()
+        tcp.close()
+        return replies
+
+    assert asyncio.run(run()) == ['"ack"', DROPPED_REPLY.decode(), '"ack"']
+
+
+def test_parse_policy():
+    assert parse_policy("drop") == "drop"
+    with pytest.raises(ValueError):
+        parse_policy("ignore")
+
+
+def test_idle_queue_holds_no_writer_task():
+    async def run():
+        writer = StalledWriter()
+        queue = OutboundQueue(writer)  # type: ignore
+        queue.put(b"a")
+        await queue.flush(timeout=1)
+        await asyncio.sleep(0)
+        assert queue._task is None
+
+        queue.put(b"b")
+        await queue.flush(timeout=1)
+        assert writer.written == [b"a", b"b"]
+        await queue.close()
+
+    asyncio.run(run())
@@ -0,0 +1,149 @@
+import asyncio
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sec_sem8.connection import client_messages, server_messages
+from sec_sem8.connection.server_states import DiffieDone, PasswordSolved, Start
+from sec_sem8.hash_task import solve_task
+from sec_sem8.impl import SqliteParamsStore
+from sec_sem8.params import DiffieParamsManager, PublishedDiffieParams
+from sec_sem8.server import _rotate_while_running
+from tests.conftest import PASSWORD_HASH, EchoWorld
+
+
+def small_params() -> tuple[int, int]:
+    return 2, 11
+
+
+def broken_generator() -> tuple[int, int]:
+    raise RuntimeError("no factorization tool")
+
+
+def test_rotation_runs_in_separate_process():
+    manager = DiffieParamsManager((5, 23), generate=small_params)
+
+    async def run():
+        rotated = await manager.rotate()
+        manager.stop()
+        return rotated
+
+    assert asyncio.run(run())
+    assert manager.current == (2, 11)
+
+
+def test_failed_rotation_keeps_parameters():
+    manager = DiffieParamsManager(
+        (5, 23), generate=broken_generator, executor=ThreadPoolExecutor(1)
+    )
+    assert not asyncio.run(manager.rotate())
+    assert manager.current == (5, 23)
+
+
+def test_parameters_rotate_periodically():
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return 2, 11
+
+    manager = DiffieParamsManager(
+        (5, 23),
+        rotation_interval=0.02,
+        generate=generate,
+        executor=ThreadPoolExecutor(1),
+    )
+
+    async def run():
+        manager.start()
+        await asyncio.sleep(0.15)
+        manager.stop()
+
+    asyncio.run(run())
+    assert len(calls) >= 2
+    assert manager.current == (2, 11)
+
+
+def test_workers_switch_to_published_parameters_together(tmp_path):
+    path = str(tmp_path / "shared.sqlite")
+    store = SqliteParamsStore(path)
+    store.publish((5, 23), time.time())
+    launcher = DiffieParamsManager(
+        (5, 23),
+        generate=small_params,
+        executor=ThreadPoolExecutor(1),
+        store=store,
+        activation_delay=0.5,
+    )
+    workers = [PublishedDiffieParams(SqliteParamsStore(path)) for _ in range(2)]
+
+    assert asyncio.run(launcher.rotate())
+    assert all(asyncio.run(worker.rotate()) for worker in workers)
+    assert [worker.current for worker in workers] == [(5, 23), (5, 23)]
+
+    time.sleep(0.6)
+    assert [worker.current for worker in workers] == [(2, 11), (2, 11)]
+    assert PublishedDiffieParams(SqliteParamsStore(path)).current == (2, 11)
+
+
+def test_launcher_exports_rotation_metrics():
+    manager = DiffieParamsManager(
+        (5, 23), generate=small_params, executor=ThreadPoolExecutor(1)
+    )
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    class Worker:
+        alive = True
+
+        def is_alive(self) -> bool:
+            return self.alive
+
+    async def run() -> bytes:
+        worker = Worker()
+        launcher = asyncio.create_task(
+            _rotate_while_running(manager, [worker], metrics_port=port)
+        )
+        await asyncio.sleep(0.1)
+        await manager.rotate()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        worker.alive = False
+        await launcher
+        return response
+
+    response = asyncio.run(run())
+    assert b'sec_sem8_diffie_params_rotations_total{outcome="ok"}' in response
+    assert b"sec_sem8_diffie_params_generation_seconds_count" in response
+
+
+def test_started_handshake_keeps_its_parameters():
+    manager = DiffieParamsManager((5, 23))
+
+    class RotatingWorld(EchoWorld):
+        def get_diffie_params(self, username: str) -> tuple[int, int]:
+            return manager.current
+
+    world = RotatingWorld()
+    nonce, state = Start().on_message(
+        client_messages.ConnectRequest(username="user"), world
+    )
+    assert isinstance(nonce, server_messages.Nonce)
+    request, state = state.on_message(
+        client_messages.HashAnswer(answer=solve_task(PASSWORD_HASH, nonce.nonce)),
+        world,
+    )
+    assert isinstance(request, server_messages.DiffieRequest)
+    assert isinstance(state, PasswordSolved)
+
+    manager._swap((2, 11))
+    client_secret = 6
+    _, done = state.on_message(
+        client_messages.DiffieAnswer(client_public_value=pow(5, client_secret, 23)),
+        world,
+    )
+    assert isinstance(done, DiffieDone)
+    assert done.shared_key == pow(request.server_public_value, client_secret, 23)
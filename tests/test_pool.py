@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from sec_sem8.connection.pool import ActiveConnectionPool, PoolClosedError
+from tests.conftest import user
+
+
+def test_pool_prepares_min_size_sessions(echo_server):
+    async def run():
+        async with ActiveConnectionPool(user, port=echo_server, size=3, min_size=2) as pool:  # type: ignore
+            stats = pool.stats()
+            assert stats.idle == 2
+            assert stats.handshakes == 2
+
+    asyncio.run(run())
+
+
+def test_pool_reuses_checked_in_sessions(echo_server):
+    async def run():
+        async with ActiveConnectionPool(user, port=echo_server, size=2, min_size=1) as pool:  # type: ignore
+            for i in range(5):
+                async with pool.connection() as conn:
+                    await conn.write(str(i))
+                    assert await conn.read() == str(i)
+            assert pool.stats().handshakes == 1
+
+    asyncio.run(run())
+
+
+def test_pool_makes_waiters_queue_when_full(echo_server):
+    async def run():
+        async with ActiveConnectionPool(user, port=echo_server, size=1, min_size=1) as pool:  # type: ignore
+            conn = await pool.checkout()
+            waiter = asyncio.create_task(pool.checkout())
+            await asyncio.sleep(0.05)
+            assert pool.stats().waiters == 1
+            await pool.checkin(conn)
+            assert await waiter is conn
+            await pool.checkin(conn)
+
+            held = await pool.checkout()
+            with pytest.raises(asyncio.TimeoutError):
+                await pool.checkout(timeout=0.05)
+            await pool.checkin(held)
+
+    asyncio.run(run())
+
+
+def test_pool_drops_discarded_and_refuses_after_close(echo_server):
+    async def run():
+        pool = ActiveConnectionPool(user, port=echo_server, size=2, min_size=0)  # type: ignore
+        await pool.start()
+        conn = await pool.checkout()
+        await pool.checkin(conn, discard=True)
+        assert not conn.is_open()
+        assert pool.stats().size == 0
+        await pool.close()
+        with pytest.raises(PoolClosedError):
+            await pool.checkout()
+
+    asyncio.run(run())
+
+
+def test_pool_expires_idle_sessions(echo_server):
+    async def run():
+        pool = ActiveConnectionPool(
+            user, port=echo_server, size=3, min_size=1, max_idle_time=0.0, health_check_interval=0.05  # type: ignore
+        )
+        async with pool:
+            first, second = await pool.checkout(), await pool.checkout()
+            await pool.checkin(first)
+            await pool.checkin(second)
+            await asyncio.sleep(0.2)
+            assert pool.stats().idle == 1
+
+    asyncio.run(run())
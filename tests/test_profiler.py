@@ -0,0 +1,102 @@
+import asyncio
+import os
+import signal
+
+import pytest
+
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.entities import WriteRequest
+from sec_sem8.metrics import Registry, start_metrics_server
+from sec_sem8.profiler import ProfilerControl, SamplingProfiler
+from sec_sem8.server import ChatServer
+from tests.conftest import EchoWorld, user
+
+
+class Worker:
+    async def crunch(self, seconds: float):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+        while loop.time() < deadline:
+            pow(3, 10**5, 2**127 - 1)
+            await asyncio.sleep(0)
+
+
+def test_samples_are_attributed_to_running_coroutine():
+    async def run():
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        await Worker().crunch(0.2)
+        return profiler.stop()
+
+    profile = asyncio.run(run())
+    owners = profile.attribute(("Worker.",))
+
+    assert profile.samples > 0
+    assert owners.most_common(1)[0][0] == "tests.test_profiler:Worker.crunch"
+    assert "tests.test_profiler:Worker.crunch" in profile.collapsed()
+    for line in profile.collapsed().splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0 and stack
+
+
+def test_profile_route_covers_server_sessions():
+    async def get(port: int, path: str) -> bytes:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.0\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    async def chat(port: int, seconds: float):
+        conn = ActiveConnection(user, port=port)  # type: ignore
+        await conn.connect()
+        await conn.handshake()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+        while loop.time() < deadline:
+            await conn.write(WriteRequest(content="x" * 4096).json())
+            await conn.read()
+        await conn.say_goodbye()
+
+    async def run():
+        control = ProfilerControl(interval=0.001)
+        server = ChatServer(EchoWorld(), verbose=False, profiler=control)
+        tcp = await server.start("127.0.0.1", 0)
+        metrics = await start_metrics_server(
+            "127.0.0.1", 0, Registry(), {"/debug/profile": control.handle_http}
+        )
+        port = metrics.sockets[0].getsockname()[1]
+        profile, busy, _ = await asyncio.gather(
+            get(port, "/debug/profile?seconds=0.3&format=top"),
+            get(port, "/debug/profile?seconds=0.3"),
+            chat(tcp.sockets[0].getsockname()[1], 0.4),
+        )
+        bad = await get(port, "/debug/profile?seconds=soon")
+        tcp.close()
+        metrics.close()
+        return profile, busy, bad
+
+    profile, busy, bad = asyncio.run(run())
+
+    assert profile.startswith(b"HTTP/1.0 200 OK")
+    assert b"passive_connection:PassiveConnection." in profile
+    assert busy.startswith(b"HTTP/1.0 409")
+    assert bad.startswith(b"HTTP/1.0 400")
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="no SIGUSR1")
+def test_signal_writes_collapsed_profile(tmp_path):
+    async def run():
+        control = ProfilerControl(tmp_path, seconds=0.1, interval=0.001)
+        control.install_signal()
+        os.kill(os.getpid(), signal.SIGUSR1)
+        await Worker().crunch(0.3)
+        while control.profiler.running or control._task is None:
+            await asyncio.sleep(0.01)
+        await control._task
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+
+    asyncio.run(run())
+
+    (path,) = tmp_path.glob("profile-*.collapsed")
+    assert "Worker.crunch" in path.read_text()
@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.entities import JoinRequest, ReadRequest, WriteRequest
+from sec_sem8.recorder import SessionRecorder
+from sec_sem8.replay import from_transcript, load_recording, replay
+from sec_sem8.server import ChatServer
+from tests.conftest import EchoWorld, user
+
+
+async def record_session(path):
+    server = ChatServer(EchoWorld(), verbose=False, recorder=SessionRecorder(path))
+    tcp = await server.start("127.0.0.1", 0)
+    conn = ActiveConnection(user, port=tcp.sockets[0].getsockname()[1])  # type: ignore
+    await conn.connect()
+    await conn.handshake()
+    for request in [
+        WriteRequest(content="hello"),
+        JoinRequest(room="random"),
+        ReadRequest(room="random"),
+    ]:
+        await conn.write(request.json())
+        await conn.read()
+    await conn.say_goodbye()
+    await asyncio.sleep(0.05)
+    tcp.close()
+    await server.recorder.close()  # type: ignore
+
+
+def test_server_records_request_mix(tmp_path):
+    path = tmp_path / "recording.jsonl"
+    asyncio.run(record_session(path))
+
+    (session,) = load_recording(path)
+    assert session.username == "user"
+    assert session.handshake_seconds is not None
+    assert [(r.kind, r.room, r.size) for r in session.requests] == [
+        ("write", "general", 5),
+        ("join", "random", 0),
+        ("read", "random", 0),
+    ]
+    assert all(r.latency is not None and r.latency >= 0 for r in session.requests)
+
+
+def test_recording_replays_against_fresh_server(tmp_path):
+    path = tmp_path / "recording.jsonl"
+    asyncio.run(record_session(path))
+
+    async def run():
+        server = ChatServer(EchoWorld(), verbose=False)
+        tcp = await server.start("127.0.0.1", 0)
+        port = tcp.sockets[0].getsockname()[1]
+        report = await replay(
+            load_recording(path), "127.0.0.1", port, lambda name: user, speed=10
+        )
+        tcp.close()
+        return report
+
+    report = asyncio.run(run())
+    assert report.errors == 0
+    assert report.replayed.requests == report.recorded.requests == 3
+    assert set(report.divergence.p50_delta) == {"join", "read", "write"}
+
+
+def test_sessions_are_rebuilt_from_mitm_transcript(tmp_path):
+    path = tmp_path / "transcript.jsonl"
+    records = [
+        (1.0, 1, "client", WriteRequest(content="ab" * 3).json(), {"last": False}),
+        (1.0, 1, "client", "", {"last": True}),
+        (1.5, 1, "server", '"ack"', {}),
+        (2.0, 2, "client", ReadRequest().json(), {}),
+        (2.25, 2, "server", "[]", {}),
+    ]
+    path.write_text(
+        "".join(
+            json.dumps(
+                {"time": t, "session": s, "author": "user", "direction": d, "text": x}
+                | extra
+            )
+            + "\n"
+            for t, s, d, x, extra in records
+        )
+    )
+
+    first, second = from_transcript(path)
+    assert [(r.kind, r.size, r.latency) for r in first.requests] == [("write", 6, 0.5)]
+    assert [(r.kind, r.latency) for r in second.requests] == [("read", 0.25)]
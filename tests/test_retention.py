@@ -0,0 +1,182 @@
+import asyncio
+import json
+import sqlite3
+from array import array
+
+import pytest
+
+from sec_sem8.entities import Message
+from sec_sem8.history import History
+from sec_sem8.impl import SqliteMessageLog
+from sec_sem8.retention import Compactor, Retention, RetentionPolicy, parse_policies
+
+
+def _history(count: int, authors: int = 1, log=None) -> History:
+    history = History(log)
+    for i in range(count):
+        message = Message(author=f"a{i % authors}", content=f"word{i % 3} {i}")
+        history.append(message, "room")
+    return history
+
+
+def _reply(history: History, after: int = 0) -> dict:
+    return json.loads(b"".join(history.encode_chunks(7, "room", after)))
+
+
+def _read(history: History, after: int = 0) -> list[str]:
+    return [message["content"] for message in _reply(history, after)["messages"]]
+
+
+def _compact(history: History, retention: Retention) -> int:
+    return asyncio.run(Compactor(history, retention).compact())
+
+
+def test_parse_policies():
+    assert parse_policies("random.count=10, a.b.age=60,random.bytes=100") == {
+        "random": RetentionPolicy(max_count=10, max_bytes=100),
+        "a.b": RetentionPolicy(max_age=60),
+    }
+    assert parse_policies("") == {}
+    with pytest.raises(ValueError):
+        parse_policies("random.size=10")
+
+
+def test_room_limits_remove_oldest_and_keep_cursors():
+    history = _history(10)
+
+    removed = _compact(history, Retention(default=RetentionPolicy(max_count=4)))
+
+    assert removed == 6 and len(history) == 4
+    assert _read(history) == [f"word{i % 3} {i}" for i in range(6, 10)]
+    assert _read(history, after=8) == ["word2 8", "word0 9"]
+    history.append(Message(author="a0", content="word1 10"), "room")
+    assert _read(history, after=10) == ["word1 10"]
+
+    found, _ = history.search("room", "word1")
+    assert [position for position, _ in found] == [10, 7]
+    postings = history.rooms["room"].index.tokens.values()
+    assert min(position for positions in postings for position in positions) == 6
+
+
+def test_reads_following_next_get_no_duplicates_across_compaction():
+    history = _history(10)
+    retention = Retention(default=RetentionPolicy(max_count=4))
+    _compact(history, retention)
+
+    first = _reply(history)
+    assert len(first["messages"]) == 4 and first["next"] == 10
+    for i in range(10, 13):
+        history.append(Message(author="a0", content=f"word{i % 3} {i}"), "room")
+    _compact(history, retention)
+
+    second = _reply(history, after=first["next"])
+    assert [m["content"] for m in second["messages"]] == [
+        f"word{i % 3} {i}" for i in range(10, 13)
+    ]
+    assert _reply(history, after=second["next"]) == {"messages": [], "next": 13}
+
+
+def test_age_and_bytes_limits():
+    history = _history(10)
+    room = history.rooms["room"]
+    room.created[:5] = array("I", [0] * 5)
+
+    _compact(history, Retention(default=RetentionPolicy(max_age=60)))
+    assert room.positions.tolist() == [5, 6, 7, 8, 9]
+
+    size = room.message_size(room.locate(8)) + room.message_size(room.locate(9))
+    _compact(history, Retention(default=RetentionPolicy(max_bytes=size)))
+    assert room.positions.tolist() == [8, 9]
+    assert history.size == size
+
+
+def test_author_policy_removes_only_their_messages():
+    history = _history(9, authors=3)
+    retention = Retention(
+        rooms={"other": RetentionPolicy(max_count=0)},
+        authors={"a1": RetentionPolicy(max_count=1)},
+    )
+
+    assert _compact(history, retention) == 2
+    assert _read(history) == [f"word{i % 3} {i}" for i in [0, 2, 3, 5, 6, 7, 8]]
+    assert _read(history, after=4) == [f"word{i % 3} {i}" for i in [5, 6, 7, 8]]
+    found, _ = history.search("room", "", author="a1")
+    assert [position for position, _ in found] == [7]
+    assert history.search("room", "word1 4") == ([], None)
+
+
+def test_streaming_read_is_not_affected_by_compaction():
+    history = _history(20)
+    chunks = history.encode_chunks(16, "room")
+    first = next(chunks)
+
+    _compact(history, Retention(default=RetentionPolicy(max_count=2)))
+
+    reply = json.loads(first + b"".join(chunks))
+    assert [message["content"] for message in reply] == [
+        f"word{i % 3} {i}" for i in range(20)
+    ]
+
+
+def test_compaction_trims_log_and_keeps_positions(tmp_path):
+    path = str(tmp_path / "messages.sqlite")
+    history = _history(10, log=SqliteMessageLog(path))
+    retention = Retention(default=RetentionPolicy(max_count=3))
+    compactor = Compactor(history, retention, batch_size=2, log=SqliteMessageLog(path))
+
+    assert asyncio.run(compactor.compact()) == 7
+    compactor.retention = Retention(authors={"a0": RetentionPolicy(max_count=0)})
+    asyncio.run(compactor.compact())
+    with pytest.raises(ValueError):
+        Compactor(history, retention)  # would share the connection of requests
+
+    restarted = History(SqliteMessageLog(path))
+    restarted.sync()
+    assert len(restarted) == 0
+    restarted.append(Message(author="b", content="new"), "room")
+    assert restarted.rooms["room"].positions.tolist() == [10]
+    assert _read(restarted, after=10) == ["new"]
+
+
+def test_compaction_and_requests_add_logged_messages_once(tmp_path):
+    path = str(tmp_path / "messages.sqlite")
+    history = History(SqliteMessageLog(path))
+    other_process = History(SqliteMessageLog(path))
+    other_process.append(Message(author="b", content="elsewhere"), "room")
+    compactor = Compactor(history, Retention(), log=SqliteMessageLog(path))
+
+    stored = history.log.read_stored_since(0)  # type: ignore
+    asyncio.run(compactor.compact())
+    history.add_stored(stored)  # a request read the same message meanwhile
+    history.sync()
+
+    assert _read(history) == ["elsewhere"]
+
+
+def test_message_log_numbers_old_messages_in_rooms(tmp_path):
+    path = str(tmp_path / "messages.sqlite")
+    db = sqlite3.connect(path)
+    db.execute(
+        """CREATE TABLE messages(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        author VARCHAR(60) NOT NULL,
+        content TEXT NOT NULL,
+        room VARCHAR(60) NOT NULL DEFAULT 'general'
+        )"""
+    )
+    for room in ["a", "b", "a"]:
+        db.execute(
+            "INSERT INTO messages(author, content, room) VALUES('x', 'y', ?)", (room,)
+        )
+    db.commit()
+    db.close()
+
+    log = SqliteMessageLog(path)
+    log.append(Message(author="x", content="z"), "a")
+    stored = log.read_stored_since(0)
+    assert [(m.room, m.position) for m in stored] == [
+        ("a", 0),
+        ("b", 0),
+        ("a", 1),
+        ("a", 2),
+    ]
@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.entities import (
+    JoinRequest,
+    LeaveRequest,
+    Message,
+    ReadRequest,
+    WriteRequest,
+)
+from sec_sem8.history import History
+from sec_sem8.server import ChatServer
+from tests.conftest import EchoWorld, user
+
+
+def test_history_keeps_rooms_apart():
+    history = History()
+    history.append(Message(author="a", content="1"))
+    history.append(Message(author="a", content="2"), "random")
+
+    assert history.messages == [Message(author="a", content="1")]
+    assert history.room("random") == [Message(author="a", content="2")]
+    assert history.room("missing") == []
+    assert len(history) == 2
+
+
+def test_sessions_read_and_write_joined_rooms():
+    async def request(conn: ActiveConnection, body) -> object:
+        await conn.write(body.json())
+        return json.loads(await conn.read())
+
+    async def run():
+        server = ChatServer(EchoWorld(), verbose=False)
+        tcp = await server.start("127.0.0.1", 0)
+        conn = ActiveConnection(user, port=tcp.sockets[0].getsockname()[1])  # type: ignore
+        await conn.connect()
+        await conn.handshake()
+
+        replies = [
+            await request(conn, WriteRequest(content="hello")),
+            await request(conn, WriteRequest(content="x", room="random")),
+            await request(conn, JoinRequest(room="random")),
+            await request(conn, WriteRequest(content="1", room="random")),
+            await request(conn, WriteRequest(content="2", room="random")),
+            await request(conn, ReadRequest(room="random")),
+            await request(conn, ReadRequest(room="random", after=1)),
+            await request(conn, ReadRequest()),
+            await request(conn, LeaveRequest(room="random")),
+            await request(conn, ReadRequest(room="random")),
+        ]
+        await conn.say_goodbye()
+        tcp.close()
+        return replies
+
+    def contents(reply):
+        messages = reply if isinstance(reply, list) else reply["messages"]
+        return [message["content"] for message in messages]
+
+    replies = asyncio.run(run())
+    assert replies[0] == "ack"
+    assert replies[1] == {"error": "not joined to room random"}
+    assert replies[2:5] == ["ack", "ack", "ack"]
+    assert contents(replies[5]) == ["1", "2"]
+    assert contents(replies[6]) == ["2"]
+    assert replies[6]["next"] == 2
+    assert contents(replies[7]) == ["hello"]
+    assert replies[8] == "ack"
+    assert replies[9] == {"error": "not joined to room random"}
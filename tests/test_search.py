@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.connection.transport import memory_connector
+from sec_sem8.entities import Message, SearchRequest, WriteRequest, parse_request
+from sec_sem8.history import History
+from sec_sem8.search import tokenize
+from sec_sem8.server import ChatServer
+from tests.conftest import EchoWorld, user
+
+
+def make_history() -> History:
+    history = History()
+    for i in range(30):
+        author = "alice" if i % 2 else "bob"
+        history.append(Message(author=author, content=f"Hello, World! number {i}"))
+    history.append(Message(author="carol", content="привет мир"), "random")
+    return history
+
+
+def test_tokenize_splits_unicode_words():
+    assert tokenize("Hello, WORLD! hello_there 42") == {
+        "hello",
+        "world",
+        "hello_there",
+        "42",
+    }
+    assert tokenize("Привет,мир") == {"привет", "мир"}
+
+
+def test_search_returns_newest_matches_page_by_page():
+    history = make_history()
+
+    found, cursor = history.search("general", "WORLD hello", limit=12)
+    assert [p for p, _ in found] == list(range(29, 17, -1))
+    assert cursor == 18
+
+    pages = [found]
+    while cursor is not None:
+        found, cursor = history.search("general", "world", limit=12, before=cursor)
+        pages.append(found)
+    assert [len(page) for page in pages] == [12, 12, 6]
+    assert pages[-1][-1] == (0, Message(author="bob", content="Hello, World! number 0"))
+
+
+def test_search_combines_words_and_author():
+    history = make_history()
+
+    found, _ = history.search("general", "number 7", author="alice")
+    assert found == [(7, Message(author="alice", content="Hello, World! number 7"))]
+    assert history.search("general", "number 7", author="bob") == ([], None)
+    assert len(history.search("general", "", author="bob", limit=100)[0]) == 15
+    assert history.search("general", "missing") == ([], None)
+    assert history.search("general", "world", author="nobody") == ([], None)
+    assert history.search("random", "МИР")[0][0][1].author == "carol"
+    assert history.search("empty", "world") == ([], None)
+
+
+def test_search_request_needs_query_or_author():
+    assert parse_request(SearchRequest(query="hi").json()) == SearchRequest(query="hi")
+    assert parse_request('{"id": 5, "query": "  "}') is None
+    assert parse_request('{"id": 5, "author": "bob", "limit": 0}') is None
+
+
+def test_server_answers_search_requests():
+    async def run():
+        server = ChatServer(EchoWorld(), verbose=False)
+        conn = ActiveConnection(user, connector=memory_connector(server.handle_client))  # type: ignore
+        await conn.connect()
+        await conn.handshake()
+        for text in ["deploy failed", "deploy ok", "lunch?"]:
+            await conn.write(WriteRequest(content=text).json())
+            await conn.read()
+        replies = []
+        for request in [
+            SearchRequest(query="deploy", limit=1),
+            SearchRequest(query="deploy", limit=1, before=1),
+            SearchRequest(query="deploy", room="other"),
+        ]:
+            await conn.write(request.json())
+            replies.append(json.loads(await conn.read()))
+        await conn.say_goodbye()
+        return replies
+
+    first, second, other = asyncio.run(run())
+    assert first == {
+        "results": [{"position": 1, "author": "user", "content": "deploy ok"}],
+        "next": 1,
+    }
+    assert second["results"][0]["content"] == "deploy failed"
+    assert second["next"] is None
+    assert other == {"error": "not joined to room other"}
@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.connection.limits import LOCAL, ConnectionLimits, peer_address
+from sec_sem8.connection.transport import memory_connector, open_memory_connection
+from sec_sem8.entities import ReadRequest, WriteRequest
+from sec_sem8.server import ChatServer
+from tests.conftest import EchoWorld, echo_client, user
+
+
+def test_handshake_and_echo_over_memory_pipe():
+    async def run():
+        conn = ActiveConnection(user, connector=memory_connector(echo_client))  # type: ignore
+        await conn.connect()
+        await conn.handshake()
+        replies = []
+        for text in ["hello", "x" * 100_000]:
+            await conn.write(text)
+            replies.append(await conn.read())
+        await conn.say_goodbye()
+        return replies
+
+    assert asyncio.run(run()) == ["hello", "x" * 100_000]
+
+
+def test_chat_server_serves_memory_connections():
+    async def run():
+        server = ChatServer(EchoWorld(), verbose=False)
+        connector = memory_connector(server.handle_client)
+        conns = [ActiveConnection(user, connector=connector) for _ in range(3)]  # type: ignore
+        for conn in conns:
+            await conn.connect()
+            await conn.handshake()
+        for i, conn in enumerate(conns):
+            await conn.write(WriteRequest(content=str(i)).json())
+            await conn.read()
+        await conns[0].write(ReadRequest().json())
+        history = json.loads(await conns[0].read())
+        for conn in conns:
+            await conn.say_goodbye()
+        return history
+
+    assert [m["content"] for m in asyncio.run(run())] == ["0", "1", "2"]
+
+
+def test_memory_peers_are_local_to_limits():
+    async def run():
+        limits = ConnectionLimits(
+            max_connections_per_ip=1,
+            handshake_rate_per_ip=0.001,
+            handshake_burst_per_ip=1,
+        )
+        server = ChatServer(EchoWorld(), verbose=False, limits=limits)
+        connector = memory_connector(server.handle_client)
+        conns = [ActiveConnection(user, connector=connector) for _ in range(5)]  # type: ignore
+        for conn in conns:
+            await conn.connect()
+            await conn.handshake()
+        _, writer = await open_memory_connection(echo_client)
+        address = peer_address(writer)
+        writer.close()
+        for conn in conns:
+            await conn.say_goodbye()
+        return address
+
+    assert asyncio.run(run()) == LOCAL
+
+
+def test_full_reader_pauses_writer():
+    async def run():
+        received = asyncio.Queue()
+
+        async def slow_reader(reader, writer):
+            await asyncio.sleep(0.05)
+            received.put_nowait(await reader.read())
+            writer.close()
+
+        reader, writer = await open_memory_connection(slow_reader, limit=1024)
+        writer.write(b"x" * 10_000)
+        drained = asyncio.create_task(writer.drain())
+        await asyncio.sleep(0.01)
+        paused = not drained.done()
+        await drained
+        writer.close()
+        data = await received.get()
+        return paused, data, await reader.read()
+
+    paused, data, rest = asyncio.run(run())
+    assert paused
+    assert data == b"x" * 10_000
+    assert rest == b""
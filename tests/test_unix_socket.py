@@ -0,0 +1,108 @@
+import asyncio
+import contextlib
+import json
+import socket
+
+import pytest
+
+from sec_sem8.connection.active_connection import ActiveConnection
+from sec_sem8.connection.background_connection import SyncActiveConnection
+from sec_sem8.connection.limits import ConnectionLimits
+from sec_sem8.entities import ReadRequest, WriteRequest
+from sec_sem8.server import ChatServer, bind_unix_socket
+from tests.conftest import EchoWorld, echo_client, serving_in_thread, user
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(socket, "AF_UNIX"), reason="no unix domain sockets"
+)
+
+
+def test_tcp_and_unix_clients_share_server(tmp_path):
+    path = str(tmp_path / "chat.sock")
+
+    async def run():
+        server = ChatServer(EchoWorld(), verbose=False)
+        tcp = await server.start("127.0.0.1", 0)
+        unix = await server.start_unix(path)
+        cache = {}
+        over_unix = ActiveConnection(user, unix_path=path, params_cache=cache)  # type: ignore
+        over_tcp = ActiveConnection(user, port=tcp.sockets[0].getsockname()[1])  # type: ignore
+        for conn in (over_unix, over_tcp):
+            await conn.connect()
+            await conn.handshake()
+
+        await over_unix.write(WriteRequest(content="from unix").json())
+        await over_unix.read()
+        await over_tcp.write(ReadRequest().json())
+        history = json.loads(await over_tcp.read())
+
+        for conn in (over_unix, over_tcp):
+            await conn.say_goodbye()
+        tcp.close()
+        unix.close()
+        return history, cache
+
+    history, cache = asyncio.run(run())
+    assert [m["content"] for m in history] == ["from unix"]
+    assert list(cache) == [(path, 0)]
+
+
+def test_unix_clients_are_not_capped_per_address(tmp_path):
+    path = str(tmp_path / "chat.sock")
+    # default per address limits, the per user rate would stop one test user
+    limits = ConnectionLimits(handshake_rate_per_user=None, max_loop_lag=None)
+    clients = ConnectionLimits().max_connections_per_ip + 22  # type: ignore
+
+    async def run():
+        server = ChatServer(EchoWorld(), verbose=False, limits=limits)
+        unix = await server.start_unix(path)
+        cache: dict = {}
+        connections = []
+        for _ in range(clients):
+            conn = ActiveConnection(user, unix_path=path, params_cache=cache)  # type: ignore
+            await conn.connect()
+            await conn.handshake()
+            connections.append(conn)
+        open_connections = server.limiter.total
+        for conn in connections:
+            await conn.say_goodbye()
+        unix.close()
+        return open_connections
+
+    assert asyncio.run(run()) == clients
+
+
+def test_serve_on_unix_socket_only(tmp_path):
+    path = tmp_path / "chat.sock"
+    path.touch()  # leftover from a crashed server is not a socket, keep it
+    with pytest.raises(OSError):
+        bind_unix_socket(path)
+    path.unlink()
+
+    async def run():
+        sock = bind_unix_socket(path)
+        server = ChatServer(EchoWorld(), verbose=False)
+        serving = asyncio.create_task(server.serve(unix_sock=sock, tcp=False))
+        conn = ActiveConnection(user, unix_path=str(path))  # type: ignore
+        await conn.connect()
+        await conn.handshake()
+        await conn.write(WriteRequest(content="hi").json())
+        reply = await conn.read()
+        await conn.say_goodbye()
+        serving.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await serving
+        return reply
+
+    assert json.loads(asyncio.run(run())) == "ack"
+
+
+def test_sync_connection_over_unix_socket(tmp_path):
+    path = str(tmp_path / "echo.sock")
+    with serving_in_thread(lambda: asyncio.start_unix_server(echo_client, path)):
+        conn = SyncActiveConnection(user, unix_path=path)  # type: ignore
+        conn.connect()
+        conn.handshake()
+        conn.write("ping")
+        assert conn.read() == "ping"
+        conn.say_goodbye()